@@ -1,11 +1,14 @@
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
 import jwt
 from jwt.exceptions import InvalidTokenError
 from pydantic import ValidationError
 from typing import Annotated
+from datetime import datetime, timezone
+import hashlib
 
-from app.core.db import get_session
+from app.core.admission import admission
+from app.core.cache import token_cache, user_cache
 from app.crud import get_public_user
 from app.core.config import settings
 from app.models import UserPublic, TokenPayload
@@ -17,21 +20,35 @@ reusable_oauth2 = OAuth2PasswordBearer(
 
 TokenDep = Annotated[str, Depends(reusable_oauth2)]
 
+def decode_token(token: str) -> TokenPayload:
+    token_hash = hashlib.sha256(token.encode()).hexdigest()
+    token_data = token_cache.get(token_hash)
+    if token_data is not None:
+        return token_data
+    payload = jwt.decode(
+        token, settings.SECURITY_SECRET_KEY, algorithms=[settings.SECURITY_ALGORITHM]
+    )
+    token_data = TokenPayload(**payload)
+    token_cache.set(token_hash, token_data, ttl=(token_data.exp - datetime.now(timezone.utc)).total_seconds())
+    return token_data
+
 async def get_current_user(token: TokenDep) -> UserPublic:
-    print(token)
+    return await get_user_by_token(token)
+
+async def get_user_by_token(token: str) -> UserPublic:
     try:
-        payload = jwt.decode(
-            token, settings.SECURITY_SECRET_KEY, algorithms=[settings.SECURITY_ALGORITHM]
-        )
-        token_data = TokenPayload(**payload)
-    except (InvalidTokenError, ValidationError) as e:
-        print(e)
+        token_data = decode_token(token)
+    except (InvalidTokenError, ValidationError):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Could not validate credentials",
         )
-    async with get_session() as session:
-        user = await get_public_user(int(token_data.sub))
+    user_id = int(token_data.sub)
+    user = user_cache.get(user_id)
+    if user is None:
+        user = await get_public_user(user_id)
+        if user:
+            user_cache.set(user_id, user)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     if not user.is_active:
@@ -39,4 +56,29 @@ async def get_current_user(token: TokenDep) -> UserPublic:
     return user
 
 
-CurrentUser = Annotated[UserPublic, Depends(get_current_user)]
\ No newline at end of file
+CurrentUser = Annotated[UserPublic, Depends(get_current_user)]
+
+
+def _client_address(request: Request) -> str:
+    return request.client.host if request.client else "unknown"
+
+def _rate_limit_key(request: Request) -> str:
+    # the user of a valid token without loading them, anonymous requests by address
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and token:
+        try:
+            return f"user:{decode_token(token).sub}"
+        except (InvalidTokenError, ValidationError):
+            pass
+    return f"client:{_client_address(request)}"
+
+async def admit(request: Request):
+    route_class = "read" if request.method in ("GET", "HEAD") else "write"
+    key = _rate_limit_key(request)
+    await admission.hold(request.scope, route_class, key, settings.RATE_LIMIT_PER_SECOND, settings.RATE_LIMIT_BURST)
+
+async def admit_auth(request: Request):
+    key = f"auth:{_client_address(request)}"
+    await admission.hold(
+        request.scope, "auth", key, settings.AUTH_RATE_LIMIT_PER_SECOND, settings.AUTH_RATE_LIMIT_BURST
+    )
\ No newline at end of file
@@ -1,9 +1,13 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
 
-from app.api.routes import auth, check
+from app.api.deps import admit, admit_auth
+from app.api.routes import analytics, auth, check, feed
 
 
 router = APIRouter()
 
-router.include_router(auth.router, tags=["Authentication"])
-router.include_router(check.router, tags=["Check"])
+router.include_router(auth.router, tags=["Authentication"], dependencies=[Depends(admit_auth)])
+router.include_router(check.router, tags=["Check"], dependencies=[Depends(admit)])
+router.include_router(analytics.router, tags=["Analytics"], dependencies=[Depends(admit)])
+# only rate limited, a stream holds its concurrency slot for as long as it's open
+router.include_router(feed.router, tags=["Check"])
@@ -0,0 +1,143 @@
+from fastapi import APIRouter, HTTPException, Query, status
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+
+from app import crud, models
+from app.api.deps import CurrentUser
+from app.utils import BASKET_SIZE_BUCKETS, get_date_preset_range
+
+router = APIRouter(prefix='/analytics')
+
+RANGE_DESCRIPTION = (
+    "date_from and date_to (inclusive) override the date preset. Days older than the last few months "
+    "are kept per month, a range reaching into them is widened to whole months: date_from and date_to "
+    "in the response tell the range actually covered."
+)
+
+
+def _date_range(
+        date_preset: models.DatePreset, date_from: Optional[date], date_to: Optional[date]
+    ) -> tuple[Optional[date], Optional[date]]:
+    if date_from is None and date_to is None:
+        created_from, _ = get_date_preset_range(date_preset)
+        date_from = created_from and created_from.date()
+    return crud.analytics_range(date_from, date_to)
+
+
+def _basket_stats(rows, date_from: Optional[date], date_to: Optional[date]) -> models.BasketStats:
+    stats = models.BasketStats(date_from=date_from, date_to=date_to)
+    found = {row[0]: row for row in rows}
+    # every bucket, empty ones included, so distributions of different periods line up
+    for index, min_size in enumerate(BASKET_SIZE_BUCKETS):
+        max_size = BASKET_SIZE_BUCKETS[index + 1] - 1 if index + 1 < len(BASKET_SIZE_BUCKETS) else None
+        bucket = models.BasketSizeBucket(min_size=min_size, max_size=max_size)
+        if min_size in found:
+            _, checks_count, positions_count, items, revenue = found[min_size]
+            bucket.checks_count, bucket.revenue = checks_count, revenue
+            stats.checks_count += checks_count
+            stats.positions_count += positions_count
+            stats.items += items
+            stats.revenue += revenue
+        stats.buckets.append(bucket)
+    if stats.checks_count:
+        stats.average_positions = stats.positions_count / stats.checks_count
+        stats.average_items = stats.items / stats.checks_count
+        stats.average_check = stats.revenue / stats.checks_count
+    return stats
+
+
+@router.get(
+    "/products",
+    response_model=models.ProductRanking,
+    summary="Top products",
+    description="The current user's best selling position names by revenue or quantity. " + RANGE_DESCRIPTION
+)
+async def get_top_products(
+    *,
+    date_preset: models.DatePreset = Query(default="all", description="Date preset to rank products over"),
+    date_from: Optional[date] = Query(default=None, description="First day to include"),
+    date_to: Optional[date] = Query(default=None, description="Last day to include"),
+    order_by: models.ProductOrder = Query(default="revenue", description="What products are ranked by"),
+    limit: int = Query(default=10, ge=1, le=100, description="Number of products"),
+    user: CurrentUser
+) -> models.ProductRanking:
+    date_from, date_to = _date_range(date_preset, date_from, date_to)
+    products = await crud.get_users_top_products(user.id, date_from, date_to, order_by, limit)
+    return models.ProductRanking(date_from=date_from, date_to=date_to, products=products)
+
+
+@router.get(
+    "/baskets",
+    response_model=models.BasketStats,
+    summary="Basket sizes",
+    description="Average basket of the current user's checks and their distribution by number of positions. "
+                + RANGE_DESCRIPTION
+)
+async def get_basket_stats(
+    *,
+    date_preset: models.DatePreset = Query(default="all", description="Date preset to compute stats for"),
+    date_from: Optional[date] = Query(default=None, description="First day to include"),
+    date_to: Optional[date] = Query(default=None, description="Last day to include"),
+    user: CurrentUser
+) -> models.BasketStats:
+    date_from, date_to = _date_range(date_preset, date_from, date_to)
+    rows = await crud.get_users_basket_rollups(user.id, date_from, date_to)
+    return _basket_stats(rows, date_from, date_to)
+
+
+@router.get(
+    "/compare",
+    response_model=models.PeriodComparison,
+    summary="Compare two periods",
+    description="Basket stats and top products of a period next to those of a previous one, by default the period "
+                "of the same length right before it. Products are the period's top ones. " + RANGE_DESCRIPTION
+)
+async def compare_periods(
+    *,
+    date_preset: models.DatePreset = Query(default="last_month", description="Date preset of the period"),
+    date_from: Optional[date] = Query(default=None, description="First day of the period"),
+    date_to: Optional[date] = Query(default=None, description="Last day of the period, today by default"),
+    previous_from: Optional[date] = Query(default=None, description="First day of the period compared to"),
+    previous_to: Optional[date] = Query(default=None, description="Last day of the period compared to"),
+    order_by: models.ProductOrder = Query(default="revenue", description="What products are ranked by"),
+    limit: int = Query(default=10, ge=1, le=100, description="Number of products"),
+    user: CurrentUser
+) -> models.PeriodComparison:
+    if date_from is None and date_to is None:
+        created_from, _ = get_date_preset_range(date_preset)
+        date_from = created_from and created_from.date()
+    if date_from is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="The period needs a first day")
+    date_to = date_to or datetime.now(timezone.utc).date()
+    if date_to < date_from:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="date_to is before date_from")
+    if previous_from is None and previous_to is None:
+        previous_to = date_from - timedelta(days=1)
+        previous_from = previous_to - (date_to - date_from)
+    elif previous_from is None or previous_to is None or previous_to < previous_from:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="previous_from and previous_to make no period"
+        )
+
+    date_from, date_to = crud.analytics_range(date_from, date_to)
+    previous_from, previous_to = crud.analytics_range(previous_from, previous_to)
+    products = await crud.get_users_top_products(user.id, date_from, date_to, order_by, limit)
+    baskets = await crud.get_users_basket_rollups(user.id, date_from, date_to)
+    previous_baskets = await crud.get_users_basket_rollups(user.id, previous_from, previous_to)
+    previous_products = await crud.get_users_products(
+        user.id, previous_from, previous_to, [product.name for product in products]
+    )
+
+    comparison = models.PeriodComparison(
+        current=_basket_stats(baskets, date_from, date_to),
+        previous=_basket_stats(previous_baskets, previous_from, previous_to),
+    )
+    for product in products:
+        previous = previous_products.get(product.name)
+        item = models.ProductComparison(name=product.name, quantity=product.quantity, revenue=product.revenue)
+        if previous:
+            item.previous_quantity, item.previous_revenue = previous.quantity, previous.revenue
+            if previous.revenue:
+                item.revenue_change = (product.revenue - previous.revenue) / previous.revenue
+        comparison.products.append(item)
+    return comparison
@@ -23,7 +23,7 @@ async def signup(
     if name in ['wronguser', 'testuser']:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="User already exists")
     
-    hashed_password = get_password_hash(password)
+    hashed_password = await get_password_hash(password)
     user = models.User(name=name, login=login, password=hashed_password)
     await crud.create_user(user) # create user and raise an error if the login already exists
     if not user:
@@ -1,16 +1,32 @@
-from fastapi import APIRouter, status, Body, HTTPException, Depends, Query
+from fastapi import APIRouter, status, Body, HTTPException, Depends, Query, Request, Response, Header
 from typing import Annotated, Optional
-import asyncio
 import uuid
-from fastapi.responses import PlainTextResponse
-from tabulate import tabulate
-import textwrap
+import json
+import csv
+import io
+import tempfile
+from datetime import date
+import asyncpg
+from pydantic import ValidationError
+from sqlalchemy.exc import DBAPIError
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 
 from app import models
 from app.core.config import settings
 from app.api.deps import CurrentUser
+from app.core.cache import receipt_cache
+from app.core.db import mark_written
+from app.core.feed import check_feed
+from app.core.group_commit import check_committer
+from app.core.metrics import HTTP_CONDITIONAL_REQUESTS
+from app.zipstream import ZipStream
 from app import crud, models
-from app.utils import get_receipt_text
+from app.utils import (
+    build_check, build_check_records, decode_cursor, encode_cursor, etag_matches, get_date_preset_range,
+    get_highlights, get_receipt_text, ids_digest, iter_ndjson_lines, make_check_etag, make_page_etag,
+    make_receipt_etag,
+)
 
 router = APIRouter(prefix='/check')
 
@@ -26,105 +42,517 @@ async def create_check(
     check: models.CheckRequest = Body(..., description="The check request containing positions and payment details"), 
     user: CurrentUser
 ):
-    position_totals = [position.price * position.quantity for position in check.positions]
-    total = sum(position_totals)
-    rest = check.payment.amount - total
-
-    if rest < 0:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Payment amount is less than the total price of the check")
-    
-    created_check = models.Check(
-        user_id=user.id,
+    if len(check.positions) > settings.LARGE_CHECK_POSITIONS:
+        return await _create_large_check(user.id, check)
+    try:
+        created_check = build_check(user.id, check)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    # check, positions and payment are written atomically in a single round trip,
+    # in group commit mode that round trip and its commit are shared with concurrent requests
+    if settings.GROUP_COMMIT_ENABLED:
+        created_check = await check_committer.submit(created_check)
+        # written by the committer task, outside this request's context
+        mark_written(user.id)
+    else:
+        created_check = await crud.create_check(created_check)
+    check_feed.publish([(user.id, created_check.id, created_check.created_at)])
+    # validated once here, returning a Response skips FastAPI's second pass over response_model
+    return Response(
+        models.CheckResponse.model_validate(created_check).model_dump_json(),
+        status_code=status.HTTP_201_CREATED,
+        media_type="application/json",
+    )
+
+async def _create_large_check(user_id: int, check: models.CheckRequest) -> Response:
+    # Thousands of positions go through COPY as plain tuples, the response is built from the same tuples
+    try:
+        check_record, position_records, payment_record = build_check_records(user_id, check)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    await crud.copy_checks([check_record], position_records, [payment_record])
+    check_feed.publish([(user_id, check_record[0], check_record[3])])
+
+    check_id, total, rest, created_at, _ = check_record
+    created_check = models.CheckResponse(
+        id=check_id,
+        positions=[
+            models.PositionResponse(name=name, price=price, quantity=quantity, total=position_total)
+            for name, price, quantity, position_total, *_ in position_records
+        ],
+        payment=models.PaymentResponse(type=check.payment.type, amount=check.payment.amount),
         total=total,
         rest=rest,
+        created_at=created_at,
     )
+    return Response(created_check.model_dump_json(), status_code=status.HTTP_201_CREATED, media_type="application/json")
 
-    created_check = await crud.create_check(created_check)
-    positions = [
-        models.Position(
-            **position.model_dump(),
-            check_id=created_check.id,
-            total=position.price * position.quantity
-        )
-        for position in check.positions
-    ]
-    payment = models.Payment(
-        **check.payment.model_dump(),
-        check_id=created_check.id,
-    )
 
-    tasks = [
-        crud.create_positions(positions),
-        crud.create_payment(payment),
-    ]
-    positions, payment = await asyncio.gather(*tasks)
-    check = await crud.get_check_by_id(created_check.id)
-    print(check)
-    # Ensure the response includes all required fields
-    response_model = models.CheckResponse(
-        id=check.id,
-        created_at=check.created_at,
-        total=round(check.total, 2),
-        rest=round(check.rest, 2),
-        positions=check.positions, 
-        payment=check.payment
-    )
-    response = response_model.model_validate(check)
-    
-    return response
+@router.post(
+    "/bulk",
+    summary="Bulk create checks",
+    description="Creates checks from a streamed NDJSON body, one check request per line. "
+                "Returns NDJSON with the result for every line: the id of the created check or the error.",
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {"application/x-ndjson": {"schema": {"type": "string", "format": "binary"}}},
+        }
+    },
+)
+async def bulk_create_checks(request: Request, user: CurrentUser):
+    # Results are spooled to disk once they get big, so memory stays flat whatever the upload size
+    results = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    chunk = []
+    chunk_positions = 0
+
+    async def write(records: list):
+        try:
+            await crud.copy_checks(
+                [check_record for _, check_record, _, _ in records],
+                [position_record for _, _, position_records, _ in records for position_record in position_records],
+                [payment_record for _, _, _, payment_record in records],
+            )
+        except (asyncpg.PostgresError, DBAPIError) as e:
+            # the whole transaction is rolled back, the halves are retried until the bad records are alone
+            if len(records) == 1:
+                results.write(_bulk_result(line=records[0][0], status="error", detail=str(getattr(e, "orig", e))))
+                return
+            middle = len(records) // 2
+            await write(records[:middle])
+            await write(records[middle:])
+            return
+        for line_number, check_record, *_ in records:
+            results.write(_bulk_result(line=line_number, status="created", id=str(check_record[0])))
+        check_feed.publish([(user.id, check_record[0], check_record[3]) for _, check_record, *_ in records])
+
+    async def flush():
+        nonlocal chunk, chunk_positions
+        records, chunk, chunk_positions = chunk, [], 0
+        await write(records)
 
+    async for line_number, line in iter_ndjson_lines(request.stream()):
+        try:
+            check = models.CheckRequest.model_validate_json(line)
+            check_record, position_records, payment_record = build_check_records(user.id, check)
+        except ValidationError as e:
+            results.write(_bulk_result(
+                line=line_number, status="error",
+                detail=e.errors(include_url=False, include_context=False, include_input=False)
+            ))
+            continue
+        except ValueError as e:
+            results.write(_bulk_result(line=line_number, status="error", detail=str(e)))
+            continue
+
+        chunk.append((line_number, check_record, position_records, payment_record))
+        chunk_positions += len(position_records)
+        if len(chunk) >= settings.BULK_INSERT_CHUNK_SIZE or chunk_positions >= settings.BULK_INSERT_CHUNK_POSITIONS:
+            await flush()
+    if chunk:
+        await flush()
+
+    def read_results():
+        with results:
+            results.seek(0)
+            while data := results.read(64 * 1024):
+                yield data
+
+    return StreamingResponse(read_results(), media_type="application/x-ndjson")
+
+def _bulk_result(**result) -> bytes:
+    return json.dumps(result, ensure_ascii=False).encode() + b"\n"
+
+
+# pages change as checks are added, clients keep them but revalidate every time
+PAGE_CACHE_CONTROL = "private, no-cache"
+CHECK_CACHE_CONTROL = f"private, max-age={settings.CHECK_CACHE_MAX_AGE}, immutable"
+# receipts print the user's name, which can change: revalidated every time, kept out of shared caches
+RECEIPT_CACHE_CONTROL = "private, no-cache"
+
+def _not_modified(request: Request, if_none_match: Optional[str], etag: str, cache_control: str) -> Optional[Response]:
+    # 304 when the client's copy is current, conditional requests are counted by route for the 304 ratio
+    if not if_none_match:
+        return None
+    matched = etag_matches(if_none_match, etag)
+    HTTP_CONDITIONAL_REQUESTS.labels(request.scope["route"].path, "not_modified" if matched else "modified").inc()
+    if not matched:
+        return None
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag, "Cache-Control": cache_control})
 
 @router.get(
     "/get-all", 
     response_model=list[models.CheckResponse],
     summary="Retrieve all checks",
-    description="Retrieves all checks for the current user, with optional filters for date, total, and payment type."
+    description="Retrieves all checks for the current user, with optional filters for date, total, and payment type. "
+                "When the page is full, the X-Next-Cursor header holds the cursor of the next page. "
+                "Supports If-None-Match with the returned ETag."
 )
 async def get_all_checks(
     *,
+    request: Request,
+    response: Response,
     date_preset: models.DatePreset = Query(default="all", description="Date preset to filter checks by"),
     total_ge: Optional[float] = Query(default=None, description="Filter checks with total greater than this value"),
     total_le: Optional[float] = Query(default=None, description="Filter checks with total less than this value"),
     payment_type: Optional[models.PaymentType] = Query(default=None, description="Filter checks by payment type"),
-    offset: Optional[int] = Query(default=0, description="Offset for pagination"),
+    offset: Optional[int] = Query(default=0, description="Offset for pagination, ignored when cursor is set"),
     limit: Optional[int] = Query(default=100, description="Limit for pagination"),
+    cursor: Optional[str] = Query(default=None, description="Cursor from the X-Next-Cursor header of the previous page"),
+    if_none_match: Optional[str] = Header(default=None),
     user: CurrentUser
 ) -> list[models.CheckResponse]:
-    checks = await crud.get_all_users_checks(user.id, date_preset, total_ge, total_le, payment_type, offset, limit)
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    if if_none_match:
+        # the ids of the page are enough to tell whether the client's copy is current
+        version = await crud.get_users_checks_version(
+            user.id, date_preset, total_ge, total_le, payment_type, offset, limit, after
+        )
+        if version is not None:
+            not_modified = _not_modified(request, if_none_match, make_page_etag(*version), PAGE_CACHE_CONTROL)
+            if not_modified:
+                return not_modified
+
+    if settings.CHECK_LEAN_READS:
+        # the page comes back as JSON built by Postgres and is sent as is
+        checks_json, count, last, version = await crud.get_all_users_checks_json(
+            user.id, date_preset, total_ge, total_le, payment_type, offset, limit, after
+        )
+        if count == 0:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No checks found")
+        headers = {"ETag": make_page_etag(*version), "Cache-Control": PAGE_CACHE_CONTROL}
+        if count == limit:
+            headers["X-Next-Cursor"] = encode_cursor(*last)
+        return Response(checks_json, media_type="application/json", headers=headers)
+
+    checks = await crud.get_all_users_checks(user.id, date_preset, total_ge, total_le, payment_type, offset, limit, after)
     if len(checks) == 0:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No checks found")
+    if len(checks) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(checks[-1].created_at, checks[-1].id)
+    newest = max(check.created_at for check in checks)
+    response.headers["ETag"] = make_page_etag(ids_digest(check.id for check in checks), newest)
+    response.headers["Cache-Control"] = PAGE_CACHE_CONTROL
     return checks
 
+@router.get(
+    "/search",
+    response_model=list[models.CheckSearchResponse],
+    summary="Search checks by position name",
+    description="Retrieves the current user's checks containing a position whose name matches the query, newest first. "
+                "Matching positions have hit set and the matching parts of their name in highlights. "
+                "Takes the filters of /get-all; when the page is full, the X-Next-Cursor header holds the next page's cursor."
+)
+async def search_checks(
+    *,
+    response: Response,
+    q: str = Query(..., min_length=3, max_length=100, description="Text to look for in position names"),
+    mode: models.SearchMode = Query(default="substring", description="How the name has to match the query"),
+    date_preset: models.DatePreset = Query(default="all", description="Date preset to filter checks by"),
+    total_ge: Optional[float] = Query(default=None, description="Filter checks with total greater than this value"),
+    total_le: Optional[float] = Query(default=None, description="Filter checks with total less than this value"),
+    payment_type: Optional[models.PaymentType] = Query(default=None, description="Filter checks by payment type"),
+    limit: int = Query(default=100, ge=1, le=1000, description="Limit for pagination"),
+    cursor: Optional[str] = Query(default=None, description="Cursor from the X-Next-Cursor header of the previous page"),
+    user: CurrentUser
+) -> list[models.CheckSearchResponse]:
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    found = await crud.search_users_checks(
+        user.id, q, mode, date_preset, total_ge, total_le, payment_type, limit, after
+    )
+    if len(found) == limit:
+        last = found[-1][0]
+        response.headers["X-Next-Cursor"] = encode_cursor(last.created_at, last.id)
+    results = []
+    for check, hits in found:
+        result = models.CheckSearchResponse.model_validate(check)
+        for position, result_position in zip(check.positions, result.positions):
+            if position.id in hits:
+                result_position.hit = True
+                result_position.highlights = get_highlights(position.name, q, mode)
+        results.append(result)
+    return results
+
+EXPORT_CSV_HEADER = [
+    "check_id", "created_at", "check_total", "rest", "payment_type", "payment_amount",
+    "position_name", "position_price", "position_quantity", "position_total",
+]
+
+@router.get(
+    "/export",
+    summary="Export checks",
+    description="Streams all checks of the current user matching the filters as NDJSON (one check per line) "
+                "or CSV (one row per position)."
+)
+async def export_checks(
+    *,
+    format: models.ExportFormat = Query(default="ndjson", description="Export format"),
+    date_preset: models.DatePreset = Query(default="all", description="Date preset to filter checks by"),
+    total_ge: Optional[float] = Query(default=None, description="Filter checks with total greater than this value"),
+    total_le: Optional[float] = Query(default=None, description="Filter checks with total less than this value"),
+    payment_type: Optional[models.PaymentType] = Query(default=None, description="Filter checks by payment type"),
+    user: CurrentUser
+) -> StreamingResponse:
+    batches = crud.stream_users_checks(user.id, date_preset, total_ge, total_le, payment_type)
+
+    async def ndjson_rows():
+        async for checks in batches:
+            yield "".join(
+                models.CheckResponse.model_validate(check).model_dump_json() + "\n" for check in checks
+            )
+
+    async def csv_rows():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_CSV_HEADER)
+        async for checks in batches:
+            for check in checks:
+                for position in check.positions:
+                    writer.writerow([
+                        check.id, check.created_at.isoformat(), check.total, check.rest,
+                        check.payment.type, check.payment.amount,
+                        position.name, position.price, position.quantity, position.total,
+                    ])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+    if format == models.ExportFormat.CSV:
+        return StreamingResponse(
+            csv_rows(),
+            media_type="text/csv",
+            headers={"Content-Disposition": 'attachment; filename="checks.csv"'},
+        )
+    return StreamingResponse(ndjson_rows(), media_type="application/x-ndjson")
+
+def _zip_receipts(archive: ZipStream, checks: list[models.Check]) -> bytes:
+    chunk = []
+    for check in checks:
+        cached = receipt_cache.get(check.id)
+        receipt_text = cached[0] if cached else get_receipt_text(check)
+        name = f"{check.created_at:%Y-%m-%d_%H-%M-%S}_{check.id}.txt"
+        chunk.append(archive.add(name, receipt_text.encode(), check.created_at))
+    return b"".join(chunk)
+
+@router.get(
+    "/export-receipts",
+    summary="Export receipts as a ZIP archive",
+    description="Streams a ZIP archive with the printable text of every receipt of the current user in the period, "
+                "one file per check. date_from and date_to (inclusive) take precedence over date_preset."
+)
+async def export_receipts(
+    *,
+    date_preset: models.DatePreset = Query(default="all", description="Date preset to filter checks by"),
+    date_from: Optional[date] = Query(default=None, description="First day to include"),
+    date_to: Optional[date] = Query(default=None, description="Last day to include"),
+    user: CurrentUser
+) -> StreamingResponse:
+    batches = crud.stream_users_checks(
+        user.id, date_preset, None, None, None, date_from=date_from, date_to=date_to, with_user=True
+    )
+
+    async def archive_chunks():
+        # one chunk per batch of checks, rendering and compression run off the event loop
+        archive = ZipStream()
+        async for checks in batches:
+            yield await run_in_threadpool(_zip_receipts, archive, checks)
+        for chunk in archive.close():
+            yield chunk
+
+    filename = f"receipts_{date_from or date_preset.value}_{date_to or ''}".rstrip("_")
+    return StreamingResponse(
+        archive_chunks(),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}.zip"'},
+    )
+
 @router.get(
     "/get", 
-    response_model=models.CheckResponse,
+    response_model=models.CheckResponse | models.CheckSummaryResponse,
     summary="Retrieve a specific check",
-    description="Retrieves a specific check by its ID for the current user."
+    description="Retrieves a specific check by its ID for the current user. "
+                "With summary set, the positions are left out and only counted, page through them with /positions. "
+                "Supports If-None-Match with the returned ETag."
 )
 async def get_check(
     *,
+    request: Request,
+    response: Response,
     check_id: uuid.UUID = Query(..., description="The UUID of the check to retrieve"),
+    summary: bool = Query(default=False, description="Return the check without its positions"),
+    if_none_match: Optional[str] = Header(default=None),
     user: CurrentUser
-) -> models.CheckResponse:
-    check = await crud.get_check_by_id(check_id)
+) -> models.CheckResponse | models.CheckSummaryResponse:
+    # a check never changes, a client holding its ETag has it, no need to look it up again
+    etag = make_check_etag(check_id)
+    not_modified = _not_modified(request, if_none_match, etag, CHECK_CACHE_CONTROL)
+    if not_modified:
+        return not_modified
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CHECK_CACHE_CONTROL
+
+    if summary:
+        found = await crud.get_check_summary(check_id, user.id)
+        if found is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Check not found")
+        check, positions_count = found
+        return models.CheckSummaryResponse(
+            id=check.id,
+            positions_count=positions_count,
+            payment=models.PaymentResponse.model_validate(check.payment, from_attributes=True),
+            total=check.total,
+            rest=check.rest,
+            created_at=check.created_at,
+        )
+
+    if settings.CHECK_LEAN_READS:
+        check_json = await crud.get_check_json_by_id(check_id, user.id)
+        if check_json is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Check not found")
+        headers = {"ETag": etag, "Cache-Control": CHECK_CACHE_CONTROL}
+        return Response(check_json, media_type="application/json", headers=headers)
+
+    check = await crud.get_check_by_id(check_id, user.id)
     if check is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Check not found")
     return check
 
+@router.get(
+    "/positions",
+    response_model=list[models.PositionResponse],
+    summary="Retrieve positions of a check",
+    description="Retrieves a check's positions in order, a page at a time. "
+                "When the page is full, the X-Next-Cursor header holds the cursor of the next page."
+)
+async def get_check_positions(
+    *,
+    response: Response,
+    check_id: uuid.UUID = Query(..., description="The UUID of the check"),
+    limit: int = Query(default=1000, ge=1, le=10_000, description="Limit for pagination"),
+    cursor: Optional[str] = Query(default=None, description="Cursor from the X-Next-Cursor header of the previous page"),
+    user: CurrentUser
+) -> list[models.PositionResponse]:
+    try:
+        after = int(cursor) if cursor else 0
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+    positions = await crud.get_check_positions(check_id, after, limit, user.id)
+    if positions is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Check not found")
+    if len(positions) == limit:
+        response.headers["X-Next-Cursor"] = str(positions[-1].id)
+    return positions
+
+@router.get(
+    "/stats",
+    response_model=models.CheckStats,
+    summary="Retrieve check statistics",
+    description="Retrieves check counts and revenue of the current user per day and payment type. "
+                "date_from and date_to (inclusive) override the date preset."
+)
+async def get_check_stats(
+    *,
+    date_preset: models.DatePreset = Query(default="all", description="Date preset to compute stats for"),
+    date_from: Optional[date] = Query(default=None, description="First day to include"),
+    date_to: Optional[date] = Query(default=None, description="Last day to include"),
+    user: CurrentUser
+) -> models.CheckStats:
+    if date_from is None and date_to is None:
+        created_from, _ = get_date_preset_range(date_preset)
+        date_from = created_from and created_from.date()
+
+    stats = models.CheckStats(date_from=date_from, date_to=date_to)
+    days = {}
+    for rollup in await crud.get_users_daily_rollups(user.id, date_from, date_to):
+        day = days.get(rollup.day)
+        if day is None:
+            day = days[rollup.day] = models.DailyStats(day=rollup.day)
+            stats.days.append(day)
+        by_type = stats.by_payment_type.setdefault(rollup.payment_type, models.PaymentTypeStats())
+        for item in (stats, day, by_type):
+            item.checks_count += rollup.checks_count
+            item.revenue += rollup.revenue
+        day.by_payment_type[rollup.payment_type] = models.PaymentTypeStats(
+            checks_count=rollup.checks_count, revenue=rollup.revenue
+        )
+    return stats
+
+def _render_receipt(check: models.Check) -> tuple[str, str]:
+    # The rendered text cached together with its ETag, until the check's user changes (crud.update_user)
+    receipt_text = get_receipt_text(check)
+    receipt = (receipt_text, make_receipt_etag(check.id, check.user.updated_at))
+    receipt_cache.set(check.id, receipt, size=len(receipt_text.encode()))
+    return receipt
+
 @router.get(
     "/get-text", 
     response_class=PlainTextResponse,
     summary="Retrieve check text",
-    description="Retrieves the text representation of a check by its ID."
+    description="Retrieves the text representation of a check by its ID. "
+                "Supports If-None-Match with the returned ETag."
 )
 async def get_check_text(
+    request: Request,
     check_id: uuid.UUID = Query(..., description="The UUID of the check to retrieve text for"),
-) -> str:
-    check = await crud.get_check_by_id(check_id)
-    if check is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Check not found")
-    
-    receipt_text = get_receipt_text(check)
-    
-    return receipt_text
+    if_none_match: Optional[str] = Header(default=None),
+) -> Response:
+    receipt = receipt_cache.get(check_id)
+    if receipt is None and if_none_match:
+        # revalidated from the user's updated_at alone, the check and its positions are loaded only when it changed
+        user_updated_at = await crud.get_receipt_version(check_id)
+        if user_updated_at is not None:
+            etag = make_receipt_etag(check_id, user_updated_at)
+            not_modified = _not_modified(request, if_none_match, etag, RECEIPT_CACHE_CONTROL)
+            if not_modified:
+                return not_modified
+            # compared and counted already
+            if_none_match = None
+    if receipt is None:
+        check = await crud.get_check_by_id(check_id)
+        if check is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Check not found")
+        receipt = _render_receipt(check)
+
+    receipt_text, etag = receipt
+    not_modified = _not_modified(request, if_none_match, etag, RECEIPT_CACHE_CONTROL)
+    if not_modified:
+        return not_modified
+    return PlainTextResponse(receipt_text, headers={"ETag": etag, "Cache-Control": RECEIPT_CACHE_CONTROL})
+
+@router.get(
+    "/get-text-batch",
+    response_model=dict[uuid.UUID, Optional[str]],
+    summary="Retrieve texts of many checks",
+    description="Retrieves the text representations of several checks at once. Unknown IDs map to null."
+)
+async def get_checks_texts(
+    check_ids: list[uuid.UUID] = Query(..., description="The UUIDs of the checks to retrieve text for"),
+) -> dict[uuid.UUID, Optional[str]]:
+    if len(check_ids) > settings.RECEIPT_BATCH_MAX_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {settings.RECEIPT_BATCH_MAX_SIZE} checks per request"
+        )
 
+    texts = {}
+    missing = []
+    for check_id in check_ids:
+        receipt = receipt_cache.get(check_id)
+        if receipt is None:
+            missing.append(check_id)
+        texts[check_id] = receipt and receipt[0]
+    if missing:
+        for check in await crud.get_checks_by_ids(missing):
+            texts[check.id] = _render_receipt(check)[0]
+    return texts
@@ -0,0 +1,134 @@
+from fastapi import APIRouter, HTTPException, Header, Query, Request, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import StreamingResponse
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Optional
+import asyncio
+import uuid
+
+from app import crud
+from app.api.deps import get_user_by_token
+from app.core.admission import admission
+from app.core.config import settings
+from app.core.feed import Subscription, check_feed
+from app.models import UserPublic
+from app.utils import decode_cursor, encode_cursor
+
+router = APIRouter(prefix='/check')
+
+STREAM_DESCRIPTION = (
+    "Pushes every check the current user creates from now on, as a WebSocket or as server-sent events. "
+    "With cursor (or Last-Event-ID) the checks created after it are replayed first, a few seconds earlier included, "
+    "so checks can arrive twice: dedupe them by id. A client that falls behind gets a lagged event and is "
+    "disconnected, it reconnects with its last cursor. After a reset event the gap was too large to replay, "
+    "reload with /get-all. The token goes in the Authorization header or, for browsers, in the token parameter."
+)
+
+
+async def _open_stream(authorization: Optional[str], token: Optional[str], cursor: Optional[str]):
+    # The user and the cursor to resume from. The subscription is taken by the stream itself, where it is released:
+    # a response whose client is gone before its body starts never runs the body's cleanup.
+    scheme, _, header_token = (authorization or "").partition(" ")
+    token = header_token if scheme.lower() == "bearer" and header_token else token
+    if not token:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
+    user = await get_user_by_token(token)
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    await admission.check_rate("read", f"user:{user.id}", settings.RATE_LIMIT_PER_SECOND, settings.RATE_LIMIT_BURST)
+    if check_feed.subscribers >= settings.FEED_MAX_SUBSCRIBERS:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many open streams, try again later",
+            headers={"Retry-After": "5"},
+        )
+    return user, after
+
+
+async def _feed_events(
+        user: UserPublic, subscription: Subscription, after: Optional[tuple[datetime, uuid.UUID]]
+    ) -> AsyncIterator[tuple[str, Optional[str], Optional[str]]]:
+    # (event, cursor, check JSON): the replay, then live checks with heartbeats while idle,
+    # until the subscriber is lagged or the replay hits its limit (reset)
+    sent = set()
+    if after is not None:
+        since = (after[0] - timedelta(seconds=settings.FEED_RESUME_OVERLAP_SECONDS), after[1])
+        rows = await crud.get_users_checks_since(user.id, since, settings.FEED_RESUME_LIMIT)
+        if len(rows) == settings.FEED_RESUME_LIMIT:
+            yield "reset", None, None
+            return
+        for created_at, check_id, _, check_json in rows:
+            sent.add(check_id)
+            yield "check", encode_cursor(created_at, check_id), check_json
+
+    while True:
+        try:
+            message = await asyncio.wait_for(subscription.queue.get(), settings.FEED_HEARTBEAT_SECONDS)
+        except asyncio.TimeoutError:
+            yield "heartbeat", None, None
+            continue
+        if message is None or subscription.lagged:
+            yield "lagged", None, None
+            return
+        check_id, cursor, check_json = message
+        if check_id not in sent:
+            yield "check", cursor, check_json
+
+
+@router.get("/stream", summary="Stream new checks", description=STREAM_DESCRIPTION)
+async def stream_checks(
+    request: Request,
+    cursor: Optional[str] = Query(default=None, description="Cursor of the last check received"),
+    token: Optional[str] = Query(default=None, description="Access token, when it can't be sent as a header"),
+    last_event_id: Optional[str] = Header(default=None),
+) -> StreamingResponse:
+    user, after = await _open_stream(request.headers.get("Authorization"), token, cursor or last_event_id)
+
+    async def events():
+        # subscribed before the replay, so nothing created in between is missed
+        subscription = check_feed.subscribe(user.id)
+        try:
+            async for event, event_cursor, check_json in _feed_events(user, subscription, after):
+                if event == "heartbeat":
+                    yield ": heartbeat\n\n"
+                elif event == "check":
+                    yield f"id: {event_cursor}\nevent: check\ndata: {check_json}\n\n"
+                else:
+                    yield f"event: {event}\ndata: {{}}\n\n"
+        finally:
+            check_feed.unsubscribe(subscription)
+
+    # X-Accel-Buffering keeps nginx from holding events back
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(events(), media_type="text/event-stream", headers=headers)
+
+
+@router.websocket("/stream")
+async def stream_checks_websocket(
+    websocket: WebSocket,
+    cursor: Optional[str] = Query(default=None),
+    token: Optional[str] = Query(default=None),
+):
+    try:
+        user, after = await _open_stream(websocket.headers.get("Authorization"), token, cursor)
+    except HTTPException as e:
+        overloaded = e.status_code in (status.HTTP_429_TOO_MANY_REQUESTS, status.HTTP_503_SERVICE_UNAVAILABLE)
+        code = status.WS_1013_TRY_AGAIN_LATER if overloaded else status.WS_1008_POLICY_VIOLATION
+        await websocket.close(code=code, reason=str(e.detail))
+        return
+
+    subscription = check_feed.subscribe(user.id)
+    try:
+        await websocket.accept()
+        async for event, event_cursor, check_json in _feed_events(user, subscription, after):
+            if event == "check":
+                await websocket.send_text(f'{{"type": "check", "cursor": "{event_cursor}", "check": {check_json}}}')
+            else:
+                await websocket.send_text(f'{{"type": "{event}"}}')
+        # the feed only ends lagged or reset, the client reconnects
+        await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER if event == "lagged" else status.WS_1000_NORMAL_CLOSURE)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        check_feed.unsubscribe(subscription)
@@ -0,0 +1,133 @@
+from bisect import bisect_right
+from datetime import date
+from functools import lru_cache
+from pathlib import Path
+from typing import AsyncIterator, Optional, Sequence
+import gzip
+import json
+import os
+import time
+import uuid
+
+from app.core.config import settings
+from app.core.partitions import month_start, partition_suffix
+from app.utils import uuid7_created_at
+
+# Cold storage for the checks of archived monthly partitions.
+# A month is a gzipped NDJSON file, one check per line (CheckResponse fields plus user_id), sorted by id.
+# Every BLOCK_SIZE lines form a separate gzip member, so the file is still a plain .ndjson.gz to any tool.
+# The index next to it has the first id, offset and length of each block, a lookup by id inflates one block.
+
+BLOCK_SIZE = 1000
+
+
+def _paths(month: date) -> tuple[Path, Path]:
+    name = f"checks{partition_suffix(month)}"
+    directory = Path(settings.ARCHIVE_DIR)
+    return directory / f"{name}.ndjson.gz", directory / f"{name}.index.json"
+
+
+# ARCHIVE_DIR's mtime and the finished archives by month, listed again once the directory changes:
+# write_month() resets it, archives written by other processes or containers show in the mtime
+_listing: tuple[Optional[int], dict[date, tuple[Path, Path]]] = (None, {})
+
+
+def _archive_files() -> dict[date, tuple[Path, Path]]:
+    global _listing
+    directory = Path(settings.ARCHIVE_DIR)
+    try:
+        version = directory.stat().st_mtime_ns
+    except FileNotFoundError:
+        return {}
+    listed_version, files = _listing
+    if version != listed_version:
+        files = {}
+        # the index is written last, a month without one is an unfinished archive
+        for path in directory.glob("checks_y*.index.json"):
+            suffix = path.name.removeprefix("checks_y").removesuffix(".index.json")
+            year, month = suffix.split("m")
+            month = date(int(year), int(month), 1)
+            files[month] = _paths(month)
+        # mtimes are coarse, a directory changed within the last second could change again without a new mtime
+        _listing = (version if time.time_ns() - version > 1_000_000_000 else None, files)
+    return files
+
+
+def archived_months() -> list[date]:
+    return sorted(_archive_files())
+
+
+def archived_count(month: date) -> Optional[int]:
+    _, index_path = _paths(month)
+    if not index_path.exists():
+        return None
+    return json.loads(index_path.read_text())["count"]
+
+
+async def write_month(month: date, batches: AsyncIterator[Sequence[str]]) -> int:
+    # Writes the month from batches of JSON lines already sorted by id, returns the number of checks
+    global _listing
+    data_path, index_path = _paths(month)
+    data_path.parent.mkdir(parents=True, exist_ok=True)
+    temporary_path = data_path.with_suffix(".tmp")
+    blocks, block, count = [], [], 0
+
+    with open(temporary_path, "wb") as data:
+        def write_block():
+            offset = data.tell()
+            data.write(gzip.compress("".join(block).encode()))
+            blocks.append([json.loads(block[0])["id"], offset, data.tell() - offset])
+            block.clear()
+
+        async for lines in batches:
+            for line in lines:
+                block.append(line + "\n")
+                count += 1
+                if len(block) == BLOCK_SIZE:
+                    write_block()
+        if block:
+            write_block()
+        data.flush()
+        os.fsync(data.fileno())
+
+    os.replace(temporary_path, data_path)
+    index_path.with_suffix(".tmp").write_text(json.dumps({"count": count, "blocks": blocks}))
+    os.replace(index_path.with_suffix(".tmp"), index_path)
+    _listing = (None, {})
+    return count
+
+
+@lru_cache(maxsize=64)
+def _load_index(month: date) -> tuple[list[uuid.UUID], list[tuple[int, int]]]:
+    # Archives never change once written, their indexes are kept in memory
+    _, index_path = _paths(month)
+    blocks = json.loads(index_path.read_text())["blocks"]
+    return [uuid.UUID(first_id) for first_id, _, _ in blocks], [(offset, length) for _, offset, length in blocks]
+
+
+def find_check(check_id: uuid.UUID) -> Optional[dict]:
+    # The archived check as stored, or None. Blocking file IO, run it in a thread.
+    files = _archive_files()
+    created_at = uuid7_created_at(check_id)
+    if created_at is not None:
+        month = month_start(created_at.date())
+        months = [month] if month in files else []
+    else:
+        months = sorted(files)
+    needle = str(check_id).encode()
+    for month in months:
+        first_ids, blocks = _load_index(month)
+        index = bisect_right(first_ids, check_id) - 1
+        if index < 0:
+            continue
+        offset, length = blocks[index]
+        data_path, _ = files[month]
+        with open(data_path, "rb") as data:
+            data.seek(offset)
+            lines = gzip.decompress(data.read(length)).splitlines()
+        for line in lines:
+            if needle in line:
+                check = json.loads(line)
+                if check["id"] == str(check_id):
+                    return check
+    return None
@@ -0,0 +1,100 @@
+import argparse
+import asyncio
+import json
+import sys
+
+from app import crud
+from app.core.migrations import migrate
+from app.seed import seed
+
+
+async def backfill_rollups(args: argparse.Namespace):
+    await crud.rebuild_daily_rollups()
+    print("Daily rollups rebuilt")
+
+
+async def rebuild_analytics(args: argparse.Namespace):
+    if args.verify:
+        mismatches = await crud.verify_analytics_rollups()
+        for name, count in mismatches.items():
+            print(f"{'ok  ' if not count else 'FAIL'} {name}: {count} mismatching rollups")
+        sys.exit(1 if any(mismatches.values()) else 0)
+    await crud.rebuild_analytics_rollups()
+    print("Product and basket rollups rebuilt")
+
+
+async def migrate_db(args: argparse.Namespace):
+    applied = await migrate()
+    for migration in applied:
+        print(f"Applied migration {migration.version}: {migration.name}")
+    if not applied:
+        print("Database is up to date")
+
+
+async def check_query_plans(args: argparse.Namespace):
+    failed = False
+    for name, plan in (await crud.explain_main_queries()).items():
+        tables = plan["seq_scans"]
+        if tables:
+            failed = True
+            print(f"FAIL {name}: sequential scan on {', '.join(tables)}")
+        else:
+            print(f"ok   {name}: {', '.join(plan['indexes'])}")
+    sys.exit(1 if failed else 0)
+
+
+async def maintain_partitions(args: argparse.Namespace):
+    archived = await crud.maintain_partitions()
+    if archived is None:
+        print("Partition maintenance is already running elsewhere")
+        sys.exit(1)
+    for month, count in archived:
+        print(f"Archived {month:%Y-%m}: {count} checks")
+    print("Partitions are up to date")
+
+
+async def seed_db(args: argparse.Namespace):
+    await migrate()
+    result = await seed(args.users, args.checks, seed=args.seed, days=args.days, chunk_size=args.chunk_size)
+    print(json.dumps(result, indent=2))
+
+
+parser = argparse.ArgumentParser(prog="python -m app.commands", description="Maintenance commands")
+subparsers = parser.add_subparsers(required=True)
+
+parser_backfill_rollups = subparsers.add_parser("backfill-rollups", help="Rebuild the daily check rollups from scratch")
+parser_backfill_rollups.set_defaults(handler=backfill_rollups)
+
+parser_rebuild_analytics = subparsers.add_parser(
+    "rebuild-analytics", help="Rebuild the product and basket rollups from scratch"
+)
+parser_rebuild_analytics.add_argument(
+    "--verify", action="store_true", help="only compare them with the checks, exit 1 on a mismatch"
+)
+parser_rebuild_analytics.set_defaults(handler=rebuild_analytics)
+
+parser_migrate = subparsers.add_parser("migrate", help="Apply pending database migrations")
+parser_migrate.set_defaults(handler=migrate_db)
+
+parser_check_query_plans = subparsers.add_parser(
+    "check-query-plans", help="Fail if any of the main queries can't be served by an index"
+)
+parser_check_query_plans.set_defaults(handler=check_query_plans)
+
+parser_maintain_partitions = subparsers.add_parser(
+    "maintain-partitions", help="Create the coming months' partitions and archive the expired ones"
+)
+parser_maintain_partitions.set_defaults(handler=maintain_partitions)
+
+parser_seed = subparsers.add_parser("seed", help="Fill the database with synthetic users and checks")
+parser_seed.add_argument("--users", type=int, default=1000)
+parser_seed.add_argument("--checks", type=int, default=100_000)
+parser_seed.add_argument("--seed", type=int, default=0, help="random seed, the same seed generates the same data")
+parser_seed.add_argument("--days", type=int, default=365, help="spread checks over this many past days")
+parser_seed.add_argument("--chunk-size", type=int, default=5000, help="checks per COPY transaction")
+parser_seed.set_defaults(handler=seed_db)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    asyncio.run(args.handler(args))
@@ -0,0 +1,167 @@
+from contextlib import AsyncExitStack, asynccontextmanager
+from importlib import import_module
+from typing import AsyncIterator, Protocol
+import asyncio
+import math
+import time
+
+from fastapi import HTTPException, status
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.metrics import ADMISSION_IN_FLIGHT, ADMISSION_QUEUE_DEPTH, ADMISSION_REJECTED
+
+# Admission control in front of the handlers: a token bucket per user (or client address for auth),
+# a concurrency limit per route class, and load shedding once requests queue or the DB pool is saturated.
+# Turned away requests get 429 (their own rate) or 503 (the server's load), both with Retry-After.
+
+
+class RateLimitBackend(Protocol):
+    # Shared token buckets. take() spends a token of key's bucket and returns 0,
+    # or the seconds until one is available, spending nothing
+    async def take(self, key: str, rate: float, burst: int) -> float: ...
+
+
+class MemoryRateLimitBackend:
+    # Buckets of this worker only, for one worker or as a stand-in: with N workers a user gets up to N times the rate.
+    # A bucket left alone long enough to refill is forgotten, it would be full anyway.
+    def __init__(self, maxsize: int = 100_000):
+        self._buckets = TTLCache("rate_limit", maxsize, 60 * 60)
+
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key) or (burst, now)
+        tokens = min(burst, tokens + (now - updated) * rate)
+        if tokens < 1:
+            return (1 - tokens) / rate
+        self._buckets.set(key, (tokens - 1, now), ttl=burst / rate)
+        return 0
+
+
+def load_backend(path: str) -> RateLimitBackend:
+    module, name = path.split(":")
+    return getattr(import_module(module), name)()
+
+
+class PoolWaitAverage:
+    # Exponentially decaying average of DB pool checkout waits, fed by app.core.db.
+    # It decays with time as well, so once shedding stops the checkouts it comes back down on its own.
+    def __init__(self, half_life: float):
+        self.half_life = half_life
+        self.value = 0.0
+        self._updated = time.monotonic()
+
+    def _decay(self, now: float) -> float:
+        return 0.5 ** ((now - self._updated) / self.half_life)
+
+    def observe(self, seconds: float):
+        now = time.monotonic()
+        weight = self._decay(now)
+        # a checkout counts for a tenth of the average, older ones fade with time
+        self.value = self.value * weight + (seconds - self.value * weight) * 0.1
+        self._updated = now
+
+    def get(self) -> float:
+        return self.value * self._decay(time.monotonic())
+
+
+def overloaded(route_class: str, reason: str) -> HTTPException:
+    ADMISSION_REJECTED.labels(route_class, reason).inc()
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="The server is overloaded, try again later",
+        headers={"Retry-After": "1"},
+    )
+
+
+class ConcurrencyLimit:
+    # At most limit requests of a route class at once, up to max_queue more wait for a slot for at most queue_timeout
+    def __init__(self, route_class: str, limit: int, max_queue: int, queue_timeout: float):
+        self.route_class = route_class
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(limit)
+        self._in_flight = ADMISSION_IN_FLIGHT.labels(route_class)
+        self._queue_depth = ADMISSION_QUEUE_DEPTH.labels(route_class)
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        if self._semaphore.locked():
+            if self.waiting >= self.max_queue:
+                raise overloaded(self.route_class, "queue_full")
+            self.waiting += 1
+            self._queue_depth.inc()
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                raise overloaded(self.route_class, "queue_timeout")
+            finally:
+                self.waiting -= 1
+                self._queue_depth.dec()
+        else:
+            await self._semaphore.acquire()
+        self._in_flight.inc()
+        try:
+            yield
+        finally:
+            self._in_flight.dec()
+            self._semaphore.release()
+
+
+class AdmissionController:
+    def __init__(self, backend: RateLimitBackend):
+        self.backend = backend
+        self.pool_wait = PoolWaitAverage(half_life=1.0)
+        self.limits = {
+            route_class: ConcurrencyLimit(route_class, limit, settings.ADMISSION_MAX_QUEUE, settings.ADMISSION_QUEUE_TIMEOUT)
+            for route_class, limit in [
+                ("read", settings.ADMISSION_READ_CONCURRENCY),
+                ("write", settings.ADMISSION_WRITE_CONCURRENCY),
+                ("auth", settings.ADMISSION_AUTH_CONCURRENCY),
+            ]
+        }
+
+    async def check_rate(self, route_class: str, key: str, rate: float, burst: int):
+        if rate <= 0:
+            return
+        retry_after = await self.backend.take(key, rate, burst)
+        if retry_after:
+            ADMISSION_REJECTED.labels(route_class, "rate_limit").inc()
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests, slow down",
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+
+    @asynccontextmanager
+    async def admit(self, route_class: str, key: str, rate: float, burst: int) -> AsyncIterator[None]:
+        await self.check_rate(route_class, key, rate, burst)
+        # writes are never shed for pool pressure, losing them costs more than a slow read
+        if route_class != "write" and self.pool_wait.get() * 1000 > settings.ADMISSION_MAX_POOL_WAIT_MS:
+            raise overloaded(route_class, "pool_wait")
+        async with self.limits[route_class].slot():
+            yield
+
+    async def hold(self, scope: Scope, route_class: str, key: str, rate: float, burst: int):
+        # admit() until the response is sent, through AdmissionMiddleware
+        await scope["admission"].enter_async_context(self.admit(route_class, key, rate, burst))
+
+
+class AdmissionMiddleware:
+    # FastAPI exits dependencies before the response is sent, a streamed body would go out after its slot is freed.
+    # Slots taken with hold() are released here instead, once the response is sent or its client went away.
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        async with AsyncExitStack() as held:
+            scope["admission"] = held
+            await self.app(scope, receive, send)
+
+
+admission = AdmissionController(load_backend(settings.RATE_LIMIT_BACKEND))
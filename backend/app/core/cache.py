@@ -0,0 +1,110 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Hashable, Optional
+import time
+
+from app.core.config import settings
+from app.core.metrics import CACHE_ENTRIES, CACHE_HITS, CACHE_MISSES
+
+
+class TTLCache:
+    # Bounded LRU cache whose entries also expire after a time to live
+    def __init__(self, name: str, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._hits = CACHE_HITS.labels(name)
+        self._misses = CACHE_MISSES.labels(name)
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = Lock()
+        CACHE_ENTRIES.labels(name).set_function(lambda: len(self._data))
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self._misses.inc()
+                return None
+            self._data.move_to_end(key)
+            self._hits.inc()
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+
+class ByteLRUCache:
+    # LRU cache of strings bounded by their total encoded size rather than by entry count
+    def __init__(self, name: str, maxbytes: int):
+        self.maxbytes = maxbytes
+        self.size = 0
+        self._hits = CACHE_HITS.labels(name)
+        self._misses = CACHE_MISSES.labels(name)
+        self._data: OrderedDict[Hashable, tuple[int, Any]] = OrderedDict()
+        self._lock = Lock()
+        CACHE_ENTRIES.labels(name).set_function(lambda: len(self._data))
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self._misses.inc()
+                return None
+            self._data.move_to_end(key)
+            self._hits.inc()
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any, size: int):
+        if size > self.maxbytes:
+            return
+        with self._lock:
+            previous = self._data.pop(key, None)
+            if previous is not None:
+                self.size -= previous[0]
+            self._data[key] = (size, value)
+            self.size += size
+            while self.size > self.maxbytes:
+                _, (evicted_size, _) = self._data.popitem(last=False)
+                self.size -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+
+# validated UserPublic by user id
+user_cache = TTLCache("user", settings.USER_CACHE_SIZE, settings.USER_CACHE_TTL_SECONDS)
+# users who wrote within the read-your-writes window, their reads skip the replicas
+recent_writers = TTLCache("recent_writer", settings.READ_YOUR_WRITES_CACHE_SIZE, settings.READ_YOUR_WRITES_SECONDS)
+# decoded token claims by sha256 of the token, kept until the token expires
+token_cache = TTLCache("token", settings.TOKEN_CACHE_SIZE, settings.TOKEN_CACHE_TTL_SECONDS)
+# rendered receipt text and its ETag by check id
+receipt_cache = ByteLRUCache("receipt", settings.RECEIPT_CACHE_MAX_BYTES)
+
+# NOTIFY channel of changed users, app.core.feed's listener has every worker drop them from its caches
+USERS_CHANNEL = "users_changed"
+
+
+def invalidate_user(user_id: int, name_changed: bool):
+    user_cache.invalidate(user_id)
+    if name_changed:
+        # the user's name is printed on every receipt
+        receipt_cache.clear()
@@ -0,0 +1,100 @@
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipResponder, IdentityResponder
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+import brotli
+
+from app.core.metrics import HTTP_RESPONSE_BYTES
+
+# Response compression negotiated from Accept-Encoding: brotli when the client takes it, else gzip.
+# Bodies under minimum_size go as they are, so do ones with a Content-Encoding or of an already compressed type.
+# Streamed bodies are compressed whatever their size, it isn't known when their first chunk goes out.
+
+# content type prefixes sent untouched, compressing them again only costs CPU on the event loop
+COMPRESSED_CONTENT_TYPES = (
+    "application/zip", "application/gzip", "application/x-gzip", "application/x-brotli", "application/pdf",
+    "image/png", "image/jpeg", "image/gif", "image/webp", "image/avif", "audio/", "video/", "font/woff",
+    "text/event-stream",
+)
+
+
+class SkipCompressedMixin:
+    async def send_with_compression(self, message: Message):
+        await super().send_with_compression(message)
+        if message["type"] == "http.response.start":
+            content_type = Headers(raw=message["headers"]).get("content-type", "")
+            # checked on every body message from now on, the body passes through as it is
+            self.content_type_is_excluded = self.content_type_is_excluded or content_type.startswith(
+                COMPRESSED_CONTENT_TYPES
+            )
+
+
+class PassThroughResponder(SkipCompressedMixin, IdentityResponder):
+    pass
+
+
+class GZipCompressedResponder(SkipCompressedMixin, GZipResponder):
+    pass
+
+
+class BrotliResponder(SkipCompressedMixin, IdentityResponder):
+    content_encoding = "br"
+
+    def __init__(self, app: ASGIApp, minimum_size: int, quality: int):
+        super().__init__(app, minimum_size)
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def apply_compression(self, body: bytes, *, more_body: bool) -> bytes:
+        # streamed bodies are flushed chunk by chunk, a client reading NDJSON gets every line as it is sent
+        compressed = self.compressor.process(body)
+        return compressed + (self.compressor.flush() if more_body else self.compressor.finish())
+
+
+def accepted_encodings(accept_encoding: str) -> set[str]:
+    # codings the client accepts, q=0 means it refuses one
+    encodings = set()
+    for item in accept_encoding.lower().split(","):
+        coding, _, params = item.partition(";")
+        name, _, value = params.partition("=")
+        try:
+            weight = float(value) if name.strip() == "q" else 1.0
+        except ValueError:
+            weight = 1.0
+        if weight > 0:
+            encodings.add(coding.strip())
+    return encodings
+
+
+class CompressionMiddleware:
+    def __init__(self, app: ASGIApp, minimum_size: int, gzip_level: int, brotli_quality: int):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encodings = accepted_encodings(Headers(scope=scope).get("Accept-Encoding", ""))
+        if "br" in encodings:
+            responder = BrotliResponder(self.app, self.minimum_size, self.brotli_quality)
+        elif "gzip" in encodings:
+            responder = GZipCompressedResponder(self.app, self.minimum_size, compresslevel=self.gzip_level)
+        else:
+            responder = PassThroughResponder(self.app, self.minimum_size)
+
+        encoding = "identity"
+
+        async def count_bytes(message: Message):
+            # bytes as they leave, after compression, by the route template like the other HTTP metrics
+            nonlocal encoding
+            if message["type"] == "http.response.start":
+                encoding = Headers(raw=message["headers"]).get("content-encoding", "identity")
+            elif message["type"] == "http.response.body":
+                route = scope.get("route")
+                route = route.path if route else "unmatched"
+                HTTP_RESPONSE_BYTES.labels(route, encoding).inc(len(message.get("body", b"")))
+            await send(message)
+
+        await responder(scope, receive, count_bytes)
@@ -5,7 +5,90 @@ class Settings(BaseSettings):
     SECURITY_SECRET_KEY: str = os.environ.get("SECRET_KEY")
     SECURITY_ACCESS_TOKEN_EXPIRE_SECONDS: int = 12 * 24 * 60 * 60 # 12 days
     SECURITY_ALGORITHM: str = "HS256"
+    SECURITY_BCRYPT_ROUNDS: int = 12 # changing it rehashes passwords on the next successful login
+    SECURITY_HASH_POOL_SIZE: int = os.cpu_count() or 1 # processes hashing and verifying passwords
+    SECURITY_HASH_QUEUE_LIMIT: int = 64 # hash calls in flight before auth requests get 503
 
-    DATABASE_URL: str = f'postgresql://{os.environ.get("POSTGRES_USER")}:{os.environ.get("POSTGRES_PASSWORD")}@db:{os.environ.get("POSTGRES_PORT")}/{os.environ.get("POSTGRES_DB")}'
+    DATABASE_URL: str = f'postgresql://{os.environ.get("POSTGRES_USER")}:{os.environ.get("POSTGRES_PASSWORD")}@{os.environ.get("POSTGRES_HOST", "db")}:{os.environ.get("POSTGRES_PORT")}/{os.environ.get("POSTGRES_DB")}'
+
+    SERVER_HOST: str = "0.0.0.0"
+    SERVER_PORT: int = 8000
+    SERVER_WORKERS: int = 0 # processes started by app.server, 0 for one per available core
+    SERVER_GRACEFUL_TIMEOUT: float = 30 # seconds in-flight requests get to finish on shutdown
+    # comma separated addresses of the reverse proxies whose X-Forwarded-For is believed, empty for none.
+    # Never "*": any client could pick its own address and with it a fresh rate limit bucket
+    SERVER_TRUSTED_PROXIES: str = "127.0.0.1"
+    MIGRATE_ON_STARTUP: bool = True # app.server migrates once before starting workers and turns this off for them
+
+    LOG_LEVEL: str = "INFO"
+    REQUEST_LOG: bool = True # one JSON line per request with its timings and query count
+    SERVER_TIMING: bool = True # Server-Timing header with db, pool wait and app time on every response
+    SLOW_QUERY_MS: float = 100 # statements slower than this are logged with their parameters
+    SLOW_REQUEST_MS: float = 1000 # requests slower than this are logged as warnings
+    N_PLUS_ONE_THRESHOLD: int = 20 # warn when one request issues more statements than this
+
+    DB_POOL_SIZE: int = 10 # persistent connections per worker
+    DB_MAX_OVERFLOW: int = 10 # extra connections opened under load, closed when returned
+    DB_POOL_TIMEOUT: float = 30 # seconds to wait for a connection before failing
+    DB_POOL_PRE_PING: bool = True # check connections on checkout, drops ones killed by the server
+    DB_POOL_RECYCLE: int = 30 * 60 # seconds before a connection is replaced, -1 to never recycle
+    DB_STATEMENT_CACHE_SIZE: int = 100 # prepared statements cached per connection, 0 for pgbouncer
+
+    REPLICA_DATABASE_URLS: list[str] = [] # JSON list of read replicas, read-only queries are spread over them
+    REPLICA_CONNECT_TIMEOUT: float = 2 # seconds before an unreachable replica is given up on
+    REPLICA_RETRY_SECONDS: float = 10 # how long a failed replica is skipped before it's tried again
+    READ_YOUR_WRITES_SECONDS: float = 5 # reads of a user who just wrote go to the primary for this long
+    READ_YOUR_WRITES_CACHE_SIZE: int = 100_000 # users who just wrote, per worker, on top of the last_write cookie
+
+    PARTITION_PREMAKE_MONTHS: int = 3 # monthly check partitions kept created ahead of time
+    PARTITION_MAINTENANCE_INTERVAL_SECONDS: int = 60 * 60 # how often future partitions are created and old ones archived
+    ARCHIVE_AFTER_MONTHS: int = 24 # months of checks kept in the database, older ones go to ARCHIVE_DIR, 0 keeps all
+    ARCHIVE_DIR: str = "archive" # gzipped NDJSON of archived months, still readable by check id
+    PRODUCT_ROLLUP_DAILY_MONTHS: int = 2 # months before the current one with daily product rollups, older are monthly
+
+    RATE_LIMIT_PER_SECOND: float = 50 # requests a user can sustain, 0 turns per-user rate limiting off
+    RATE_LIMIT_BURST: int = 200 # requests a user can make at once after being idle
+    AUTH_RATE_LIMIT_PER_SECOND: float = 2 # sign in and sign up attempts per client address
+    AUTH_RATE_LIMIT_BURST: int = 20
+    RATE_LIMIT_BACKEND: str = "app.core.admission:MemoryRateLimitBackend" # module:class sharing buckets between workers
+    ADMISSION_READ_CONCURRENCY: int = 32 # requests per worker running at once, by route class
+    ADMISSION_WRITE_CONCURRENCY: int = 32
+    ADMISSION_AUTH_CONCURRENCY: int = 16
+    ADMISSION_MAX_QUEUE: int = 64 # requests waiting for a slot, per route class, before new ones get 503
+    ADMISSION_QUEUE_TIMEOUT: float = 2 # seconds a request waits for a slot before it gets 503
+    ADMISSION_MAX_POOL_WAIT_MS: float = 200 # recent average DB pool wait above which reads and auth are shed
+
+    COMPRESSION_MIN_SIZE: int = 1024 # response bodies smaller than this are sent uncompressed
+    COMPRESSION_GZIP_LEVEL: int = 6
+    COMPRESSION_BROTLI_QUALITY: int = 4 # 0-11, higher levels cost far more CPU than they save on JSON
+    CHECK_CACHE_MAX_AGE: int = 365 * 24 * 60 * 60 # seconds clients may keep a check, they never change
+
+    FEED_BACKEND: str = "postgres" # /check/stream and user changes go by LISTEN/NOTIFY, "local" for one worker
+    FEED_QUEUE_SIZE: int = 256 # checks buffered per subscriber before it's cut off as lagged
+    FEED_MAX_SUBSCRIBERS: int = 1000 # open /check/stream connections per worker
+    FEED_HEARTBEAT_SECONDS: float = 15 # idle streams get a heartbeat, which also finds closed connections
+    FEED_RESUME_LIMIT: int = 1000 # checks replayed on reconnect, past that the client has to reload
+    FEED_RESUME_OVERLAP_SECONDS: float = 5 # replay also covers checks committed late, clients dedupe by id
+
+    CHECK_LEAN_READS: bool = True # /check/get and /check/get-all send JSON built by Postgres, skipping the ORM
+
+    BULK_INSERT_CHUNK_SIZE: int = 2000 # checks written per COPY transaction in /check/bulk
+    BULK_INSERT_CHUNK_POSITIONS: int = 100_000 # or fewer checks, once they add up to this many positions
+
+    CHECK_MAX_POSITIONS: int = 100_000 # larger checks are rejected
+    LARGE_CHECK_POSITIONS: int = 1000 # /check/create writes checks with more positions with COPY, skipping the ORM
+
+    GROUP_COMMIT_ENABLED: bool = False # /check/create queues checks and writes them in shared transactions
+    GROUP_COMMIT_MAX_BATCH: int = 100 # checks per group commit transaction
+    GROUP_COMMIT_MAX_LINGER_MS: float = 5 # how long the first queued check waits for others to join its batch
+
+    USER_CACHE_SIZE: int = 10_000 # authenticated users kept in memory, 0 disables the cache
+    # how long other workers may serve a changed user (e.g. deactivated) when FEED_BACKEND is local
+    # or their listener is down, with LISTEN/NOTIFY they drop it as soon as the change commits
+    USER_CACHE_TTL_SECONDS: int = 60
+    TOKEN_CACHE_SIZE: int = 10_000 # decoded tokens kept in memory, 0 disables the cache
+    TOKEN_CACHE_TTL_SECONDS: int = 60 * 60 # upper bound, entries never outlive the token's exp
+    RECEIPT_CACHE_MAX_BYTES: int = 32 * 1024 * 1024 # rendered receipts kept in memory
+    RECEIPT_BATCH_MAX_SIZE: int = 100 # checks per /check/get-text-batch request
 
 settings = Settings()
\ No newline at end of file
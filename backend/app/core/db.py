@@ -1,13 +1,90 @@
 from contextlib import asynccontextmanager
-from sqlmodel import SQLModel
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from contextvars import ContextVar
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, AsyncSession
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from typing import Optional
+import asyncio
+import time
 
+from app.core.admission import admission
+from app.core.cache import recent_writers
 from app.core.config import settings
+from app.core.request_stats import instrument_engine, record_pool_wait
+from app.core.metrics import (
+    DB_POOL_CHECKED_OUT, DB_POOL_CHECKOUT_SECONDS, DB_POOL_OVERFLOW, DB_POOL_SIZE, DB_READS, DB_REPLICA_FAILURES,
+)
 
 DATABASE_URL = settings.DATABASE_URL.replace(
     "postgresql://", "postgresql+asyncpg://"
 )
-engine = create_async_engine(DATABASE_URL)
+REPLICA_DATABASE_URLS = [url.replace("postgresql://", "postgresql+asyncpg://") for url in settings.REPLICA_DATABASE_URLS]
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    # Measures how long checkouts wait for a free connection (or for a new one to be opened)
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            seconds = time.perf_counter() - start
+            DB_POOL_CHECKOUT_SECONDS.observe(seconds)
+            record_pool_wait(seconds)
+            admission.pool_wait.observe(seconds)
+
+
+def create_engine(url: str, **connect_args) -> AsyncEngine:
+    engine = create_async_engine(
+        url,
+        poolclass=TimedQueuePool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        connect_args={
+            # asyncpg's own cache and SQLAlchemy's prepared statement cache on top of it
+            "statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+            "prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+            **connect_args,
+        },
+    )
+    instrument_engine(engine.sync_engine)
+    return engine
+
+
+class ReplicaRouter:
+    # Round-robin over the replicas, a replica that fails to connect is skipped for retry_after seconds
+    def __init__(self, engines: list[AsyncEngine], retry_after: float):
+        self.engines = engines
+        self.retry_after = retry_after
+        self._next = 0
+        self._down_until = [0.0] * len(engines)
+
+    def candidates(self) -> list[AsyncEngine]:
+        # healthy replicas, starting with the one whose turn it is
+        now = time.monotonic()
+        count = len(self.engines)
+        start = self._next
+        self._next = (start + 1) % count if count else 0
+        order = [(start + i) % count for i in range(count)]
+        return [self.engines[i] for i in order if self._down_until[i] <= now]
+
+    def mark_down(self, engine: AsyncEngine):
+        DB_REPLICA_FAILURES.inc()
+        self._down_until[self.engines.index(engine)] = time.monotonic() + self.retry_after
+
+
+engine = create_engine(DATABASE_URL)
+replica_router = ReplicaRouter(
+    [create_engine(url, timeout=settings.REPLICA_CONNECT_TIMEOUT) for url in REPLICA_DATABASE_URLS],
+    settings.REPLICA_RETRY_SECONDS,
+)
+
+DB_POOL_SIZE.set(settings.DB_POOL_SIZE)
+DB_POOL_CHECKED_OUT.set_function(lambda: engine.pool.checkedout())
+DB_POOL_OVERFLOW.set_function(lambda: max(engine.pool.overflow(), 0))
 
 @asynccontextmanager
 async def get_session():
@@ -17,6 +94,73 @@ async def get_session():
         finally:
             await session.close()
 
-async def init_db():
-    async with engine.begin() as conn:
-        await conn.run_sync(SQLModel.metadata.create_all)
\ No newline at end of file
+# The client's last write travels with it, as a cookie or for other clients a header the response also carries,
+# so whichever worker serves its next reads keeps them on the primary. recent_writers only covers this worker.
+LAST_WRITE_COOKIE = "last_write"
+LAST_WRITE_HEADER = "X-Last-Write"
+
+
+class LastWrite:
+    # Per request: when the client last wrote, as it told us or as this request's writes updated it
+    def __init__(self, value: Optional[str] = None):
+        try:
+            written_at = float(value) if value else None
+        except ValueError:
+            written_at = None
+        # a value from the future can only be made up, it would pin the client to the primary for good
+        self.written_at = written_at if written_at is not None and written_at <= time.time() + 1 else None
+        self.changed = False
+
+    def mark(self):
+        self.written_at = time.time()
+        self.changed = True
+
+    def is_recent(self) -> bool:
+        return self.written_at is not None and time.time() - self.written_at < settings.READ_YOUR_WRITES_SECONDS
+
+
+last_write: ContextVar[Optional[LastWrite]] = ContextVar("last_write", default=None)
+
+def mark_written(*user_ids: int):
+    # Pins the users' reads to the primary until the replicas have most likely caught up
+    if replica_router.engines:
+        for user_id in user_ids:
+            recent_writers.set(user_id, True)
+        request_write = last_write.get()
+        if request_write is not None:
+            request_write.mark()
+
+def _reads_own_writes(user_id: Optional[int]) -> bool:
+    request_write = last_write.get()
+    if request_write is not None and request_write.is_recent():
+        return True
+    return user_id is not None and recent_writers.get(user_id) is not None
+
+@asynccontextmanager
+async def get_read_session(user_id: Optional[int] = None):
+    # Session for read-only queries: a healthy replica, or the primary when there is none
+    # or the client is inside its read-your-writes window
+    if not _reads_own_writes(user_id):
+        for replica in replica_router.candidates():
+            session = AsyncSession(replica)
+            try:
+                # connect now so an unreachable replica fails over before any query runs
+                await session.connection()
+            except (DBAPIError, OSError, asyncio.TimeoutError):
+                await session.close()
+                replica_router.mark_down(replica)
+                continue
+            DB_READS.labels("replica").inc()
+            try:
+                yield session
+            finally:
+                await session.close()
+            return
+    DB_READS.labels("primary").inc()
+    async with get_session() as session:
+        yield session
+
+async def dispose_engines():
+    await engine.dispose()
+    for replica in replica_router.engines:
+        await replica.dispose()
\ No newline at end of file
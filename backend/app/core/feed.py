@@ -0,0 +1,206 @@
+from collections import defaultdict
+from datetime import datetime
+from typing import Iterable, Optional
+import asyncio
+import json
+import logging
+import uuid
+
+import asyncpg
+
+from app import crud
+from app.core.cache import USERS_CHANNEL, invalidate_user, receipt_cache, user_cache
+from app.core.config import settings
+from app.core.db import engine
+from app.core.metrics import FEED_LAGGED, FEED_MESSAGES, FEED_SUBSCRIBERS
+from app.core.request_stats import request_stats
+from app.utils import encode_cursor
+
+# Live feed of created checks, pushed to the subscribed user's open /check/stream connections.
+# The create paths publish (user_id, check_id, created_at) events. With the "local" backend they're delivered in
+# process, with "postgres" they go through NOTIFY and every worker, the publisher included, gets them by LISTEN.
+# A worker loads the checks its subscribers want once, in one query, and fans them out.
+# Delivery is at least once: clients dedupe by check id. A subscriber too slow to keep up is cut off
+# as lagged and resumes from its last cursor, so publishers never wait for consumers.
+
+CHANNEL = "checks_created"
+# NOTIFY payloads are limited to 8000 bytes
+MAX_PAYLOAD_BYTES = 7000
+
+logger = logging.getLogger("app.feed")
+
+FeedEvent = tuple[int, uuid.UUID, datetime] # user_id, check_id, created_at
+FeedMessage = tuple[uuid.UUID, str, str] # check_id, cursor, CheckResponse JSON
+
+
+class Subscription:
+    def __init__(self, user_id: int, queue_size: int):
+        self.user_id = user_id
+        self.queue: asyncio.Queue[Optional[FeedMessage]] = asyncio.Queue(queue_size)
+        self.lagged = False
+
+    def offer(self, message: FeedMessage):
+        # never blocks, a full queue means the consumer can't keep up
+        if self.lagged:
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.cut_off()
+
+    def cut_off(self):
+        # the consumer stops at its next message and tells the client to resume from its cursor
+        if not self.lagged:
+            self.lagged = True
+            FEED_LAGGED.inc()
+        if not self.queue.full():
+            self.queue.put_nowait(None)
+
+
+class CheckFeed:
+    def __init__(self, backend: str, queue_size: int):
+        self.backend = backend
+        self.queue_size = queue_size
+        self.subscriptions: dict[int, set[Subscription]] = defaultdict(set)
+        self._events: Optional[asyncio.Queue[list[FeedEvent]]] = None
+        self._notifications: Optional[asyncio.Queue[FeedEvent]] = None
+        self._tasks: list[asyncio.Task] = []
+
+    @property
+    def subscribers(self) -> int:
+        return sum(len(subscriptions) for subscriptions in self.subscriptions.values())
+
+    async def start(self):
+        # the tasks start from the lifespan, their queries must not be counted against any request
+        request_stats.set(None)
+        self._events = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._deliver_forever())]
+        if self.backend == "postgres":
+            self._notifications = asyncio.Queue()
+            self._tasks += [asyncio.create_task(self._listen_forever()), asyncio.create_task(self._notify_forever())]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for subscriptions in self.subscriptions.values():
+            for subscription in subscriptions:
+                subscription.cut_off()
+
+    def publish(self, events: Iterable[FeedEvent]):
+        # Called by the create paths once the checks are committed, returns at once
+        if self._events is None:
+            return
+        if self.backend == "postgres":
+            for event in events:
+                self._notifications.put_nowait(event)
+        else:
+            self._dispatch(list(events))
+
+    def subscribe(self, user_id: int) -> Subscription:
+        subscription = Subscription(user_id, self.queue_size)
+        self.subscriptions[user_id].add(subscription)
+        FEED_SUBSCRIBERS.inc()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscriptions = self.subscriptions.get(subscription.user_id)
+        if subscriptions and subscription in subscriptions:
+            subscriptions.remove(subscription)
+            FEED_SUBSCRIBERS.dec()
+            if not subscriptions:
+                del self.subscriptions[subscription.user_id]
+
+    def _dispatch(self, events: list[FeedEvent]):
+        # only events of users subscribed to this worker are worth loading
+        wanted = [event for event in events if event[0] in self.subscriptions]
+        if wanted:
+            self._events.put_nowait(wanted)
+
+    async def _deliver_forever(self):
+        # one batch at a time, so every subscriber gets checks in the order they were published
+        while True:
+            events = [*await self._events.get()]
+            while not self._events.empty():
+                events += self._events.get_nowait()
+            try:
+                rows = await crud.get_checks_json([check_id for _, check_id, _ in events])
+            except Exception:
+                logger.exception("Loading %d feed checks failed", len(events))
+                self._cut_off_all()
+                continue
+            for created_at, check_id, user_id, check_json in rows:
+                message = (check_id, encode_cursor(created_at, check_id), check_json)
+                for subscription in self.subscriptions.get(user_id, ()):
+                    subscription.offer(message)
+                    FEED_MESSAGES.inc()
+
+    def _cut_off_all(self):
+        # events may have been missed, every client resumes from its cursor
+        for subscriptions in self.subscriptions.values():
+            for subscription in subscriptions:
+                subscription.cut_off()
+
+    async def _notify_forever(self):
+        # NOTIFY off the request path, as many events per notification as fit in its payload
+        while True:
+            events = [await self._notifications.get()]
+            while not self._notifications.empty():
+                events.append(self._notifications.get_nowait())
+            payloads, payload = [], []
+            for user_id, check_id, created_at in events:
+                payload.append([user_id, str(check_id), created_at.isoformat()])
+                if len(payload) * 80 >= MAX_PAYLOAD_BYTES:
+                    payloads.append(payload)
+                    payload = []
+            if payload:
+                payloads.append(payload)
+            try:
+                async with engine.connect() as connection:
+                    for payload in payloads:
+                        await connection.exec_driver_sql("SELECT pg_notify($1, $2)", (CHANNEL, json.dumps(payload)))
+                    await connection.commit()
+            except Exception:
+                logger.exception("Notifying %d feed events failed", len(events))
+
+    def _on_notification(self, connection, pid, channel, payload: str):
+        self._dispatch([
+            (user_id, uuid.UUID(check_id), datetime.fromisoformat(created_at))
+            for user_id, check_id, created_at in json.loads(payload)
+        ])
+
+    def _on_user_changed(self, connection, pid, channel, payload: str):
+        user_id, name_changed = json.loads(payload)
+        invalidate_user(user_id, name_changed)
+
+    async def _listen_forever(self):
+        # a dedicated connection outside the pool, reopened whenever it is lost.
+        # It also carries crud.update_user's changes, so no worker keeps serving a stale (e.g. deactivated) user.
+        while True:
+            try:
+                connection = await asyncpg.connect(settings.DATABASE_URL)
+            except (OSError, asyncpg.PostgresError):
+                logger.warning("Feed listener can't connect, retrying", exc_info=True)
+                await asyncio.sleep(1)
+                continue
+            closed = asyncio.Event()
+            connection.add_termination_listener(lambda _: closed.set())
+            try:
+                await connection.add_listener(CHANNEL, self._on_notification)
+                await connection.add_listener(USERS_CHANNEL, self._on_user_changed)
+                # notifications sent while the listener was down are lost
+                self._cut_off_all()
+                user_cache.clear()
+                receipt_cache.clear()
+                await closed.wait()
+                logger.warning("Feed listener connection lost, reconnecting")
+            except asyncpg.PostgresError:
+                logger.warning("Feed listener failed, reconnecting", exc_info=True)
+            finally:
+                if not connection.is_closed():
+                    await connection.close()
+            await asyncio.sleep(1)
+
+
+check_feed = CheckFeed(settings.FEED_BACKEND, settings.FEED_QUEUE_SIZE)
@@ -0,0 +1,106 @@
+from typing import Any, Awaitable, Callable, Optional
+import asyncio
+import time
+
+from app import crud
+from app.core.config import settings
+from app.core.db import last_write
+from app.core.metrics import GROUP_COMMIT_BATCH_SIZE, GROUP_COMMIT_WAIT_SECONDS
+from app.core.request_stats import request_stats
+
+# Put in the queue by stop(), the background task returns when it gets to it
+STOP = object()
+
+
+class GroupCommitter:
+    # Coalesces concurrent writes into batches, written by a single background task.
+    # A batch is flushed once it holds max_batch items or its first item has waited max_linger seconds,
+    # so under burst load many requests share one transaction and one commit instead of paying for their own.
+    def __init__(self, flush: Callable[[list], Awaitable[list]], max_batch: int, max_linger: float):
+        self.flush = flush
+        self.max_batch = max_batch
+        self.max_linger = max_linger
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def submit(self, item: Any) -> Any:
+        # Resolves to what flush returned for this item, or raises what writing it alone raised
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future, time.monotonic()))
+        return await future
+
+    async def _run(self):
+        # the task was created from some request's context, its writes must not be counted against that request
+        # nor mark that request as having written, the submitting requests mark themselves
+        request_stats.set(None)
+        last_write.set(None)
+        stopping = False
+        while not stopping:
+            entry = await self._queue.get()
+            if entry is STOP:
+                return
+            batch = [entry]
+            deadline = time.monotonic() + self.max_linger
+            while len(batch) < self.max_batch and not stopping:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    entry = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                stopping = entry is STOP
+                if not stopping:
+                    batch.append(entry)
+            # take whatever else is already waiting, it costs nothing to include
+            while len(batch) < self.max_batch and not stopping and not self._queue.empty():
+                entry = self._queue.get_nowait()
+                stopping = entry is STOP
+                if not stopping:
+                    batch.append(entry)
+            await self._write(batch)
+
+    async def _write(self, batch: list):
+        now = time.monotonic()
+        for _, _, queued_at in batch:
+            GROUP_COMMIT_WAIT_SECONDS.observe(now - queued_at)
+        GROUP_COMMIT_BATCH_SIZE.observe(len(batch))
+        try:
+            results = await self.flush([item for item, _, _ in batch])
+        except Exception as e:
+            if len(batch) > 1:
+                # one bad item must not fail the others, retry them one by one so only it gets the error
+                for entry in batch:
+                    await self._write([entry])
+                return
+            results = [e]
+        for (_, future, _), result in zip(batch, results):
+            # the caller may have gone away, e.g. the client disconnected
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def stop(self):
+        # Writes what is still queued, then stops the background task.
+        # The task is never cancelled: a batch it is writing is finished and its callers get their results.
+        if self._task is None:
+            return
+        if not self._task.done():
+            # queued behind every item submitted so far, the task stops once it has written them
+            await self._queue.put(STOP)
+            await self._task
+        self._task = None
+        # submitted while it was stopping
+        while not self._queue.empty():
+            batch = [self._queue.get_nowait() for _ in range(min(self.max_batch, self._queue.qsize()))]
+            await self._write(batch)
+
+check_committer = GroupCommitter(
+    crud.create_checks, settings.GROUP_COMMIT_MAX_BATCH, settings.GROUP_COMMIT_MAX_LINGER_MS / 1000
+)
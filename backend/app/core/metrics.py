@@ -0,0 +1,68 @@
+from functools import wraps
+from prometheus_client import Counter, Gauge, Histogram
+
+APP_STARTUP_SECONDS = Gauge("app_startup_seconds", "Time from importing app.main to serving, per worker")
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_seconds", "HTTP request latency by route", ["method", "route", "status"]
+)
+HTTP_RESPONSE_BYTES = Counter(
+    "http_response_bytes", "Response body bytes sent, after compression", ["route", "encoding"]
+)
+HTTP_CONDITIONAL_REQUESTS = Counter(
+    "http_conditional_requests", "Requests with If-None-Match, by whether they got 304", ["route", "result"]
+)
+HTTP_REQUEST_QUERIES = Histogram(
+    "http_request_queries", "SQL statements issued per request", ["route"],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+
+DB_QUERY_SECONDS = Histogram(
+    "db_query_seconds", "Latency of crud functions, including pool checkout", ["function"]
+)
+DB_POOL_CHECKOUT_SECONDS = Histogram(
+    "db_pool_checkout_seconds", "Time spent waiting for a connection from the pool",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+DB_POOL_SIZE = Gauge("db_pool_size", "Configured number of persistent pool connections")
+DB_POOL_CHECKED_OUT = Gauge("db_pool_checked_out", "Connections currently checked out of the pool")
+DB_POOL_OVERFLOW = Gauge("db_pool_overflow", "Overflow connections currently open beyond the pool size")
+DB_READS = Counter("db_reads", "Read-only sessions by the database they were routed to", ["target"])
+DB_REPLICA_FAILURES = Counter("db_replica_failures", "Replica connection failures, each takes the replica out for a while")
+
+CACHE_HITS = Counter("cache_hits", "In-process cache hits", ["cache"])
+CACHE_MISSES = Counter("cache_misses", "In-process cache misses", ["cache"])
+CACHE_ENTRIES = Gauge("cache_entries", "Entries currently held by an in-process cache", ["cache"])
+
+PASSWORD_HASH_QUEUE_DEPTH = Gauge("password_hash_queue_depth", "Password hash calls in flight or waiting for the pool")
+PASSWORD_HASH_SECONDS = Histogram(
+    "password_hash_seconds", "Password hash and verify latency, including the wait for the pool",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+PASSWORD_HASH_REJECTED = Counter("password_hash_rejected", "Password hash calls rejected because the queue was full")
+ADMISSION_IN_FLIGHT = Gauge("admission_in_flight", "Requests holding an admission slot", ["route_class"])
+ADMISSION_QUEUE_DEPTH = Gauge("admission_queue_depth", "Requests waiting for an admission slot", ["route_class"])
+ADMISSION_REJECTED = Counter(
+    "admission_rejected", "Requests turned away by admission control", ["route_class", "reason"]
+)
+FEED_SUBSCRIBERS = Gauge("feed_subscribers", "Open /check/stream connections")
+FEED_MESSAGES = Counter("feed_messages", "Checks pushed to /check/stream subscribers")
+FEED_LAGGED = Counter("feed_lagged", "Subscribers cut off for falling behind, they resume from their cursor")
+GROUP_COMMIT_BATCH_SIZE = Histogram(
+    "group_commit_batch_size", "Checks written per group commit transaction",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500),
+)
+GROUP_COMMIT_WAIT_SECONDS = Histogram(
+    "group_commit_wait_seconds", "Time a check waits in the group commit queue before its batch is flushed",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25),
+)
+
+
+def observe_query(fn):
+    # Records the latency of an async crud function under its name
+    histogram = DB_QUERY_SECONDS.labels(fn.__name__)
+
+    @wraps(fn)
+    async def wrapper(*args, **kwargs):
+        with histogram.time():
+            return await fn(*args, **kwargs)
+    return wrapper
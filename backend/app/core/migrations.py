@@ -0,0 +1,309 @@
+from typing import NamedTuple, Optional
+from datetime import datetime, timezone
+import re
+from sqlalchemy import text
+
+from app.core.db import engine
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    statements: list[str]
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction, such migrations run statement by statement
+    transactional: bool = True
+
+
+# Append only: a migration that has been applied somewhere must never change.
+# The initial schema uses IF NOT EXISTS so databases created by the old create_all are adopted as is.
+MIGRATIONS = [
+    Migration(1, "initial schema", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id SERIAL NOT NULL,
+            name VARCHAR NOT NULL,
+            login VARCHAR NOT NULL,
+            password VARCHAR NOT NULL,
+            is_active BOOLEAN NOT NULL,
+            created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            updated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            PRIMARY KEY (id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS checks (
+            id UUID NOT NULL,
+            total FLOAT NOT NULL,
+            rest FLOAT NOT NULL,
+            created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            user_id INTEGER NOT NULL,
+            PRIMARY KEY (id),
+            FOREIGN KEY(user_id) REFERENCES users (id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS positions (
+            name VARCHAR NOT NULL,
+            price FLOAT NOT NULL,
+            quantity INTEGER NOT NULL,
+            id SERIAL NOT NULL,
+            total FLOAT NOT NULL,
+            check_id UUID NOT NULL,
+            PRIMARY KEY (id),
+            FOREIGN KEY(check_id) REFERENCES checks (id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS payments (
+            type VARCHAR NOT NULL,
+            amount FLOAT NOT NULL,
+            id SERIAL NOT NULL,
+            check_id UUID NOT NULL,
+            PRIMARY KEY (id),
+            FOREIGN KEY(check_id) REFERENCES checks (id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS check_daily_rollups (
+            user_id INTEGER NOT NULL,
+            day DATE NOT NULL,
+            payment_type VARCHAR NOT NULL,
+            checks_count INTEGER NOT NULL,
+            revenue FLOAT NOT NULL,
+            PRIMARY KEY (user_id, day, payment_type),
+            FOREIGN KEY(user_id) REFERENCES users (id)
+        )
+        """,
+    ]),
+    Migration(2, "check tables indexes", [
+        "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ux_users_login ON users (login)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_checks_user_id_created_at_id ON checks (user_id, created_at, id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_checks_created_at ON checks (created_at)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_positions_check_id ON positions (check_id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_payments_check_id ON payments (check_id)",
+    ], transactional=False),
+    Migration(3, "position name search index", [
+        # pg_trgm is a trusted extension, the database owner can create it
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_positions_name_trgm ON positions USING gin (name gin_trgm_ops)",
+    ], transactional=False),
+    # Monthly range partitions: checks by created_at, positions and payments by their check's created_at so a month
+    # of checks and everything hanging off it can be detached and archived together (see app.archive).
+    # Keys and unique constraints of a partitioned table must include the partition key, hence the composite ones.
+    # Rows are copied in one transaction, the tables are locked for the duration.
+    Migration(4, "monthly partitions", [
+        "ALTER TABLE positions RENAME TO positions_unpartitioned",
+        "ALTER TABLE payments RENAME TO payments_unpartitioned",
+        "ALTER TABLE checks RENAME TO checks_unpartitioned",
+        # the id sequences carry over, unowned so dropping the old tables keeps them
+        "ALTER SEQUENCE positions_id_seq OWNED BY NONE",
+        "ALTER SEQUENCE payments_id_seq OWNED BY NONE",
+        """
+        CREATE TABLE checks (
+            id UUID NOT NULL,
+            total FLOAT NOT NULL,
+            rest FLOAT NOT NULL,
+            created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            user_id INTEGER NOT NULL
+        ) PARTITION BY RANGE (created_at)
+        """,
+        """
+        CREATE TABLE positions (
+            name VARCHAR NOT NULL,
+            price FLOAT NOT NULL,
+            quantity INTEGER NOT NULL,
+            id INTEGER NOT NULL DEFAULT nextval('positions_id_seq'),
+            total FLOAT NOT NULL,
+            check_id UUID NOT NULL,
+            check_created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL
+        ) PARTITION BY RANGE (check_created_at)
+        """,
+        """
+        CREATE TABLE payments (
+            type VARCHAR NOT NULL,
+            amount FLOAT NOT NULL,
+            id INTEGER NOT NULL DEFAULT nextval('payments_id_seq'),
+            check_id UUID NOT NULL,
+            check_created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL
+        ) PARTITION BY RANGE (check_created_at)
+        """,
+        "ALTER SEQUENCE positions_id_seq OWNED BY positions.id",
+        "ALTER SEQUENCE payments_id_seq OWNED BY payments.id",
+        # a partition per month from the oldest check to three months ahead, named like app.core.partitions does
+        """
+        DO $$
+        DECLARE
+            partition_month DATE := date_trunc('month', coalesce((SELECT min(created_at) FROM checks_unpartitioned), now()));
+            parent TEXT;
+        BEGIN
+            WHILE partition_month <= date_trunc('month', now()) + interval '3 months' LOOP
+                FOREACH parent IN ARRAY ARRAY['checks', 'positions', 'payments'] LOOP
+                    EXECUTE format(
+                        'CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                        parent || to_char(partition_month, '"_y"YYYY"m"MM'), parent,
+                        partition_month, partition_month + interval '1 month'
+                    );
+                END LOOP;
+                partition_month := partition_month + interval '1 month';
+            END LOOP;
+        END
+        $$
+        """,
+        "INSERT INTO checks (id, total, rest, created_at, user_id) SELECT id, total, rest, created_at, user_id FROM checks_unpartitioned",
+        """
+        INSERT INTO positions (name, price, quantity, id, total, check_id, check_created_at)
+        SELECT p.name, p.price, p.quantity, p.id, p.total, p.check_id, c.created_at
+        FROM positions_unpartitioned p JOIN checks_unpartitioned c ON c.id = p.check_id
+        """,
+        """
+        INSERT INTO payments (type, amount, id, check_id, check_created_at)
+        SELECT p.type, p.amount, p.id, p.check_id, c.created_at
+        FROM payments_unpartitioned p JOIN checks_unpartitioned c ON c.id = p.check_id
+        """,
+        "DROP TABLE positions_unpartitioned, payments_unpartitioned, checks_unpartitioned",
+        # keys and indexes are built after the copy, on the parents so every partition, present and future, gets them
+        "ALTER TABLE checks ADD PRIMARY KEY (id, created_at)",
+        "ALTER TABLE checks ADD FOREIGN KEY (user_id) REFERENCES users (id)",
+        "ALTER TABLE positions ADD PRIMARY KEY (id, check_created_at)",
+        "ALTER TABLE positions ADD FOREIGN KEY (check_id, check_created_at) REFERENCES checks (id, created_at)",
+        "ALTER TABLE payments ADD PRIMARY KEY (id, check_created_at)",
+        "ALTER TABLE payments ADD FOREIGN KEY (check_id, check_created_at) REFERENCES checks (id, created_at)",
+        "CREATE INDEX ix_checks_user_id_created_at_id ON checks (user_id, created_at, id)",
+        "CREATE INDEX ix_checks_created_at ON checks (created_at)",
+        "CREATE INDEX ix_positions_check_id ON positions (check_id)",
+        "CREATE INDEX ix_payments_check_id ON payments (check_id)",
+        "CREATE INDEX ix_positions_name_trgm ON positions USING gin (name gin_trgm_ops)",
+    ]),
+    # Pages of a check's positions in id order straight from the index. It replaces the check_id one.
+    # CONCURRENTLY isn't available on partitioned tables, writes to positions wait for the build.
+    Migration(5, "positions by check id and id", [
+        "CREATE INDEX IF NOT EXISTS ix_positions_check_id_id ON positions (check_id, id)",
+        "DROP INDEX IF EXISTS ix_positions_check_id",
+    ]),
+    # Empty until `python -m app.commands rebuild-analytics` fills them from the existing checks
+    Migration(6, "product and basket rollups", [
+        """
+        CREATE TABLE IF NOT EXISTS product_daily_rollups (
+            user_id INTEGER NOT NULL,
+            day DATE NOT NULL,
+            name VARCHAR NOT NULL,
+            quantity INTEGER NOT NULL,
+            revenue FLOAT NOT NULL,
+            positions_count INTEGER NOT NULL,
+            PRIMARY KEY (user_id, day, name),
+            FOREIGN KEY(user_id) REFERENCES users (id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS product_monthly_rollups (
+            user_id INTEGER NOT NULL,
+            month DATE NOT NULL,
+            name VARCHAR NOT NULL,
+            quantity INTEGER NOT NULL,
+            revenue FLOAT NOT NULL,
+            positions_count INTEGER NOT NULL,
+            PRIMARY KEY (user_id, month, name),
+            FOREIGN KEY(user_id) REFERENCES users (id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS basket_daily_rollups (
+            user_id INTEGER NOT NULL,
+            day DATE NOT NULL,
+            basket_size INTEGER NOT NULL,
+            checks_count INTEGER NOT NULL,
+            positions_count INTEGER NOT NULL,
+            items INTEGER NOT NULL,
+            revenue FLOAT NOT NULL,
+            PRIMARY KEY (user_id, day, basket_size),
+            FOREIGN KEY(user_id) REFERENCES users (id)
+        )
+        """,
+    ]),
+]
+
+
+async def get_applied_versions(connection) -> set[int]:
+    await connection.execute(text(
+        """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER NOT NULL PRIMARY KEY,
+            name VARCHAR NOT NULL,
+            applied_at TIMESTAMP WITHOUT TIME ZONE NOT NULL
+        )
+        """
+    ))
+    result = await connection.execute(text("SELECT version FROM schema_migrations"))
+    return set(result.scalars().all())
+
+
+# the index built by a non-transactional migration's statement
+CONCURRENT_INDEX = re.compile(
+    r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)", re.IGNORECASE
+)
+
+
+def concurrent_index_name(statement: str) -> Optional[str]:
+    match = CONCURRENT_INDEX.search(statement)
+    return match.group(1) if match else None
+
+
+async def is_invalid_index(connection, name: str) -> bool:
+    result = await connection.execute(
+        text("SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"), {"name": name}
+    )
+    return bool(result.scalar())
+
+
+async def drop_invalid_index(connection, name: str):
+    # A failed CREATE INDEX CONCURRENTLY leaves an INVALID index behind, which IF NOT EXISTS would take as built
+    if await is_invalid_index(connection, name):
+        await connection.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"'))
+
+
+async def apply_migration(migration: Migration):
+    record = text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:version, :name, :applied_at)")
+    params = {
+        "version": migration.version,
+        "name": migration.name,
+        "applied_at": datetime.now(timezone.utc).replace(tzinfo=None),
+    }
+    if migration.transactional:
+        async with engine.begin() as connection:
+            for statement in migration.statements:
+                await connection.execute(text(statement))
+            await connection.execute(record, params)
+    else:
+        # every statement must be idempotent, a failure halfway is retried from the start
+        async with engine.connect() as connection:
+            connection = await connection.execution_options(isolation_level="AUTOCOMMIT")
+            for statement in migration.statements:
+                index = concurrent_index_name(statement)
+                if index:
+                    await drop_invalid_index(connection, index)
+                await connection.execute(text(statement))
+                if index and await is_invalid_index(connection, index):
+                    raise RuntimeError(f"Index {index} of migration {migration.version} was left invalid")
+            await connection.execute(record, params)
+
+
+# pg_advisory_lock key, any constant shared by every process that migrates this database
+MIGRATION_LOCK_KEY = 0x636865636B626F78
+
+
+async def migrate() -> list[Migration]:
+    # Applies pending migrations in version order and returns them.
+    # Concurrent callers (workers, containers) queue on an advisory lock, the first applies, the rest find nothing to do.
+    async with engine.connect() as lock_connection:
+        lock_connection = await lock_connection.execution_options(isolation_level="AUTOCOMMIT")
+        await lock_connection.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        try:
+            async with engine.begin() as connection:
+                applied = await get_applied_versions(connection)
+
+            pending = [migration for migration in sorted(MIGRATIONS) if migration.version not in applied]
+            for migration in pending:
+                await apply_migration(migration)
+            return pending
+        finally:
+            await lock_connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
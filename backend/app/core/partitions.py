@@ -0,0 +1,110 @@
+from contextlib import asynccontextmanager
+from datetime import date
+from typing import AsyncIterator, Optional
+import re
+
+from sqlalchemy import text
+
+from app.core.db import engine
+
+# Monthly range partitions of checks, positions and payments (created by migration 4).
+# Each month has three partitions with the same bounds and suffix: checks_y2025m05, positions_y2025m05, ...
+
+PARTITIONED_TABLES = ["checks", "positions", "payments"]
+PARTITION_NAME = re.compile(r"^checks_y(\d{4})m(\d{2})$")
+# pg_try_advisory_lock key for partition maintenance, so only one worker does it at a time
+MAINTENANCE_LOCK_KEY = 0x636865636B707274
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_suffix(month: date) -> str:
+    return f"_y{month.year:04d}m{month.month:02d}"
+
+
+async def ensure_partitions(start: date, end: date):
+    # Creates the missing monthly partitions covering start..end (both inclusive)
+    month = month_start(start)
+    async with engine.begin() as connection:
+        # attaching a partition locks the parent, better to fail and retry later than to queue behind long queries
+        await connection.execute(text("SET LOCAL lock_timeout = '5s'"))
+        while month <= end:
+            for table in PARTITIONED_TABLES:
+                await connection.execute(text(
+                    f"CREATE TABLE IF NOT EXISTS {table}{partition_suffix(month)} PARTITION OF {table} "
+                    f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+                ))
+            month = add_months(month, 1)
+
+
+@asynccontextmanager
+async def maintenance_lock() -> AsyncIterator[bool]:
+    # Whether this process got to do the partition maintenance, only one process at a time does it
+    async with engine.connect() as lock_connection:
+        lock_connection = await lock_connection.execution_options(isolation_level="AUTOCOMMIT")
+        result = await lock_connection.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": MAINTENANCE_LOCK_KEY})
+        acquired = result.scalar()
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                await lock_connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MAINTENANCE_LOCK_KEY})
+
+
+async def get_partition_months(attached: Optional[bool] = None) -> list[date]:
+    # Months that have a checks partition table, attached to checks or left detached by an interrupted archive run
+    async with engine.connect() as connection:
+        result = await connection.execute(text(
+            """
+            SELECT c.relname, i.inhparent IS NOT NULL
+            FROM pg_class c
+            LEFT JOIN pg_inherits i ON i.inhrelid = c.oid
+            WHERE c.relkind = 'r' AND c.relname LIKE 'checks\\_y%' AND c.relnamespace = 'public'::regnamespace
+            """
+        ))
+        months = []
+        for name, is_attached in result:
+            match = PARTITION_NAME.match(name)
+            if match and (attached is None or attached == is_attached):
+                months.append(date(int(match[1]), int(match[2]), 1))
+        return sorted(months)
+
+
+async def detach_partitions(month: date):
+    # Takes a month out of the partitioned tables without blocking them (DETACH ... CONCURRENTLY).
+    # Positions and payments go first, their foreign keys are dropped so the checks partition can follow.
+    suffix = partition_suffix(month)
+    async with engine.connect() as connection:
+        connection = await connection.execution_options(isolation_level="AUTOCOMMIT")
+        for table in ["positions", "payments", "checks"]:
+            partition = f"{table}{suffix}"
+            result = await connection.execute(
+                text("SELECT inhdetachpending FROM pg_inherits WHERE inhrelid = to_regclass(:name)"), {"name": partition}
+            )
+            detach_pending = result.scalar()
+            if detach_pending is not None:
+                # an interrupted concurrent detach can only be finalized
+                mode = "FINALIZE" if detach_pending else "CONCURRENTLY"
+                await connection.execute(text(f"ALTER TABLE {table} DETACH PARTITION {partition} {mode}"))
+            if table != "checks":
+                result = await connection.execute(
+                    text("SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(:name) AND contype = 'f'"),
+                    {"name": partition},
+                )
+                for constraint in result.scalars().all():
+                    await connection.execute(text(f'ALTER TABLE {partition} DROP CONSTRAINT "{constraint}"'))
+
+
+async def drop_partitions(month: date):
+    suffix = partition_suffix(month)
+    async with engine.begin() as connection:
+        await connection.execute(text(
+            f"DROP TABLE IF EXISTS positions{suffix}, payments{suffix}, checks{suffix}"
+        ))
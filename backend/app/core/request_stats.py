@@ -0,0 +1,97 @@
+from collections import Counter
+from contextvars import ContextVar
+from typing import Any, Optional
+import json
+import logging
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.core.config import settings
+
+# Per-request database accounting. The middleware in app.main puts a RequestStats in the context,
+# the engine events and the pool add to it; SQLAlchemy runs them in greenlets that share the request's context.
+
+logger = logging.getLogger("app.request")
+slow_query_logger = logging.getLogger("app.slow_query")
+
+MAX_LOGGED_PARAMS = 500
+
+
+class RequestStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.pool_wait_seconds = 0.0
+        self.statements: Counter[str] = Counter()
+
+    def server_timing(self, total_seconds: float) -> str:
+        app_seconds = max(total_seconds - self.db_seconds - self.pool_wait_seconds, 0)
+        return (
+            f'db;dur={self.db_seconds * 1000:.1f};desc="{self.queries} queries", '
+            f"pool;dur={self.pool_wait_seconds * 1000:.1f}, app;dur={app_seconds * 1000:.1f}"
+        )
+
+
+request_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def record_pool_wait(seconds: float):
+    stats = request_stats.get()
+    if stats is not None:
+        stats.pool_wait_seconds += seconds
+
+
+def _loggable_params(context: Any, parameters: Any) -> str:
+    # by name when the statement was compiled by SQLAlchemy, never with password values
+    params = context.compiled_parameters[0] if getattr(context, "compiled_parameters", None) else parameters
+    if isinstance(params, dict):
+        params = {key: "***" if "password" in key else value for key, value in params.items()}
+    text = repr(params)
+    return text if len(text) <= MAX_LOGGED_PARAMS else text[:MAX_LOGGED_PARAMS] + "..."
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info["query_started"].pop()
+    stats = request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += seconds
+        stats.statements[statement] += 1
+    if seconds * 1000 >= settings.SLOW_QUERY_MS:
+        slow_query_logger.warning(
+            "Slow query (%.1f ms): %s params=%s", seconds * 1000, statement, _loggable_params(context, parameters)
+        )
+
+
+def instrument_engine(engine: Engine):
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def log_request(stats: RequestStats, method: str, route: str, status: int, seconds: float):
+    record = {
+        "method": method,
+        "route": route,
+        "status": status,
+        "duration_ms": round(seconds * 1000, 1),
+        "db_ms": round(stats.db_seconds * 1000, 1),
+        "pool_wait_ms": round(stats.pool_wait_seconds * 1000, 1),
+        "queries": stats.queries,
+    }
+    if settings.REQUEST_LOG:
+        logger.info(json.dumps(record))
+    if seconds * 1000 >= settings.SLOW_REQUEST_MS:
+        logger.warning("Slow request: %s", json.dumps(record))
+    if stats.queries > settings.N_PLUS_ONE_THRESHOLD:
+        # the same statement over and over is the usual sign of lazy loading in a loop
+        statement, count = stats.statements.most_common(1)[0]
+        logger.warning(
+            "Possible N+1: %s %s issued %d queries, %d of them: %s", method, route, stats.queries, count, statement
+        )
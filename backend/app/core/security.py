@@ -1,21 +1,79 @@
 from datetime import datetime, timedelta, timezone
 from fastapi import HTTPException, status
-from typing import Any
+from typing import Any, Callable, Optional
+from concurrent.futures import ProcessPoolExecutor
+import asyncio
+import multiprocessing
 import jwt
 from passlib.context import CryptContext
 
 from app.models import TokenPayload
 from app import crud
 from app.core.config import settings
+from app.core.metrics import PASSWORD_HASH_QUEUE_DEPTH, PASSWORD_HASH_REJECTED, PASSWORD_HASH_SECONDS
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.SECURITY_BCRYPT_ROUNDS)
+
+
+class PasswordHasher:
+    # bcrypt is pure CPU for hundreds of milliseconds, so it runs on a process pool instead of the event loop.
+    # Calls beyond the queue limit are rejected with 503 rather than piling up behind the pool.
+    def __init__(self, pool_size: int, queue_limit: int):
+        self.pool_size = pool_size
+        self.queue_limit = queue_limit
+        self.pending = 0
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    async def run(self, fn: Callable, *args):
+        if self.pending >= self.queue_limit:
+            PASSWORD_HASH_REJECTED.inc()
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many authentication requests, try again later",
+                headers={"Retry-After": "1"},
+            )
+        if self._pool is None:
+            raise RuntimeError("The password hashing pool isn't started")
+
+        self.pending += 1
+        PASSWORD_HASH_QUEUE_DEPTH.inc()
+        try:
+            with PASSWORD_HASH_SECONDS.time():
+                return await asyncio.get_running_loop().run_in_executor(self._pool, fn, *args)
+        finally:
+            self.pending -= 1
+            PASSWORD_HASH_QUEUE_DEPTH.dec()
+
+    async def start(self):
+        # From the lifespan, with every pool process up before the first sign in.
+        # Not forked from this process: its threads (prometheus, the DB driver) may hold locks a fork would copy held.
+        # The forkserver imports this module once and forks its single threaded self for each pool process.
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        if context.get_start_method() == "forkserver":
+            context.set_forkserver_preload([__name__])
+        self._pool = ProcessPoolExecutor(max_workers=self.pool_size, mp_context=context)
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self._pool, _ready) for _ in range(self.pool_size)))
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+password_hasher = PasswordHasher(settings.SECURITY_HASH_POOL_SIZE, settings.SECURITY_HASH_QUEUE_LIMIT)
 
 async def get_token_from_login_password(login: str, password: str) -> str:
     user = await crud.get_user_by_login(login)
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-    if not verify_password(password, user.password):
+    valid, new_hash = await verify_password(password, user.password)
+    if not valid:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid password")
+    if new_hash:
+        # the configured bcrypt cost changed since this hash was made
+        await crud.update_user(user.id, password=new_hash)
 
     access_token = create_access_token(
         subject=user.id,
@@ -29,8 +87,19 @@ def create_access_token(subject: int, expires_delta: timedelta) -> str:
     encoded_jwt = jwt.encode(to_encode, settings.SECURITY_SECRET_KEY, algorithm=settings.SECURITY_ALGORITHM)
     return encoded_jwt
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password: str, hashed_password: str) -> tuple[bool, Optional[str]]:
+    # Returns whether the password matches and, if the hash is outdated, a new hash to store
+    return await password_hasher.run(_verify_and_update, plain_password, hashed_password)
+
+async def get_password_hash(password: str) -> str:
+    return await password_hasher.run(_hash, password)
+
+# run inside the pool processes, module level so they can be pickled
+def _ready() -> bool:
+    return True
+
+def _verify_and_update(plain_password: str, hashed_password: str) -> tuple[bool, Optional[str]]:
+    return pwd_context.verify_and_update(plain_password, hashed_password)
 
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
\ No newline at end of file
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
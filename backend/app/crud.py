@@ -1,13 +1,35 @@
 from sqlmodel import select
-from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.orm import aliased, joinedload, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
 from fastapi import HTTPException, status
 import uuid
-from sqlalchemy import func
-from datetime import datetime, timedelta
+import asyncio
+import json
+from functools import lru_cache
+from sqlalchemy import (
+    text, func, tuple_, insert, update, delete, cast, literal_column, Date, DateTime, Text, bindparam, literal, String,
+    Float, Integer, Uuid, and_, case, or_, union_all,
+)
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.dialects.postgresql import ARRAY, aggregate_order_by, insert as pg_insert
+from datetime import date, datetime, timedelta, timezone
+from typing import AsyncIterator, Awaitable, Callable, Iterable, Optional, Sequence
 
-from app import models
-from app.core.db import get_session
+from app import archive, models
+from app.core.db import engine, get_read_session, get_session, mark_written
+from app.core.partitions import (
+    add_months, detach_partitions, drop_partitions, ensure_partitions, get_partition_months, maintenance_lock,
+    month_start, partition_suffix,
+)
+from app.utils import (
+    BASKET_SIZE_BUCKETS, basket_size_bucket, get_date_preset_range, get_date_range, parse_timestamp, uuid7_created_at,
+)
+from app.core.config import settings
+from app.core.metrics import observe_query
+from app.core.cache import USERS_CHANNEL, invalidate_user
 
+@observe_query
 async def create_user(user: models.User):
     async with get_session() as session:
         check_stmt = select(models.User).where(models.User.login == user.login)
@@ -16,47 +38,553 @@ async def create_user(user: models.User):
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="User already exists")
         else:
             session.add(user)
-            await session.commit()
+            try:
+                await session.commit()
+            except IntegrityError:
+                # lost the race against a concurrent signup with the same login
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="User already exists")
             await session.refresh(user)
             return user
         
-async def create_positions(positions: list[models.Position]):
+CHECK_ROLLUP_COLUMNS = {
+    "user_id": Integer, "day": Date, "payment_type": String, "checks_count": Integer, "revenue": Float,
+}
+PRODUCT_ROLLUP_COLUMNS = {
+    "user_id": Integer, "day": Date, "name": String, "quantity": Integer, "revenue": Float, "positions_count": Integer,
+}
+BASKET_ROLLUP_COLUMNS = {
+    "user_id": Integer, "day": Date, "basket_size": Integer,
+    "checks_count": Integer, "positions_count": Integer, "items": Integer, "revenue": Float,
+}
+
+def _rollup_rows(checks: Iterable[tuple[int, datetime, str, float]]) -> list[tuple]:
+    # Folds (user_id, created_at, payment_type, total) into one row per rollup key, in CHECK_ROLLUP_COLUMNS order:
+    # a single upsert can't touch the same row twice.
+    # Sorted by key: concurrent transactions lock the rows they share in the same order and can't deadlock on them.
+    rollups = {}
+    for user_id, created_at, payment_type, total in checks:
+        key = (user_id, created_at.date(), payment_type)
+        checks_count, revenue = rollups.get(key, (0, 0))
+        rollups[key] = (checks_count + 1, revenue + total)
+    return [(*key, *sums) for key, sums in sorted(rollups.items())]
+
+def _product_rollup_rows(positions: Iterable[tuple[int, datetime, str, int, float]]) -> list[tuple]:
+    # Same for (user_id, created_at, name, quantity, total) of positions, in PRODUCT_ROLLUP_COLUMNS order
+    rollups = {}
+    for user_id, created_at, name, quantity, total in positions:
+        key = (user_id, created_at.date(), name)
+        quantity_sum, revenue, positions_count = rollups.get(key, (0, 0, 0))
+        rollups[key] = (quantity_sum + quantity, revenue + total, positions_count + 1)
+    return [(*key, *sums) for key, sums in sorted(rollups.items())]
+
+def _basket_rollup_rows(checks: Iterable[tuple[int, datetime, int, int, float]]) -> list[tuple]:
+    # Same for (user_id, created_at, positions_count, items, total) of checks, in BASKET_ROLLUP_COLUMNS order
+    rollups = {}
+    for user_id, created_at, positions_count, items, total in checks:
+        key = (user_id, created_at.date(), basket_size_bucket(positions_count))
+        checks_count, positions_sum, items_sum, revenue = rollups.get(key, (0, 0, 0, 0))
+        rollups[key] = (checks_count + 1, positions_sum + positions_count, items_sum + items, revenue + total)
+    return [(*key, *sums) for key, sums in sorted(rollups.items())]
+
+def _upsert_sums_stmt(model, columns: dict, keys: list[str], rows: list[tuple]):
+    # Adds the rows to the rollups, the columns not in keys are summed.
+    # Rows come from unnest() over column arrays, one bind parameter per column whatever the row count:
+    # big checks and COPY chunks would run out of them otherwise.
+    table = model.__tablename__
+    new_rows = func.unnest(*(
+        bindparam(f"{table}_{column}", [row[index] for row in rows], type_=ARRAY(column_type))
+        for index, (column, column_type) in enumerate(columns.items())
+    )).table_valued(*columns).render_derived()
+    stmt = pg_insert(model).from_select(list(columns), select(new_rows))
+    return stmt.on_conflict_do_update(
+        index_elements=keys,
+        set_={column: getattr(model, column) + stmt.excluded[column] for column in columns if column not in keys},
+    )
+
+def _upsert_rollups_stmt(rows: list[tuple]):
+    return _upsert_sums_stmt(models.CheckDailyRollup, CHECK_ROLLUP_COLUMNS, ["user_id", "day", "payment_type"], rows)
+
+def _upsert_product_rollups_stmt(rows: list[tuple]):
+    return _upsert_sums_stmt(models.ProductDailyRollup, PRODUCT_ROLLUP_COLUMNS, ["user_id", "day", "name"], rows)
+
+def _upsert_basket_rollups_stmt(rows: list[tuple]):
+    return _upsert_sums_stmt(models.BasketDailyRollup, BASKET_ROLLUP_COLUMNS, ["user_id", "day", "basket_size"], rows)
+
+def _insert_checks_stmt(checks: list[models.Check]):
+    # One statement for any number of receipts: checks, payments and rollups go in as data-modifying CTEs,
+    # rows come from unnest() over column arrays so the statement doesn't grow with the row count
+    positions = [position for check in checks for position in check.positions]
+    new_checks = func.unnest(
+        bindparam("check_ids", [check.id for check in checks], type_=ARRAY(Uuid)),
+        bindparam("check_totals", [check.total for check in checks], type_=ARRAY(Float)),
+        bindparam("check_rests", [check.rest for check in checks], type_=ARRAY(Float)),
+        bindparam("check_created_ats", [check.created_at for check in checks], type_=ARRAY(DateTime)),
+        bindparam("check_user_ids", [check.user_id for check in checks], type_=ARRAY(Integer)),
+    ).table_valued("id", "total", "rest", "created_at", "user_id").render_derived()
+    new_payments = func.unnest(
+        bindparam("payment_types", [check.payment.type for check in checks], type_=ARRAY(String)),
+        bindparam("payment_amounts", [check.payment.amount for check in checks], type_=ARRAY(Float)),
+        bindparam("payment_check_ids", [check.id for check in checks], type_=ARRAY(Uuid)),
+        bindparam("payment_check_created_ats", [check.created_at for check in checks], type_=ARRAY(DateTime)),
+    ).table_valued("type", "amount", "check_id", "check_created_at").render_derived()
+    new_positions = func.unnest(
+        bindparam("position_names", [position.name for position in positions], type_=ARRAY(String)),
+        bindparam("position_prices", [position.price for position in positions], type_=ARRAY(Float)),
+        bindparam("position_quantities", [position.quantity for position in positions], type_=ARRAY(Integer)),
+        bindparam("position_totals", [position.total for position in positions], type_=ARRAY(Float)),
+        bindparam("position_check_ids", [position.check_id for position in positions], type_=ARRAY(Uuid)),
+        bindparam(
+            "position_check_created_ats", [position.check_created_at for position in positions], type_=ARRAY(DateTime)
+        ),
+    ).table_valued(
+        "name", "price", "quantity", "total", "check_id", "check_created_at", with_ordinality="ordinality"
+    ).render_derived()
+
+    check_cte = (
+        insert(models.Check)
+        .from_select(["id", "total", "rest", "created_at", "user_id"], select(new_checks))
+        .returning(models.Check.id)
+        .cte("new_check")
+    )
+    payment_cte = (
+        insert(models.Payment)
+        .from_select(["type", "amount", "check_id", "check_created_at"], select(new_payments))
+        .returning(models.Payment.id)
+        .cte("new_payment")
+    )
+    rollup_cte = _upsert_rollups_stmt(
+        _rollup_rows((check.user_id, check.created_at, check.payment.type, check.total) for check in checks)
+    ).cte("new_rollup")
+    product_rollup_cte = _upsert_product_rollups_stmt(_product_rollup_rows(
+        (check.user_id, check.created_at, position.name, position.quantity, position.total)
+        for check in checks for position in check.positions
+    )).cte("new_product_rollup")
+    basket_rollup_cte = _upsert_basket_rollups_stmt(_basket_rollup_rows(
+        (check.user_id, check.created_at, len(check.positions), sum(position.quantity for position in check.positions),
+         check.total)
+        for check in checks
+    )).cte("new_basket_rollup")
+    # INSERT ... RETURNING gives no row order, so position ids are drawn from the sequence up front
+    # (a CTE holding a volatile call is evaluated once) and handed back ordered by the input position
+    position_columns = ["name", "price", "quantity", "total", "check_id", "check_created_at"]
+    new_position_ids = select(
+        func.nextval(literal_column("'positions_id_seq'")).label("id"), *new_positions.c
+    ).cte("new_position_id")
+    position_cte = (
+        insert(models.Position)
+        .from_select(
+            ["id", *position_columns], select(*(new_position_ids.c[column] for column in ["id", *position_columns]))
+        )
+        .cte("new_position")
+    )
+    return (
+        select(new_position_ids.c.id)
+        .order_by(new_position_ids.c.ordinality)
+        .add_cte(check_cte)
+        .add_cte(payment_cte)
+        .add_cte(rollup_cte)
+        .add_cte(product_rollup_cte)
+        .add_cte(basket_rollup_cte)
+        .add_cte(position_cte)
+    )
+
+@observe_query
+async def create_checks(checks: list[models.Check]) -> list[models.Check]:
+    # All the checks are written atomically in a single round trip
     async with get_session() as session:
-        session.add_all(positions)
-        await session.commit()
-        for position in positions:
-            await session.refresh(position)
-        return positions
-    
-async def create_payment(payment: models.Payment):
+        async with session.begin():
+            result = await session.execute(_insert_checks_stmt(checks))
+            positions = (position for check in checks for position in check.positions)
+            for position, position_id in zip(positions, result.scalars()):
+                position.id = position_id
+        mark_written(*{check.user_id for check in checks})
+        return checks
+
+async def create_check(check: models.Check) -> models.Check:
+    return (await create_checks([check]))[0]
+
+@observe_query
+async def copy_checks(checks: list[tuple], positions: list[tuple], payments: list[tuple]):
+    # Records are plain tuples in the column order below, checks and payments aligned by index.
+    # Everything, rollups included, is written in one transaction.
+    rollups = _rollup_rows(
+        (user_id, created_at, payment_type, total)
+        for (_, total, _, created_at, user_id), (payment_type, *_) in zip(checks, payments)
+    )
+    users = {check_id: user_id for check_id, _, _, _, user_id in checks}
+    product_rollups = _product_rollup_rows(
+        (users[check_id], created_at, name, quantity, total)
+        for name, _, quantity, total, check_id, created_at in positions
+    )
+    baskets = {check_id: (0, 0) for check_id in users}
+    for _, _, quantity, _, check_id, _ in positions:
+        positions_count, items = baskets[check_id]
+        baskets[check_id] = (positions_count + 1, items + quantity)
+    basket_rollups = _basket_rollup_rows(
+        (user_id, created_at, *baskets[check_id], total) for check_id, total, _, created_at, user_id in checks
+    )
     async with get_session() as session:
-        session.add(payment)
-        await session.commit()
-        await session.refresh(payment)
-        print("here3")
-        return payment
-    
-async def create_check(check: models.Check):
+        async with session.begin():
+            # the upserts run first so the transaction is already open on the driver connection used by COPY
+            await session.execute(_upsert_rollups_stmt(rollups))
+            await session.execute(_upsert_product_rollups_stmt(product_rollups))
+            await session.execute(_upsert_basket_rollups_stmt(basket_rollups))
+            connection = await session.connection()
+            raw_connection = (await connection.get_raw_connection()).driver_connection
+            await raw_connection.copy_records_to_table(
+                models.Check.__tablename__, records=checks, columns=["id", "total", "rest", "created_at", "user_id"]
+            )
+            await raw_connection.copy_records_to_table(
+                models.Position.__tablename__, records=positions,
+                columns=["name", "price", "quantity", "total", "check_id", "check_created_at"],
+            )
+            await raw_connection.copy_records_to_table(
+                models.Payment.__tablename__, records=payments, columns=["type", "amount", "check_id", "check_created_at"]
+            )
+    mark_written(*{user_id for (_, _, _, _, user_id) in checks})
+
+@observe_query
+async def create_users(names: list[str], logins: list[str], password: str) -> list[int]:
+    # Bulk insert of active users sharing one password hash, returns the new ids in the same order
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    users = func.unnest(
+        bindparam("names", names, type_=ARRAY(String)),
+        bindparam("logins", logins, type_=ARRAY(String)),
+    ).table_valued("name", "login", with_ordinality="ordinality").render_derived()
+    stmt = (
+        insert(models.User)
+        .from_select(
+            ["name", "login", "password", "is_active", "created_at", "updated_at"],
+            select(users.c.name, users.c.login, literal(password), literal(True), literal(now), literal(now))
+            .order_by(users.c.ordinality),
+        )
+        .returning(models.User.login, models.User.id)
+    )
     async with get_session() as session:
-        session.add(check)
-        await session.commit()
-        await session.refresh(check)
-        return check
+        async with session.begin():
+            ids = dict((await session.execute(stmt)).all())
+        return [ids[login] for login in logins]
 
-async def get_check_by_id(check_id: uuid.UUID):
+async def _read_or_primary(read: Callable[[AsyncSession], Awaitable], user_id: Optional[int] = None):
+    # Single-row read on a replica, repeated on the primary when the replica comes back empty:
+    # a row created a moment ago (e.g. a receipt fetched without a token) may not be replicated yet
+    async with get_read_session(user_id) as session:
+        found = await read(session)
+        if found is not None or session.bind is engine:
+            return found
     async with get_session() as session:
-        print(check_id)
-        stmt = (
-            select(models.Check)
-            .where(models.Check.id == check_id)
-            .options(joinedload(models.Check.positions), 
-                     joinedload(models.Check.payment),
-                     joinedload(models.Check.user)
-                    )
-        )
+        return await read(session)
+
+def _created_at_bounds(check_id: uuid.UUID) -> Optional[tuple[datetime, datetime]]:
+    # A UUIDv7 check id carries its creation time, bounding created_at by it lets Postgres prune the other partitions.
+    # A second on both sides keeps ids minted on a skewed clock findable.
+    created_at = uuid7_created_at(check_id)
+    if created_at is None:
+        return None
+    return created_at - timedelta(seconds=1), created_at + timedelta(seconds=1)
+
+async def _get_archived_check(check_id: uuid.UUID) -> Optional[models.Check]:
+    # A check of an archived month rebuilt from the archive, transient, never added to a session
+    archived = await asyncio.to_thread(archive.find_check, check_id)
+    if archived is None:
+        return None
+    # archives written before created_at had a fixed precision have trimmed fractions
+    created_at = parse_timestamp(archived["created_at"])
+    check = models.Check(
+        id=check_id,
+        total=archived["total"],
+        rest=archived["rest"],
+        created_at=created_at,
+        user_id=archived["user_id"],
+    )
+    # archived positions have lost their ids, their ordinals stand in for them
+    check.positions = [
+        models.Position(**position, id=ordinal, check_id=check_id, check_created_at=created_at)
+        for ordinal, position in enumerate(archived["positions"], 1)
+    ]
+    check.payment = models.Payment(**archived["payment"], check_id=check_id, check_created_at=created_at)
+    async with get_read_session() as session:
+        check.user = await session.get(models.User, check.user_id)
+    return check
+
+@observe_query
+async def get_check_by_id(check_id: uuid.UUID, user_id: Optional[int] = None):
+    stmt = select(models.Check).where(models.Check.id == check_id)
+    positions, payment = models.Check.positions, models.Check.payment
+    bounds = _created_at_bounds(check_id)
+    if bounds:
+        stmt = stmt.where(models.Check.created_at.between(*bounds))
+        positions = positions.and_(models.Position.check_created_at.between(*bounds))
+        payment = payment.and_(models.Payment.check_created_at.between(*bounds))
+    stmt = stmt.options(joinedload(positions), joinedload(payment), joinedload(models.Check.user))
+
+    async def read(session: AsyncSession):
         result = await session.execute(stmt)
         return result.unique().scalars().one_or_none()
+    check = await _read_or_primary(read, user_id)
+    if check is None:
+        check = await _get_archived_check(check_id)
+    return check
+
+@observe_query
+async def get_receipt_version(check_id: uuid.UUID) -> Optional[datetime]:
+    # When the check's user last changed, all a receipt's ETag depends on besides the check, without loading it.
+    # None for an unknown or archived check.
+    stmt = (
+        select(models.User.updated_at)
+        .join(models.Check, models.Check.user_id == models.User.id)
+        .where(models.Check.id == check_id)
+    )
+    bounds = _created_at_bounds(check_id)
+    if bounds:
+        stmt = stmt.where(models.Check.created_at.between(*bounds))
+
+    async def read(session: AsyncSession):
+        return (await session.execute(stmt)).scalar_one_or_none()
+    return await _read_or_primary(read)
     
+@observe_query
+async def get_check_json_by_id(check_id: uuid.UUID, user_id: Optional[int] = None) -> Optional[str]:
+    stmt = select(cast(_check_json(models.Check), Text)).where(models.Check.id == check_id)
+    bounds = _created_at_bounds(check_id)
+    if bounds:
+        stmt = stmt.where(models.Check.created_at.between(*bounds))
+
+    async def read(session: AsyncSession):
+        result = await session.execute(stmt)
+        return result.scalar_one_or_none()
+    check_json = await _read_or_primary(read, user_id)
+    if check_json is None:
+        archived = await asyncio.to_thread(archive.find_check, check_id)
+        if archived is not None:
+            del archived["user_id"]
+            # in the format of the checks still in the database
+            archived["created_at"] = parse_timestamp(archived["created_at"]).isoformat()
+            check_json = json.dumps(archived)
+    return check_json
+
+@observe_query
+async def get_check_summary(check_id: uuid.UUID, user_id: Optional[int] = None) -> Optional[tuple[models.Check, int]]:
+    # The check with its payment and the number of its positions, which are left unloaded
+    positions_count = (
+        select(func.count())
+        .where(models.Position.check_id == models.Check.id, models.Position.check_created_at == models.Check.created_at)
+        .scalar_subquery()
+    )
+    stmt = (
+        select(models.Check, positions_count)
+        .where(models.Check.id == check_id)
+        .options(joinedload(models.Check.payment))
+    )
+    bounds = _created_at_bounds(check_id)
+    if bounds:
+        stmt = stmt.where(models.Check.created_at.between(*bounds))
+
+    async def read(session: AsyncSession):
+        result = await session.execute(stmt)
+        return result.unique().one_or_none()
+    found = await _read_or_primary(read, user_id)
+    if found is not None:
+        return tuple(found)
+    check = await _get_archived_check(check_id)
+    if check is None:
+        return None
+    return check, len(check.positions)
+
+@observe_query
+async def get_check_positions(
+        check_id: uuid.UUID, after: int, limit: int, user_id: Optional[int] = None
+    ) -> Optional[Sequence[models.Position]]:
+    # Keyset page of a check's positions in id order, None when there is no such check
+    stmt = (
+        select(models.Position)
+        .where(models.Position.check_id == check_id, models.Position.id > after)
+        .order_by(models.Position.id)
+        .limit(limit)
+    )
+    check_stmt = select(models.Check.id).where(models.Check.id == check_id)
+    bounds = _created_at_bounds(check_id)
+    if bounds:
+        stmt = stmt.where(models.Position.check_created_at.between(*bounds))
+        check_stmt = check_stmt.where(models.Check.created_at.between(*bounds))
+
+    async def read(session: AsyncSession):
+        positions = (await session.execute(stmt)).scalars().all()
+        if positions:
+            return positions
+        # an empty page, past the last position or of a check that doesn't exist
+        found = (await session.execute(check_stmt)).first()
+        return positions if found else None
+    positions = await _read_or_primary(read, user_id)
+    if positions is not None:
+        return positions
+    check = await _get_archived_check(check_id)
+    if check is None:
+        return None
+    return [position for position in check.positions if position.id > after][:limit]
+
+def _users_checks_params(
+        user_id: int,
+        date_preset: models.DatePreset,
+        total_ge: Optional[float],
+        total_le: Optional[float],
+        payment_type: Optional[models.PaymentType],
+        offset: Optional[int] = None,
+        limit: Optional[int] = None,
+        cursor: Optional[tuple[datetime, uuid.UUID]] = None,
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None,
+    ) -> dict:
+    # Bound values of the users checks query, the set of keys selects the cached statement shape.
+    # An explicit date_from/date_to range replaces the preset.
+    params = {"user_id": user_id}
+    if date_from or date_to:
+        created_from, created_to = get_date_range(date_from, date_to)
+    else:
+        created_from, created_to = get_date_preset_range(date_preset)
+    if created_from:
+        params["created_from"] = created_from
+    if created_to:
+        params["created_to"] = created_to
+    if total_ge:
+        params["total_ge"] = total_ge
+    if total_le:
+        params["total_le"] = total_le
+    if payment_type:
+        params["payment_type"] = payment_type.value
+    if cursor:
+        params.update(cursor_created_at=cursor[0], cursor_id=cursor[1])
+    elif offset:
+        params["offset"] = offset
+    if limit is not None:
+        params["limit"] = limit
+    return params
+
+def _users_checks_page(stmt, filters: frozenset[str]):
+    stmt = stmt.where(models.Check.user_id == bindparam("user_id"))
+    if "created_from" in filters:
+        stmt = stmt.where(models.Check.created_at >= bindparam("created_from"))
+    if "created_to" in filters:
+        stmt = stmt.where(models.Check.created_at < bindparam("created_to"))
+    if "total_ge" in filters:
+        stmt = stmt.where(models.Check.total >= bindparam("total_ge"))
+    if "total_le" in filters:
+        stmt = stmt.where(models.Check.total <= bindparam("total_le"))
+    if "payment_type" in filters:
+        # every check has its payment, the join only narrows when filtering on it
+        stmt = stmt.join(models.Check.payment).where(models.Payment.type == bindparam("payment_type"))
+    if "cursor_id" in filters:
+        # keyset pagination, served by the (user_id, created_at, id) index
+        stmt = stmt.where(
+            tuple_(models.Check.created_at, models.Check.id)
+            < tuple_(bindparam("cursor_created_at", type_=DateTime), bindparam("cursor_id", type_=Uuid))
+        )
+    stmt = stmt.order_by(models.Check.created_at.desc(), models.Check.id.desc())
+    if "offset" in filters:
+        stmt = stmt.offset(bindparam("offset", type_=Integer))
+    if "limit" in filters:
+        stmt = stmt.limit(bindparam("limit", type_=Integer))
+    return stmt
+
+@lru_cache(maxsize=256)
+def _users_checks_stmt(filters: frozenset[str]):
+    # Built once per filter combination, SQLAlchemy's compiled cache then skips compilation too
+    return _users_checks_page(select(models.Check), filters).options(
+        selectinload(models.Check.positions), selectinload(models.Check.payment)
+    )
+
+def _check_json(check):
+    # The whole CheckResponse built by Postgres: same keys and values as the Pydantic serialization, though not
+    # byte for byte (Postgres spaces the keys, trims trailing zeros of fractions, writes 7.0 as 7)
+    positions = (
+        select(func.coalesce(
+            func.json_agg(aggregate_order_by(
+                func.json_build_object(
+                    "name", models.Position.name,
+                    "price", models.Position.price,
+                    "quantity", models.Position.quantity,
+                    "total", models.Position.total,
+                ),
+                models.Position.id,
+            )),
+            literal_column("'[]'::json"),
+        ))
+        # the partition key too, so each lookup touches only the check's month
+        .where(models.Position.check_id == check.id, models.Position.check_created_at == check.created_at)
+        .scalar_subquery()
+    )
+    payment = (
+        select(func.json_build_object("type", models.Payment.type, "amount", models.Payment.amount))
+        .where(models.Payment.check_id == check.id, models.Payment.check_created_at == check.created_at)
+        .limit(1)
+        .scalar_subquery()
+    )
+    return func.json_build_object(
+        "id", check.id,
+        "positions", positions,
+        "payment", payment,
+        "total", check.total,
+        "rest", check.rest,
+        "created_at", check.created_at,
+    )
+
+def _page_version(page):
+    # md5 of the page's ids newest first, as utils.ids_digest computes it, and its newest created_at.
+    # Checks never change, so the same ids mean the same page.
+    ids = func.string_agg(
+        cast(page.id, Text), aggregate_order_by(literal_column("','"), page.created_at.desc(), page.id.desc())
+    )
+    return func.md5(ids), func.max(page.created_at)
+
+@lru_cache(maxsize=256)
+def _users_checks_json_stmt(filters: frozenset[str]):
+    # One row: the JSON array of the page, its length, the keyset of its last check and the page version
+    page = aliased(models.Check, _users_checks_page(select(models.Check), filters).subquery("page"))
+    newest_first = (page.created_at.desc(), page.id.desc())
+    return select(
+        cast(func.coalesce(
+            func.json_agg(aggregate_order_by(_check_json(page), *newest_first)), literal_column("'[]'::json")
+        ), Text),
+        func.count(),
+        func.min(page.created_at),
+        (func.array_agg(aggregate_order_by(page.id, page.created_at, page.id)))[1],
+        *_page_version(page),
+    )
+
+@lru_cache(maxsize=256)
+def _users_checks_version_stmt(filters: frozenset[str]):
+    # Only ids and created_at, an index-only scan of ix_checks_user_id_created_at_id for the usual filters
+    page = _users_checks_page(select(models.Check.id, models.Check.created_at), filters).subquery("page")
+    return select(*_page_version(page.c))
+
+@observe_query
+async def get_checks_by_ids(check_ids: list[uuid.UUID]):
+    stmt = (
+        select(models.Check)
+        .options(selectinload(models.Check.positions),
+                 joinedload(models.Check.payment),
+                 joinedload(models.Check.user)
+                )
+    )
+    async with get_read_session() as session:
+        result = await session.execute(stmt.where(models.Check.id.in_(check_ids)))
+        checks = list(result.unique().scalars().all())
+        on_primary = session.bind is engine
+    missing = set(check_ids) - {check.id for check in checks}
+    if missing and not on_primary:
+        # like _read_or_primary, the ones the replica doesn't have yet are looked up on the primary
+        async with get_session() as session:
+            result = await session.execute(stmt.where(models.Check.id.in_(missing)))
+            checks += result.unique().scalars().all()
+        missing -= {check.id for check in checks}
+    # whatever is still missing may belong to an archived month
+    for check_id in missing:
+        archived = await _get_archived_check(check_id)
+        if archived is not None:
+            checks.append(archived)
+    return checks
+
+@observe_query
 async def get_all_users_checks(
         user_id: int, 
         date_preset: models.DatePreset, 
@@ -64,45 +592,578 @@ async def get_all_users_checks(
         total_le: float, 
         payment_type: models.PaymentType, 
         offset: int, 
-        limit: int
+        limit: int,
+        cursor: Optional[tuple[datetime, uuid.UUID]] = None
     ):
+    async with get_read_session(user_id) as session:
+        params = _users_checks_params(
+            user_id, date_preset, total_ge, total_le, payment_type, offset, limit if limit is not None else 100, cursor
+        )
+        stmt = _users_checks_stmt(frozenset(params))
+        result = await session.execute(stmt, params)
+        return result.unique().scalars().all()
+
+@observe_query
+async def get_all_users_checks_json(
+        user_id: int,
+        date_preset: models.DatePreset,
+        total_ge: float,
+        total_le: float,
+        payment_type: models.PaymentType,
+        offset: int,
+        limit: int,
+        cursor: Optional[tuple[datetime, uuid.UUID]] = None
+    ) -> tuple[str, int, Optional[tuple[datetime, uuid.UUID]], Optional[tuple[str, datetime]]]:
+    # Same page as get_all_users_checks, serialized by Postgres.
+    # Returns the JSON array, the number of checks in it, the keyset of the last one and the page version.
+    async with get_read_session(user_id) as session:
+        params = _users_checks_params(
+            user_id, date_preset, total_ge, total_le, payment_type, offset, limit if limit is not None else 100, cursor
+        )
+        result = await session.execute(_users_checks_json_stmt(frozenset(params)), params)
+        checks_json, count, last_created_at, last_id, digest, newest = result.one()
+        if not count:
+            return checks_json, count, None, None
+        return checks_json, count, (last_created_at, last_id), (digest, newest)
+
+@observe_query
+async def get_users_checks_version(
+        user_id: int,
+        date_preset: models.DatePreset,
+        total_ge: float,
+        total_le: float,
+        payment_type: models.PaymentType,
+        offset: int,
+        limit: int,
+        cursor: Optional[tuple[datetime, uuid.UUID]] = None
+    ) -> Optional[tuple[str, datetime]]:
+    # The version of the page get_all_users_checks would return, without loading it. None for an empty page.
+    async with get_read_session(user_id) as session:
+        params = _users_checks_params(
+            user_id, date_preset, total_ge, total_le, payment_type, offset, limit if limit is not None else 100, cursor
+        )
+        result = await session.execute(_users_checks_version_stmt(frozenset(params)), params)
+        digest, newest = result.one()
+        return (digest, newest) if digest else None
+
+@observe_query
+async def get_checks_json(check_ids: list[uuid.UUID]) -> list[tuple[datetime, uuid.UUID, int, str]]:
+    # (created_at, id, user_id, CheckResponse JSON) of just created checks, oldest first.
+    # From the primary, a replica may not have them yet.
+    stmt = (
+        select(models.Check.created_at, models.Check.id, models.Check.user_id, cast(_check_json(models.Check), Text))
+        .where(models.Check.id.in_(check_ids))
+        .order_by(models.Check.created_at, models.Check.id)
+    )
+    bounds = [_created_at_bounds(check_id) for check_id in check_ids]
+    if all(bounds):
+        stmt = stmt.where(models.Check.created_at.between(min(low for low, _ in bounds), max(high for _, high in bounds)))
     async with get_session() as session:
+        result = await session.execute(stmt)
+        return result.all()
+
+@observe_query
+async def get_users_checks_since(
+        user_id: int, after: tuple[datetime, uuid.UUID], limit: int
+    ) -> list[tuple[datetime, uuid.UUID, int, str]]:
+    # The user's checks created after the keyset, oldest first, in the shape of get_checks_json.
+    # From the primary too, a feed resuming from a replica could skip checks it hasn't replicated yet.
+    stmt = (
+        select(models.Check.created_at, models.Check.id, models.Check.user_id, cast(_check_json(models.Check), Text))
+        .where(
+            models.Check.user_id == user_id,
+            tuple_(models.Check.created_at, models.Check.id) > tuple_(*after),
+        )
+        .order_by(models.Check.created_at, models.Check.id)
+        .limit(limit)
+    )
+    async with get_session() as session:
+        result = await session.execute(stmt)
+        return result.all()
+
+def _search_params(query: str, mode: models.SearchMode) -> dict:
+    # The parameter names also tell _position_matches which condition to build
+    if mode == models.SearchMode.FUZZY:
+        return {"name_query": query}
+    escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    if mode == models.SearchMode.PREFIX:
+        return {"name_prefix": f"{escaped}%", "word_prefix": f"% {escaped}%"}
+    return {"name_pattern": f"%{escaped}%"}
+
+def _position_matches(filters: frozenset[str]):
+    # All three are served by the ix_positions_name_trgm GIN index
+    name = models.Position.name
+    if "name_prefix" in filters:
+        return or_(name.ilike(bindparam("name_prefix")), name.ilike(bindparam("word_prefix")))
+    if "name_pattern" in filters:
+        return name.ilike(bindparam("name_pattern"))
+    # word_similarity above pg_trgm.word_similarity_threshold
+    return bindparam("name_query", type_=String).op("<%")(name)
+
+@lru_cache(maxsize=256)
+def _search_checks_stmt(filters: frozenset[str]):
+    # A user's checks with at least one matching position. With LIMIT the planner can walk the user's checks
+    # newest first when the term is common, or start from the trigram index when it's rare.
+    matching = select(models.Position.id).where(
+        models.Position.check_id == models.Check.id, _position_matches(filters)
+    )
+    return _users_checks_page(select(models.Check), filters).where(matching.exists()).options(
+        selectinload(models.Check.payment)
+    )
+
+@lru_cache(maxsize=8)
+def _search_positions_stmt(filters: frozenset[str]):
+    # the page's created_at range bounds the partition key, so only the page's months are probed
+    return (
+        select(models.Position, _position_matches(filters))
+        .where(
+            models.Position.check_id.in_(bindparam("check_ids", expanding=True)),
+            models.Position.check_created_at.between(bindparam("page_from"), bindparam("page_to")),
+        )
+        .order_by(models.Position.id)
+    )
+
+@observe_query
+async def search_users_checks(
+        user_id: int,
+        query: str,
+        mode: models.SearchMode,
+        date_preset: models.DatePreset,
+        total_ge: Optional[float],
+        total_le: Optional[float],
+        payment_type: Optional[models.PaymentType],
+        limit: int,
+        cursor: Optional[tuple[datetime, uuid.UUID]] = None,
+    ) -> list[tuple[models.Check, set[int]]]:
+    # A page of the user's checks containing positions whose name matches the query, each with its positions loaded
+    # and the ids of the matching ones
+    search_params = _search_params(query, mode)
+    params = _users_checks_params(user_id, date_preset, total_ge, total_le, payment_type, limit=limit, cursor=cursor)
+    params.update(search_params)
+    async with get_read_session(user_id) as session:
+        result = await session.execute(_search_checks_stmt(frozenset(params)), params)
+        checks = result.unique().scalars().all()
+        if not checks:
+            return []
+        page = {
+            "check_ids": [check.id for check in checks],
+            "page_from": min(check.created_at for check in checks),
+            "page_to": max(check.created_at for check in checks),
+        }
+        result = await session.execute(_search_positions_stmt(frozenset(search_params)), {**search_params, **page})
+        positions, hits = {check.id: [] for check in checks}, {check.id: set() for check in checks}
+        for position, hit in result:
+            positions[position.check_id].append(position)
+            if hit:
+                hits[position.check_id].add(position.id)
+        for check in checks:
+            set_committed_value(check, "positions", positions[check.id])
+        return [(check, hits[check.id]) for check in checks]
+
+async def stream_users_checks(
+        user_id: int,
+        date_preset: models.DatePreset,
+        total_ge: float,
+        total_le: float,
+        payment_type: models.PaymentType,
+        batch_size: int = 1000,
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None,
+        with_user: bool = False,
+    ) -> AsyncIterator[Sequence[models.Check]]:
+    # Yields batches of checks read through a server-side cursor, so only one batch is held in memory
+    async with get_read_session(user_id) as session:
+        params = _users_checks_params(
+            user_id, date_preset, total_ge, total_le, payment_type, date_from=date_from, date_to=date_to
+        )
+        stmt = _users_checks_stmt(frozenset(params)).execution_options(yield_per=batch_size)
+        if with_user:
+            stmt = stmt.options(selectinload(models.Check.user))
+        result = await session.stream(stmt, params)
+        async for checks in result.scalars().partitions():
+            yield checks
+            session.expunge_all()
+
+@observe_query
+async def get_users_daily_rollups(user_id: int, date_from: Optional[date], date_to: Optional[date]):
+    async with get_read_session(user_id) as session:
         stmt = (
-            select(models.Check)
-            .join(models.Check.payment)
-            .where(models.Check.user_id == user_id)
-            .order_by(models.Check.created_at.desc())
-            .options(selectinload(models.Check.positions), 
-                     selectinload(models.Check.payment))
-        )
-        if date_preset == models.DatePreset.ALL:
-            ...
-        elif date_preset == models.DatePreset.TODAY:
-            stmt = stmt.where(func.date(models.Check.created_at) == datetime.now().date())
-        elif date_preset == models.DatePreset.LAST_3_DAYS:
-            stmt = stmt.where(func.date(models.Check.created_at) >= (datetime.now() - timedelta(days=3)).date())
-        elif date_preset == models.DatePreset.LAST_7_DAYS:
-            stmt = stmt.where(func.date(models.Check.created_at) >= (datetime.now() - timedelta(days=7)).date())
-        elif date_preset == models.DatePreset.LAST_MONTH:
-            stmt = stmt.where(func.date(models.Check.created_at) >= (datetime.now() - timedelta(days=30)).date())
-        elif date_preset == models.DatePreset.LAST_YEAR:
-            stmt = stmt.where(func.date(models.Check.created_at) >= (datetime.now() - timedelta(days=365)).date())
-        
-        if total_ge:
-            stmt = stmt.where(models.Check.total >= total_ge)
-        if total_le:
-            stmt = stmt.where(models.Check.total <= total_le)
-        
-        if payment_type:
-            stmt = stmt.where(models.Payment.type == payment_type)
-        
-        stmt = stmt.offset(offset if offset is not None else 0)
-        stmt = stmt.limit(limit if limit is not None else 100)
-        print(str(stmt))
+            select(models.CheckDailyRollup)
+            .where(models.CheckDailyRollup.user_id == user_id)
+            .order_by(models.CheckDailyRollup.day)
+        )
+        if date_from:
+            stmt = stmt.where(models.CheckDailyRollup.day >= date_from)
+        if date_to:
+            stmt = stmt.where(models.CheckDailyRollup.day <= date_to)
         result = await session.execute(stmt)
-        return result.unique().scalars().all()
+        return result.scalars().all()
+
+@observe_query
+async def rebuild_daily_rollups():
+    # Recomputes every rollup from the checks themselves, in one transaction.
+    # Archived months are no longer in the database, their rollups are kept as they are.
+    archived = await asyncio.to_thread(archive.archived_months)
+    since = add_months(archived[-1], 1) if archived else None
+    async with get_session() as session:
+        async with session.begin():
+            day = cast(models.Check.created_at, Date)
+            rollups = (
+                select(
+                    models.Check.user_id,
+                    day,
+                    models.Payment.type,
+                    func.count(),
+                    func.sum(models.Check.total),
+                )
+                .join(models.Check.payment)
+                .group_by(models.Check.user_id, day, models.Payment.type)
+            )
+            if since:
+                await session.execute(delete(models.CheckDailyRollup).where(models.CheckDailyRollup.day >= since))
+                rollups = rollups.where(models.Check.created_at >= since)
+            else:
+                await session.execute(delete(models.CheckDailyRollup))
+            await session.execute(
+                insert(models.CheckDailyRollup).from_select(
+                    ["user_id", "day", "payment_type", "checks_count", "revenue"], rollups
+                )
+            )
+
+def product_rollup_cutoff() -> date:
+    # Days before this month start only have monthly product rollups, once compacted
+    return add_months(month_start(datetime.now(timezone.utc).date()), -settings.PRODUCT_ROLLUP_DAILY_MONTHS)
+
+def analytics_range(date_from: Optional[date], date_to: Optional[date]) -> tuple[Optional[date], Optional[date]]:
+    # The range analytics actually cover: where it reaches into compacted months it's widened to whole months
+    cutoff = product_rollup_cutoff()
+    if date_from and date_from < cutoff:
+        date_from = month_start(date_from)
+    if date_to and date_to < cutoff:
+        date_to = add_months(month_start(date_to), 1) - timedelta(days=1)
+    return date_from, date_to
+
+def _compact_product_rollups_stmt(cutoff: date):
+    # Moves the daily product rollups before cutoff into monthly ones, in one statement:
+    # readers see a day either way, never both or neither
+    daily = models.ProductDailyRollup
+    moved = (
+        delete(daily)
+        .where(daily.day < cutoff)
+        .returning(daily.user_id, daily.day, daily.name, daily.quantity, daily.revenue, daily.positions_count)
+        .cte("moved")
+    )
+    month = cast(func.date_trunc("month", moved.c.day), Date)
+    stmt = pg_insert(models.ProductMonthlyRollup).from_select(
+        ["user_id", "month", "name", "quantity", "revenue", "positions_count"],
+        select(
+            moved.c.user_id, month, moved.c.name,
+            func.sum(moved.c.quantity), func.sum(moved.c.revenue), func.sum(moved.c.positions_count),
+        ).group_by(moved.c.user_id, month, moved.c.name),
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=["user_id", "month", "name"],
+        set_={
+            column: getattr(models.ProductMonthlyRollup, column) + stmt.excluded[column]
+            for column in ("quantity", "revenue", "positions_count")
+        },
+    ).add_cte(moved)
+
+@observe_query
+async def compact_product_rollups() -> int:
+    # Returns the monthly rollups written
+    async with get_session() as session:
+        async with session.begin():
+            result = await session.execute(_compact_product_rollups_stmt(product_rollup_cutoff()))
+            return result.rowcount
+
+def _product_rollups_stmt(user_id: int, date_from: Optional[date], date_to: Optional[date]):
+    # (name, quantity, revenue, positions_count) over a range from analytics_range, daily and monthly rollups alike
+    daily, monthly = models.ProductDailyRollup, models.ProductMonthlyRollup
+    daily_rows = (
+        select(daily.name, daily.quantity, daily.revenue, daily.positions_count)
+        .where(daily.user_id == user_id)
+    )
+    monthly_rows = (
+        select(monthly.name, monthly.quantity, monthly.revenue, monthly.positions_count)
+        .where(monthly.user_id == user_id)
+    )
+    if date_from:
+        daily_rows = daily_rows.where(daily.day >= date_from)
+        monthly_rows = monthly_rows.where(monthly.month >= date_from)
+    if date_to:
+        daily_rows = daily_rows.where(daily.day <= date_to)
+        monthly_rows = monthly_rows.where(monthly.month <= date_to)
+    rows = union_all(daily_rows, monthly_rows).subquery()
+    return (
+        select(rows.c.name, func.sum(rows.c.quantity), func.sum(rows.c.revenue), func.sum(rows.c.positions_count))
+        .group_by(rows.c.name)
+    )
+
+@observe_query
+async def get_users_top_products(
+        user_id: int,
+        date_from: Optional[date],
+        date_to: Optional[date],
+        order_by: models.ProductOrder,
+        limit: int,
+    ) -> list[models.ProductStats]:
+    stmt = _product_rollups_stmt(user_id, date_from, date_to)
+    quantity, revenue = stmt.selected_columns[1], stmt.selected_columns[2]
+    ranked_by = quantity if order_by == models.ProductOrder.QUANTITY else revenue
+    stmt = stmt.order_by(ranked_by.desc(), "name").limit(limit)
+    async with get_read_session(user_id) as session:
+        result = await session.execute(stmt)
+        return [
+            models.ProductStats(name=name, quantity=quantity, revenue=revenue, positions_count=positions_count)
+            for name, quantity, revenue, positions_count in result.all()
+        ]
+
+@observe_query
+async def get_users_products(
+        user_id: int, date_from: Optional[date], date_to: Optional[date], names: list[str]
+    ) -> dict[str, models.ProductStats]:
+    stmt = _product_rollups_stmt(user_id, date_from, date_to)
+    stmt = stmt.where(stmt.selected_columns[0].in_(names))
+    async with get_read_session(user_id) as session:
+        result = await session.execute(stmt)
+        return {
+            name: models.ProductStats(name=name, quantity=quantity, revenue=revenue, positions_count=positions_count)
+            for name, quantity, revenue, positions_count in result.all()
+        }
+
+@observe_query
+async def get_users_basket_rollups(user_id: int, date_from: Optional[date], date_to: Optional[date]):
+    # (basket_size, checks_count, positions_count, items, revenue) per bucket
+    rollup = models.BasketDailyRollup
+    stmt = (
+        select(
+            rollup.basket_size, func.sum(rollup.checks_count), func.sum(rollup.positions_count),
+            func.sum(rollup.items), func.sum(rollup.revenue),
+        )
+        .where(rollup.user_id == user_id)
+        .group_by(rollup.basket_size)
+        .order_by(rollup.basket_size)
+    )
+    if date_from:
+        stmt = stmt.where(rollup.day >= date_from)
+    if date_to:
+        stmt = stmt.where(rollup.day <= date_to)
+    async with get_read_session(user_id) as session:
+        result = await session.execute(stmt)
+        return result.all()
+
+def _fresh_product_rollups(since: Optional[date]):
+    # The daily product rollups computed from the positions, in PRODUCT_ROLLUP_COLUMNS order.
+    # A check without positions has no products, the create paths add nothing for it either.
+    day = cast(models.Check.created_at, Date)
+    stmt = (
+        select(
+            models.Check.user_id, day.label("day"), models.Position.name,
+            func.sum(models.Position.quantity).label("quantity"),
+            func.sum(models.Position.total).label("revenue"),
+            func.count().label("positions_count"),
+        )
+        .join(models.Position, and_(
+            models.Position.check_id == models.Check.id,
+            models.Position.check_created_at == models.Check.created_at,
+        ))
+        .group_by(models.Check.user_id, day, models.Position.name)
+    )
+    if since:
+        # on both sides, Postgres doesn't carry a range across the join to prune the positions partitions
+        stmt = stmt.where(models.Check.created_at >= since, models.Position.check_created_at >= since)
+    return stmt
+
+def _fresh_basket_rollups(since: Optional[date]):
+    # Same for the basket rollups, in BASKET_ROLLUP_COLUMNS order.
+    # Outer joined: a check without positions is a basket of size 0, counted in the smallest bucket like on create.
+    position_matches = [
+        models.Position.check_id == models.Check.id,
+        models.Position.check_created_at == models.Check.created_at,
+    ]
+    if since:
+        position_matches.append(models.Position.check_created_at >= since)
+    baskets = (
+        select(
+            models.Check.user_id,
+            cast(models.Check.created_at, Date).label("day"),
+            func.count(models.Position.id).label("positions_count"),
+            func.coalesce(func.sum(models.Position.quantity), 0).label("items"),
+            models.Check.total,
+        )
+        .outerjoin(models.Position, and_(*position_matches))
+        .group_by(models.Check.id, models.Check.created_at)
+    )
+    if since:
+        baskets = baskets.where(models.Check.created_at >= since)
+    baskets = baskets.subquery()
+    basket_size = case(
+        *((baskets.c.positions_count >= bucket, bucket) for bucket in reversed(BASKET_SIZE_BUCKETS[1:])),
+        else_=BASKET_SIZE_BUCKETS[0],
+    )
+    return (
+        select(
+            baskets.c.user_id, baskets.c.day, basket_size.label("basket_size"),
+            func.count().label("checks_count"),
+            func.sum(baskets.c.positions_count).label("positions_count"),
+            func.sum(baskets.c["items"]).label("items"),
+            func.sum(baskets.c.total).label("revenue"),
+        )
+        .group_by(baskets.c.user_id, baskets.c.day, basket_size)
+    )
+
+async def _analytics_since() -> Optional[date]:
+    # Archived months are no longer in the database, their rollups can be neither rebuilt nor checked
+    archived = await asyncio.to_thread(archive.archived_months)
+    return add_months(archived[-1], 1) if archived else None
+
+@observe_query
+async def rebuild_analytics_rollups():
+    # Recomputes the product and basket rollups from the checks in one transaction, then compacts them
+    since = await _analytics_since()
+    daily, monthly, baskets = models.ProductDailyRollup, models.ProductMonthlyRollup, models.BasketDailyRollup
+    async with get_session() as session:
+        async with session.begin():
+            if since:
+                await session.execute(delete(daily).where(daily.day >= since))
+                await session.execute(delete(monthly).where(monthly.month >= since))
+                await session.execute(delete(baskets).where(baskets.day >= since))
+            else:
+                await session.execute(delete(daily))
+                await session.execute(delete(monthly))
+                await session.execute(delete(baskets))
+            await session.execute(
+                insert(daily).from_select(list(PRODUCT_ROLLUP_COLUMNS), _fresh_product_rollups(since))
+            )
+            await session.execute(
+                insert(baskets).from_select(list(BASKET_ROLLUP_COLUMNS), _fresh_basket_rollups(since))
+            )
+            await session.execute(_compact_product_rollups_stmt(product_rollup_cutoff()))
+
+def _mismatches_stmt(stored, fresh, keys: list[str], counts: list[str], amount: str):
+    # Count of keys whose stored and fresh sums differ, either side missing included.
+    # Float sums depend on the order they're added in, a cent of difference is tolerated.
+    joined = stored.join(fresh, and_(*(stored.c[key] == fresh.c[key] for key in keys)), full=True)
+    return select(func.count()).select_from(joined).where(or_(
+        *(stored.c[count].is_distinct_from(fresh.c[count]) for count in counts),
+        func.abs(func.coalesce(stored.c[amount], 0) - func.coalesce(fresh.c[amount], 0)) > 0.01,
+    ))
+
+def _product_months(rows, month):
+    return (
+        select(
+            rows.c.user_id, month.label("month"), rows.c.name, func.sum(rows.c.quantity).label("quantity"),
+            func.sum(rows.c.revenue).label("revenue"), func.sum(rows.c.positions_count).label("positions_count"),
+        )
+        .group_by(rows.c.user_id, month, rows.c.name)
+        .subquery()
+    )
+
+@observe_query
+async def verify_analytics_rollups() -> dict[str, int]:
+    # Compares the rollups with ones computed afresh, without writing anything.
+    # Returns the mismatching product months (a month is compared whole, compacted or not) and basket days.
+    since = await _analytics_since()
+    daily, monthly, baskets = models.ProductDailyRollup, models.ProductMonthlyRollup, models.BasketDailyRollup
+    stored_daily = select(
+        daily.user_id, cast(func.date_trunc("month", daily.day), Date).label("month"), daily.name,
+        daily.quantity, daily.revenue, daily.positions_count,
+    )
+    stored_monthly = select(
+        monthly.user_id, monthly.month, monthly.name, monthly.quantity, monthly.revenue, monthly.positions_count
+    )
+    stored_baskets = select(*(getattr(baskets, column) for column in BASKET_ROLLUP_COLUMNS))
+    if since:
+        stored_daily = stored_daily.where(daily.day >= since)
+        stored_monthly = stored_monthly.where(monthly.month >= since)
+        stored_baskets = stored_baskets.where(baskets.day >= since)
+    stored_products = union_all(stored_daily, stored_monthly).subquery()
+    fresh_products = _fresh_product_rollups(since).subquery()
+
+    async with get_session() as session:
+        products = await session.execute(_mismatches_stmt(
+            _product_months(stored_products, stored_products.c.month),
+            _product_months(fresh_products, cast(func.date_trunc("month", fresh_products.c.day), Date)),
+            ["user_id", "month", "name"], ["quantity", "positions_count"], "revenue",
+        ))
+        basket_days = await session.execute(_mismatches_stmt(
+            stored_baskets.subquery(), _fresh_basket_rollups(since).subquery(),
+            ["user_id", "day", "basket_size"], ["checks_count", "positions_count", "items"], "revenue",
+        ))
+        return {"products": products.scalar_one(), "baskets": basket_days.scalar_one()}
+
+async def stream_partition_json(month: date, batch_size: int = 5000) -> AsyncIterator[Sequence[str]]:
+    # Every check of a detached month as a JSON line (CheckResponse plus user_id), sorted by id for app.archive
+    suffix = partition_suffix(month)
+    stmt = text(
+        f"""
+        SELECT json_build_object(
+            'id', c.id,
+            'positions', coalesce((
+                SELECT json_agg(json_build_object(
+                    'name', p.name, 'price', p.price, 'quantity', p.quantity, 'total', p.total
+                ) ORDER BY p.id)
+                FROM positions{suffix} p WHERE p.check_id = c.id
+            ), '[]'::json),
+            'payment', (
+                SELECT json_build_object('type', p.type, 'amount', p.amount)
+                FROM payments{suffix} p WHERE p.check_id = c.id LIMIT 1
+            ),
+            'total', c.total,
+            'rest', c.rest,
+            -- to the microsecond, json would trim trailing zeros
+            'created_at', to_char(c.created_at, 'YYYY-MM-DD"T"HH24:MI:SS.US'),
+            'user_id', c.user_id
+        )::text
+        FROM checks{suffix} c
+        ORDER BY c.id
+        """
+    ).execution_options(yield_per=batch_size)
+    async with get_session() as session:
+        result = await session.stream(stmt)
+        async for lines in result.scalars().partitions():
+            yield lines
+
+async def archive_old_partitions(keep_months: int) -> list[tuple[date, int]]:
+    # Moves every month older than the last keep_months out of the database into the archive:
+    # detach, export, check the archive has every check of the partition, drop.
+    # Each step can be repeated, an interrupted run is picked up by the next one.
+    cutoff = add_months(month_start(datetime.now(timezone.utc).date()), -max(keep_months, 1))
+    archived = []
+    for month in await get_partition_months():
+        if month >= cutoff:
+            continue
+        await detach_partitions(month)
+        count = await asyncio.to_thread(archive.archived_count, month)
+        if count is None:
+            count = await archive.write_month(month, stream_partition_json(month))
+        async with get_session() as session:
+            result = await session.execute(text(f"SELECT count(*) FROM checks{partition_suffix(month)}"))
+            expected = result.scalar_one()
+        if count != expected:
+            raise RuntimeError(f"The archive of {month:%Y-%m} has {count} checks, the partition {expected}")
+        await drop_partitions(month)
+        archived.append((month, count))
+    return archived
+
+async def maintain_partitions() -> Optional[list[tuple[date, int]]]:
+    # Creates the coming months' partitions, compacts the product rollups and archives the expired months,
+    # returns the archived ones.
+    # None when another process holds the maintenance lock.
+    async with maintenance_lock() as acquired:
+        if not acquired:
+            return None
+        this_month = month_start(datetime.now(timezone.utc).date())
+        await ensure_partitions(this_month, add_months(this_month, settings.PARTITION_PREMAKE_MONTHS))
+        await compact_product_rollups()
+        if not settings.ARCHIVE_AFTER_MONTHS:
+            return []
+        return await archive_old_partitions(settings.ARCHIVE_AFTER_MONTHS)
 
+@observe_query
 async def get_user_by_login(login: str):
+    # always the primary, sign in must never see a replaced password hash or miss a new account
     async with get_session() as session:
         stmt = select(models.User).where(models.User.login == login)
         result = await session.execute(stmt)
@@ -111,14 +1172,109 @@ async def get_user_by_login(login: str):
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
         return user
     
+@observe_query
 async def get_public_user(user_id: int):
-    async with get_session() as session:
-        stmt = select(models.User).where(models.User.id == user_id)
+    stmt = select(models.User).where(models.User.id == user_id)
+
+    async def read(session: AsyncSession):
         result = await session.execute(stmt)
-        user = result.scalar_one()
+        user = result.scalar_one_or_none()
         if user:
             return models.UserPublic.model_validate(user)
         else:
             return None
-        
-    
\ No newline at end of file
+    return await _read_or_primary(read, user_id)
+
+@observe_query
+async def update_user(user_id: int, **values):
+    # Every change to a user goes through here so every worker drops its cached UserPublic
+    async with get_session() as session:
+        stmt = (
+            update(models.User)
+            .where(models.User.id == user_id)
+            .values(**values, updated_at=datetime.now(timezone.utc).replace(tzinfo=None))
+        )
+        await session.execute(stmt)
+        # delivered to every worker on commit, this one drops its copy right away
+        await session.execute(
+            text("SELECT pg_notify(:channel, :payload)"),
+            {"channel": USERS_CHANNEL, "payload": json.dumps([user_id, "name" in values])},
+        )
+        await session.commit()
+    invalidate_user(user_id, "name" in values)
+
+async def explain_main_queries() -> dict[str, dict[str, list[str]]]:
+    # EXPLAIN of the hot queries with sequential scans disabled: if one still shows up, no index can serve it.
+    # Returns by query name the tables scanned sequentially ("seq_scans") and the indexes used ("indexes"),
+    # a partition's index under the name of the partitioned table's index it belongs to.
+    some_id = uuid.uuid4()
+    users_checks_params = _users_checks_params(
+        1, models.DatePreset.LAST_MONTH, None, None, models.PaymentType.CASH, limit=100, cursor=(datetime.now(), some_id)
+    )
+    position_params = _search_params("milk", models.SearchMode.SUBSTRING)
+    search_params = {**users_checks_params, **position_params}
+    queries = {
+        "get_all_users_checks": (_users_checks_stmt(frozenset(users_checks_params)), users_checks_params),
+        "get_all_users_checks_json": (_users_checks_json_stmt(frozenset(users_checks_params)), users_checks_params),
+        "search_users_checks": (_search_checks_stmt(frozenset(search_params)), search_params),
+        "search_users_positions": (
+            _search_positions_stmt(frozenset(position_params)).params(
+                **position_params, check_ids=[some_id],
+                page_from=datetime.now() - timedelta(days=1), page_to=datetime.now(),
+            ),
+            None,
+        ),
+        "get_check_by_id": (select(models.Check).where(models.Check.id == some_id), None),
+        "positions_by_check_id": (select(models.Position).where(models.Position.check_id.in_([some_id])), None),
+        "get_check_positions": (
+            select(models.Position)
+            .where(models.Position.check_id == some_id, models.Position.id > 0)
+            .order_by(models.Position.id)
+            .limit(1000),
+            None,
+        ),
+        "payment_by_check_id": (select(models.Payment).where(models.Payment.check_id.in_([some_id])), None),
+        "get_user_by_login": (select(models.User).where(models.User.login == "login"), None),
+        "get_users_top_products": (_product_rollups_stmt(1, date.today() - timedelta(days=30), date.today()), None),
+    }
+    plans = {}
+    async with get_session() as session:
+        async with session.begin():
+            await session.execute(text("SET LOCAL enable_seqscan = off"))
+            connection = await session.connection()
+            for name, (stmt, params) in queries.items():
+                compiled = stmt.compile(dialect=connection.dialect, compile_kwargs={"render_postcompile": True})
+                values = compiled.construct_params(params)
+                positional = tuple(values[param] for param in compiled.positiontup)
+                result = await connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", positional)
+                plans[name] = result.scalar_one()[0]["Plan"]
+            index_names = {index for plan in plans.values() for index in _find_plan_values(plan, "Index Name")}
+            parents = dict((await session.execute(_parent_indexes_stmt, {"names": list(index_names)})).all())
+    return {
+        name: {
+            "seq_scans": _find_plan_values(plan, "Relation Name", "Seq Scan"),
+            "indexes": sorted({parents.get(index, index) for index in _find_plan_values(plan, "Index Name")}),
+        }
+        for name, plan in plans.items()
+    }
+
+# Each index with the topmost one it is attached to, partitions' indexes are attached to their parent's
+_parent_indexes_stmt = text("""
+    WITH RECURSIVE ancestors AS (
+        SELECT oid AS index_oid, oid AS ancestor_oid FROM pg_class WHERE relname = ANY(:names)
+        UNION ALL
+        SELECT ancestors.index_oid, pg_inherits.inhparent
+        FROM ancestors JOIN pg_inherits ON pg_inherits.inhrelid = ancestors.ancestor_oid
+    )
+    SELECT index_class.relname, ancestor_class.relname
+    FROM ancestors
+    JOIN pg_class index_class ON index_class.oid = ancestors.index_oid
+    JOIN pg_class ancestor_class ON ancestor_class.oid = ancestors.ancestor_oid
+    WHERE NOT EXISTS (SELECT 1 FROM pg_inherits WHERE pg_inherits.inhrelid = ancestors.ancestor_oid)
+""")
+
+def _find_plan_values(plan: dict, key: str, node_type: Optional[str] = None) -> list[str]:
+    values = [plan[key]] if key in plan and node_type in (None, plan["Node Type"]) else []
+    for subplan in plan.get("Plans", []):
+        values.extend(_find_plan_values(subplan, key, node_type))
+    return values
@@ -1,19 +1,98 @@
-from fastapi import FastAPI
+import time
+IMPORT_STARTED = time.perf_counter() # taken before the imports below, cold start includes them
+
+from fastapi import FastAPI, Request
 from starlette.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 from typing import AsyncIterator
+import asyncio
+import logging
+import math
 
+from app import crud
 from app.api.main import router
-from app.core.db import init_db
+from app.api.routes import metrics
+from app.core.admission import AdmissionMiddleware
+from app.core.compression import CompressionMiddleware
+from app.core.config import settings
+from app.core.metrics import APP_STARTUP_SECONDS, HTTP_REQUEST_QUERIES, HTTP_REQUEST_SECONDS
+from app.core.request_stats import RequestStats, log_request, request_stats
+from app.core.db import LAST_WRITE_COOKIE, LAST_WRITE_HEADER, LastWrite, dispose_engines, last_write
+from app.core.feed import check_feed
+from app.core.group_commit import check_committer
+from app.core.migrations import migrate
+from app.core.security import password_hasher
+
+logging.basicConfig(level=settings.LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+async def maintain_partitions():
+    # every worker runs it, the maintenance lock lets one of them do the work
+    logger = logging.getLogger("app.partitions")
+    while True:
+        try:
+            for month, count in await crud.maintain_partitions() or []:
+                logger.info("Archived %s: %d checks", month.strftime("%Y-%m"), count)
+        except Exception:
+            logger.exception("Partition maintenance failed")
+        await asyncio.sleep(settings.PARTITION_MAINTENANCE_INTERVAL_SECONDS)
 
 @asynccontextmanager
 async def lifespan(_: FastAPI) -> AsyncIterator[None]:
-    await init_db() # initialize the database on startup
+    if settings.MIGRATE_ON_STARTUP:
+        await migrate() # bring the database schema up to date on startup
+    await password_hasher.start()
+    startup_seconds = time.perf_counter() - IMPORT_STARTED
+    APP_STARTUP_SECONDS.set(startup_seconds)
+    logging.getLogger("uvicorn.error").info("Started in %.3fs", startup_seconds)
+    partition_maintenance = asyncio.create_task(maintain_partitions())
+    await check_feed.start()
     yield
+    partition_maintenance.cancel()
+    await check_feed.stop()
+    await check_committer.stop()
+    password_hasher.shutdown()
+    await dispose_engines()
 
 app = FastAPI(lifespan=lifespan, title="Check API", version="1.0.0")
 
+# innermost, added first: behind instrument_request every body would arrive as a stream and skip the size threshold
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=settings.COMPRESSION_MIN_SIZE,
+    gzip_level=settings.COMPRESSION_GZIP_LEVEL,
+    brotli_quality=settings.COMPRESSION_BROTLI_QUALITY,
+)
+
+# streamed responses keep their admission slot until the last chunk is sent
+app.add_middleware(AdmissionMiddleware)
+
 app.include_router(router, prefix="/api")
+app.include_router(metrics.router)
+
+@app.middleware("http")
+async def instrument_request(request: Request, call_next):
+    stats = RequestStats()
+    request_stats.set(stats)
+    request_write = LastWrite(request.cookies.get(LAST_WRITE_COOKIE) or request.headers.get(LAST_WRITE_HEADER))
+    last_write.set(request_write)
+    response = await call_next(request)
+    if request_write.changed:
+        value = f"{request_write.written_at:.3f}"
+        response.headers[LAST_WRITE_HEADER] = value
+        response.set_cookie(
+            LAST_WRITE_COOKIE, value, max_age=math.ceil(settings.READ_YOUR_WRITES_SECONDS), httponly=True, samesite="lax"
+        )
+    seconds = time.perf_counter() - stats.started
+    # the route template, not the raw path, to keep label cardinality bounded
+    route = request.scope.get("route")
+    route = route.path if route else "unmatched"
+    HTTP_REQUEST_SECONDS.labels(request.method, route, response.status_code).observe(seconds)
+    HTTP_REQUEST_QUERIES.labels(route).observe(stats.queries)
+    # streamed bodies are still being produced here, their timings cover the handler only
+    if settings.SERVER_TIMING:
+        response.headers["Server-Timing"] = stats.server_timing(seconds)
+    log_request(stats, request.method, route, response.status_code, seconds)
+    return response
 
 app.add_middleware(
     CORSMiddleware,
@@ -21,4 +100,5 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Server-Timing", "ETag", LAST_WRITE_HEADER],
 )
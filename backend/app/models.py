@@ -1,6 +1,7 @@
 from sqlmodel import SQLModel, Field, Relationship
 from pydantic import BaseModel
-from datetime import datetime, timezone
+from sqlalchemy import Index
+from datetime import date, datetime, timezone
 from enum import Enum
 from typing import Optional, List
 import uuid
@@ -18,6 +19,19 @@ class DatePreset(str, Enum):
     LAST_MONTH = "last_month"
     LAST_YEAR = "last_year"
 
+class ExportFormat(str, Enum):
+    NDJSON = "ndjson"
+    CSV = "csv"
+
+class SearchMode(str, Enum):
+    PREFIX = "prefix" # the name or one of its words starts with the query
+    SUBSTRING = "substring"
+    FUZZY = "fuzzy" # trigram word similarity, tolerates typos
+
+class ProductOrder(str, Enum):
+    REVENUE = "revenue"
+    QUANTITY = "quantity"
+
 ##### USER MODELS #####
 class UserPublic(SQLModel):
     id: int
@@ -33,6 +47,9 @@ class UserPublic(SQLModel):
 
 class User(SQLModel, table=True):
     __tablename__ = "users"
+    __table_args__ = (
+        Index("ux_users_login", "login", unique=True),
+    )
 
     id: int = Field(default=None, primary_key=True)
     name: str
@@ -45,21 +62,33 @@ class User(SQLModel, table=True):
     checks: Optional[list["Check"]] = Relationship(back_populates="user")
 
 ##### CHECK MODELS #####
+POSITION_NAME_MAX_LENGTH = 255
+
 class PositionBase(SQLModel):
     name: str = Field(..., description="Name of the position")
     price: float = Field(..., ge=0.01, description="Price of the position")
     quantity: int = Field(..., ge=1, description="Quantity of the position")
 
+class PositionRequest(PositionBase):
+    # the name is part of the product rollups' primary key, unbounded it could outgrow a btree entry.
+    # New positions only, older ones may be longer and are still returned as they are.
+    name: str = Field(..., max_length=POSITION_NAME_MAX_LENGTH, description="Name of the position")
+
 class PositionResponse(PositionBase):
     total: float
 
 class Position(PositionBase, table=True):
     __tablename__ = "positions"
+    __table_args__ = (
+        Index("ix_positions_check_id_id", "check_id", "id"),
+        Index("ix_positions_name_trgm", "name", postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"}),
+    )
 
     id: int = Field(default=None, primary_key=True)
     total: float = Field(ge=0.01)
 
     check_id: uuid.UUID = Field(foreign_key="checks.id")
+    check_created_at: datetime # partition key, a copy of the check's created_at
     check: "Check" = Relationship(back_populates="positions")
     
 
@@ -74,23 +103,30 @@ class Payment(PaymentBase, table=True):
     __tablename__ = "payments"
 
     id: int = Field(default=None, primary_key=True)
-    check_id: uuid.UUID = Field(foreign_key="checks.id")
+    check_id: uuid.UUID = Field(foreign_key="checks.id", index=True)
+    check_created_at: datetime # partition key, a copy of the check's created_at
     check: "Check" = Relationship(back_populates="payment")
 
 class CheckRequest(SQLModel):
-    positions: List[PositionBase] = Field(..., description="List of positions in the check")
+    positions: List[PositionRequest] = Field(..., description="List of positions in the check")
     payment: PaymentBase = Field(..., description="Payment details for the check")
 
 
 class Check(SQLModel, table=True):
+    # indexes and partitions here mirror app.core.migrations, which is what actually creates them.
+    # In the database the primary key is (id, created_at), ids of new checks are UUIDv7 carrying created_at.
     __tablename__ = "checks"
+    __table_args__ = (
+        Index("ix_checks_user_id_created_at_id", "user_id", "created_at", "id"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
 
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     positions: Optional[list[Position]] = Relationship(back_populates="check")
     payment: Optional[Payment] = Relationship(back_populates="check")
     total: float = Field(ge=0.01)
     rest: float = Field(ge=0.00)
-    created_at: datetime = Field(default=datetime.now(timezone.utc).replace(tzinfo=None))
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc).replace(tzinfo=None), index=True)
     
     user_id: int = Field(foreign_key="users.id")
     user: "User" = Relationship(back_populates="checks")
@@ -107,6 +143,127 @@ class CheckResponse(SQLModel):
         from_attributes = True
         arbitrary_types_allowed = True
 
+class CheckSummaryResponse(SQLModel):
+    # a check without its positions, for checks too large to send whole (see /check/positions)
+    id: uuid.UUID
+    positions_count: int
+    payment: PaymentResponse
+    total: float
+    rest: float
+    created_at: datetime
+
+##### SEARCH MODELS #####
+
+class PositionSearchResponse(PositionResponse):
+    hit: bool = False
+    highlights: list[tuple[int, int]] = [] # [start, end) character spans of name that match the query
+
+class CheckSearchResponse(CheckResponse):
+    positions: list[PositionSearchResponse]
+
+
+##### STATS MODELS #####
+class CheckDailyRollup(SQLModel, table=True):
+    # Maintained in the same transaction as check creation, rebuilt by `python -m app.commands backfill-rollups`
+    __tablename__ = "check_daily_rollups"
+
+    user_id: int = Field(foreign_key="users.id", primary_key=True)
+    day: date = Field(primary_key=True)
+    payment_type: str = Field(primary_key=True)
+    checks_count: int = Field(default=0)
+    revenue: float = Field(default=0)
+
+class ProductDailyRollup(SQLModel, table=True):
+    # Quantity and revenue per position name, maintained with CheckDailyRollup.
+    # Days older than PRODUCT_ROLLUP_DAILY_MONTHS are compacted into ProductMonthlyRollup.
+    __tablename__ = "product_daily_rollups"
+
+    user_id: int = Field(foreign_key="users.id", primary_key=True)
+    day: date = Field(primary_key=True)
+    name: str = Field(primary_key=True)
+    quantity: int = Field(default=0)
+    revenue: float = Field(default=0)
+    positions_count: int = Field(default=0)
+
+class ProductMonthlyRollup(SQLModel, table=True):
+    __tablename__ = "product_monthly_rollups"
+
+    user_id: int = Field(foreign_key="users.id", primary_key=True)
+    month: date = Field(primary_key=True) # first day of the month
+    name: str = Field(primary_key=True)
+    quantity: int = Field(default=0)
+    revenue: float = Field(default=0)
+    positions_count: int = Field(default=0)
+
+class BasketDailyRollup(SQLModel, table=True):
+    # Checks per basket size bucket, the lower bound of one of app.utils.BASKET_SIZE_BUCKETS
+    __tablename__ = "basket_daily_rollups"
+
+    user_id: int = Field(foreign_key="users.id", primary_key=True)
+    day: date = Field(primary_key=True)
+    basket_size: int = Field(primary_key=True)
+    checks_count: int = Field(default=0)
+    positions_count: int = Field(default=0)
+    items: int = Field(default=0) # sum of the positions' quantities
+    revenue: float = Field(default=0)
+
+class PaymentTypeStats(SQLModel):
+    checks_count: int = 0
+    revenue: float = 0
+
+class DailyStats(PaymentTypeStats):
+    day: date
+    by_payment_type: dict[str, PaymentTypeStats] = {}
+
+class CheckStats(PaymentTypeStats):
+    date_from: Optional[date]
+    date_to: Optional[date]
+    by_payment_type: dict[str, PaymentTypeStats] = {}
+    days: list[DailyStats] = []
+
+class ProductStats(SQLModel):
+    name: str
+    quantity: int
+    revenue: float
+    positions_count: int
+
+class ProductRanking(SQLModel):
+    # the range actually covered, compacted months only count whole
+    date_from: Optional[date]
+    date_to: Optional[date]
+    products: list[ProductStats] = []
+
+class BasketSizeBucket(SQLModel):
+    min_size: int
+    max_size: Optional[int] # inclusive, None for the last bucket
+    checks_count: int = 0
+    revenue: float = 0
+
+class BasketStats(SQLModel):
+    date_from: Optional[date]
+    date_to: Optional[date]
+    checks_count: int = 0
+    positions_count: int = 0
+    items: int = 0
+    revenue: float = 0
+    average_positions: float = 0
+    average_items: float = 0
+    average_check: float = 0
+    buckets: list[BasketSizeBucket] = []
+
+class ProductComparison(SQLModel):
+    name: str
+    quantity: int = 0
+    revenue: float = 0
+    previous_quantity: int = 0
+    previous_revenue: float = 0
+    revenue_change: Optional[float] = None # relative, None when there was no previous revenue
+
+class PeriodComparison(SQLModel):
+    current: BasketStats
+    previous: BasketStats
+    products: list[ProductComparison] = []
+
 ##### OTHER #####
 class TokenPayload(SQLModel):
     sub: str
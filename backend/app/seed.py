@@ -0,0 +1,100 @@
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate
+import math
+import random
+import time
+import uuid
+
+from app import crud, models
+from app.core.partitions import ensure_partitions
+from app.core.security import pwd_context
+from app.utils import uuid7
+
+# Synthetic data generator, deterministic for a given seed.
+# Shapes roughly follow production: a few heavy users own most checks (Zipf), baskets are mostly small,
+# prices are log-normal, popular products repeat and most checks happen during business hours.
+
+BRANDS = ["Galychyna", "Roshen", "Yagotynske", "Lviv", "Morshynska", "Zhytomyr", "Svitoch", "Obolon", "Chumak", "Kyiv"]
+PRODUCTS = [
+    "milk 2.5%", "kefir", "butter", "cheese", "yogurt", "bread", "baguette", "buckwheat", "rice", "pasta",
+    "sugar", "salt", "coffee", "tea", "chocolate", "cookies", "water", "juice", "beer", "apples",
+    "bananas", "potatoes", "onions", "tomatoes", "cucumbers", "eggs", "chicken", "sausage", "ham", "fish",
+]
+CATALOG = [f"{brand} {product}" for brand in BRANDS for product in PRODUCTS]
+BUSINESS_HOURS_WEIGHTS = [1, 1, 1, 1, 1, 2, 4, 8, 12, 14, 15, 16, 18, 17, 15, 15, 16, 19, 20, 17, 12, 8, 4, 2]
+USERS_PER_INSERT = 10_000
+
+
+def _zipf_cum_weights(n: int, exponent: float) -> list[float]:
+    return list(accumulate(1 / (rank + 1) ** exponent for rank in range(n)))
+
+
+def _position(rng: random.Random, catalog_weights: list[float]) -> tuple[str, float, int]:
+    name = rng.choices(CATALOG, cum_weights=catalog_weights)[0]
+    price = max(round(rng.lognormvariate(3.5, 1.0), 2), 0.01)
+    quantity = 1 if rng.random() < 0.75 else rng.randint(2, 6)
+    return name, price, quantity
+
+
+def _payment(rng: random.Random, total: float) -> tuple[str, float]:
+    if rng.random() < 0.65:
+        return models.PaymentType.CASHLESS.value, total
+    # cash is handed over in notes, so there usually is some change
+    note = rng.choice([10, 50, 100, 200, 500])
+    return models.PaymentType.CASH.value, float(math.ceil(total / note) * note)
+
+
+async def seed(users: int, checks: int, seed: int = 0, days: int = 365, chunk_size: int = 5000) -> dict:
+    rng = random.Random(seed)
+    start = time.perf_counter()
+
+    # one bcrypt hash shared by everyone, the password is "password"
+    password = pwd_context.hash("password")
+    prefix = f"seed{seed}-{uuid.UUID(int=rng.getrandbits(128)).hex[:8]}"
+    user_ids = []
+    for offset in range(0, users, USERS_PER_INSERT):
+        numbers = range(offset, min(offset + USERS_PER_INSERT, users))
+        user_ids += await crud.create_users(
+            [f"Seed user {number}" for number in numbers],
+            [f"{prefix}-{number}" for number in numbers],
+            password,
+        )
+
+    user_weights = _zipf_cum_weights(len(user_ids), 1.1)
+    catalog_weights = _zipf_cum_weights(len(CATALOG), 0.8)
+    today = datetime.now(timezone.utc).replace(tzinfo=None, hour=0, minute=0, second=0, microsecond=0)
+    await ensure_partitions((today - timedelta(days=days)).date(), today.date())
+    positions_count = 0
+
+    for offset in range(0, checks, chunk_size):
+        check_records, position_records, payment_records = [], [], []
+        for user_id in rng.choices(user_ids, cum_weights=user_weights, k=min(chunk_size, checks - offset)):
+            # any past day, at a business-hours-weighted time of that day
+            created_at = today - timedelta(days=1 + rng.randrange(days)) + timedelta(
+                hours=rng.choices(range(24), weights=BUSINESS_HOURS_WEIGHTS)[0],
+                seconds=rng.randrange(3600),
+            )
+            check_id = uuid7(created_at, rng.getrandbits(74))
+            total = 0.0
+            for _ in range(min(1 + int(rng.expovariate(1 / 3)), 60)):
+                name, price, quantity = _position(rng, catalog_weights)
+                position_total = round(price * quantity, 2)
+                total += position_total
+                position_records.append((name, price, quantity, position_total, check_id, created_at))
+            total = round(total, 2)
+            payment_type, amount = _payment(rng, total)
+            check_records.append((check_id, total, round(amount - total, 2), created_at, user_id))
+            payment_records.append((payment_type, amount, check_id, created_at))
+
+        positions_count += len(position_records)
+        await crud.copy_checks(check_records, position_records, payment_records)
+
+    elapsed = time.perf_counter() - start
+    return {
+        "users": len(user_ids),
+        "checks": checks,
+        "positions": positions_count,
+        "login_prefix": prefix,
+        "seconds": round(elapsed, 2),
+        "checks_per_second": round(checks / elapsed) if elapsed else None,
+    }
@@ -0,0 +1,74 @@
+import argparse
+import asyncio
+import os
+import tempfile
+
+import uvicorn
+
+from app.core.config import settings
+
+# Production entry point: migrates the database once, then serves app.main:app from several uvicorn workers.
+# Workers are spawned, not forked, so each one builds its own engine, pools, caches and hash pool.
+# Every worker has DB_POOL_SIZE + DB_MAX_OVERFLOW connections, size max_connections in Postgres accordingly.
+
+
+def available_cores() -> int:
+    # honours CPU affinity (taskset, cpusets), unlike os.cpu_count()
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+async def migrate_once():
+    from app.core.db import dispose_engines
+    from app.core.migrations import migrate
+
+    for migration in await migrate():
+        print(f"Applied migration {migration.version}: {migration.name}")
+    await dispose_engines()
+
+
+def trusted_proxies() -> list[str]:
+    proxies = [address.strip() for address in settings.SERVER_TRUSTED_PROXIES.split(",") if address.strip()]
+    if "*" in proxies:
+        raise SystemExit("SERVER_TRUSTED_PROXIES can't be *, list the addresses of the proxies in front of the app")
+    return proxies
+
+
+def main(args: argparse.Namespace):
+    cores = available_cores()
+    proxies = trusted_proxies()
+    workers = args.workers or settings.SERVER_WORKERS or cores
+
+    with tempfile.TemporaryDirectory(prefix="prometheus-") as metrics_dir:
+        # set before anything imports the metrics, spawned workers inherit the environment
+        os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", metrics_dir)
+        # split the cores between the workers' password hashing pools instead of giving each worker all of them
+        os.environ.setdefault("SECURITY_HASH_POOL_SIZE", str(max(cores // workers, 1)))
+        # the schema is brought up to date here, before any worker accepts traffic
+        asyncio.run(migrate_once())
+        os.environ["MIGRATE_ON_STARTUP"] = "false"
+
+        uvicorn.run(
+            "app.main:app",
+            host=args.host,
+            port=args.port,
+            workers=workers,
+            loop="uvloop",
+            http="httptools",
+            timeout_graceful_shutdown=settings.SERVER_GRACEFUL_TIMEOUT,
+            # client addresses key the rate limits, they are taken from X-Forwarded-For of known proxies only
+            proxy_headers=bool(proxies),
+            forwarded_allow_ips=proxies or None,
+        )
+
+
+parser = argparse.ArgumentParser(prog="python -m app.server", description="Run the API with several workers")
+parser.add_argument("--host", default=settings.SERVER_HOST)
+parser.add_argument("--port", type=int, default=settings.SERVER_PORT)
+parser.add_argument("--workers", type=int, default=0, help="defaults to SERVER_WORKERS, then one per core")
+
+
+if __name__ == "__main__":
+    main(parser.parse_args())
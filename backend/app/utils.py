@@ -1,4 +1,189 @@
-from app.models import Check, PaymentType
+from typing import AsyncIterator, Iterable, Optional
+from bisect import bisect_right
+from datetime import date, datetime, timedelta, timezone
+import base64
+import hashlib
+import json
+import os
+import re
+import uuid
+
+from app.core.config import settings
+from app.models import Check, CheckRequest, DatePreset, Payment, PaymentType, Position, SearchMode
+
+EPOCH = datetime(1970, 1, 1)
+
+# Lower bounds of the basket size buckets, in positions per check, the last one is open ended.
+# Rollups store the bucket, changing these needs `python -m app.commands rebuild-analytics`.
+BASKET_SIZE_BUCKETS = (1, 2, 3, 4, 5, 6, 8, 11, 16, 21, 31, 51, 101, 1001)
+
+DATE_PRESET_DAYS = {
+    DatePreset.TODAY: 0,
+    DatePreset.LAST_3_DAYS: 3,
+    DatePreset.LAST_7_DAYS: 7,
+    DatePreset.LAST_MONTH: 30,
+    DatePreset.LAST_YEAR: 365,
+}
+
+def get_date_preset_range(date_preset: DatePreset) -> tuple[Optional[datetime], Optional[datetime]]:
+    # Half-open [start, end) range of naive UTC timestamps, compared to created_at as is so indexes apply.
+    # (None, None) for all time.
+    if date_preset == DatePreset.ALL:
+        return None, None
+    today = datetime.now(timezone.utc).replace(tzinfo=None, hour=0, minute=0, second=0, microsecond=0)
+    return today - timedelta(days=DATE_PRESET_DAYS[date_preset]), today + timedelta(days=1)
+
+def get_date_range(date_from: Optional[date], date_to: Optional[date]) -> tuple[Optional[datetime], Optional[datetime]]:
+    # Same half-open range for explicit days, both inclusive, either one may be left open
+    start = date_from and datetime.combine(date_from, datetime.min.time())
+    end = date_to and datetime.combine(date_to + timedelta(days=1), datetime.min.time())
+    return start, end
+
+def basket_size_bucket(positions_count: int) -> int:
+    return BASKET_SIZE_BUCKETS[max(bisect_right(BASKET_SIZE_BUCKETS, positions_count) - 1, 0)]
+
+def uuid7(created_at: datetime, random_bits: Optional[int] = None) -> uuid.UUID:
+    # UUIDv7: 48 bits of unix milliseconds (of the naive UTC created_at), then random bits.
+    # Check ids carry their creation time, so a lookup by id can be narrowed to one partition.
+    milliseconds = (created_at - EPOCH) // timedelta(milliseconds=1)
+    if random_bits is None:
+        random_bits = int.from_bytes(os.urandom(10), "big")
+    rand_a, rand_b = random_bits >> 62 & 0xFFF, random_bits & (1 << 62) - 1
+    return uuid.UUID(int=milliseconds << 80 | 0x7 << 76 | rand_a << 64 | 0b10 << 62 | rand_b)
+
+def uuid7_created_at(check_id: uuid.UUID) -> Optional[datetime]:
+    # created_at to the millisecond for UUIDv7 ids, None for the older random ones
+    if check_id.version != 7:
+        return None
+    return EPOCH + timedelta(milliseconds=check_id.int >> 80)
+
+def parse_timestamp(value: str) -> datetime:
+    # A naive ISO timestamp as Postgres writes it, with the fraction's trailing zeros trimmed.
+    # fromisoformat only takes 3 or 6 fraction digits before Python 3.11.
+    whole, _, fraction = value.partition(".")
+    return datetime.strptime(whole, "%Y-%m-%dT%H:%M:%S").replace(microsecond=int(fraction.ljust(6, "0")))
+
+def get_check_totals(check_request: CheckRequest) -> tuple[list[float], float, float]:
+    # Returns positions totals, check total and rest, raises ValueError if the check is too large
+    # or the payment doesn't cover it. One pass over the positions, whatever their number.
+    if len(check_request.positions) > settings.CHECK_MAX_POSITIONS:
+        raise ValueError(f"A check can have at most {settings.CHECK_MAX_POSITIONS} positions")
+    position_totals = []
+    total = 0.0
+    for position in check_request.positions:
+        position_total = round(position.price * position.quantity, 2)
+        position_totals.append(position_total)
+        total += position_total
+    total = round(total, 2)
+    rest = round(check_request.payment.amount - total, 2)
+
+    if rest < 0:
+        raise ValueError("Payment amount is less than the total price of the check")
+    return position_totals, total, rest
+
+def build_check(user_id: int, check_request: CheckRequest) -> Check:
+    # Builds the check with its positions and payment in memory, ready to be inserted as is
+    position_totals, total, rest = get_check_totals(check_request)
+    created_at = datetime.now(timezone.utc).replace(tzinfo=None)
+    check = Check(id=uuid7(created_at), user_id=user_id, total=total, rest=rest, created_at=created_at)
+    check.positions = [
+        Position(**position.model_dump(), check_id=check.id, check_created_at=created_at, total=position_total)
+        for position, position_total in zip(check_request.positions, position_totals)
+    ]
+    check.payment = Payment(**check_request.payment.model_dump(), check_id=check.id, check_created_at=created_at)
+    return check
+
+def build_check_records(user_id: int, check_request: CheckRequest) -> tuple[tuple, list[tuple], tuple]:
+    # Same as build_check but as the plain tuples crud.copy_checks takes, without an ORM object per position
+    position_totals, total, rest = get_check_totals(check_request)
+    created_at = datetime.now(timezone.utc).replace(tzinfo=None)
+    check_id = uuid7(created_at)
+    return (
+        (check_id, total, rest, created_at, user_id),
+        [
+            (position.name, position.price, position.quantity, position_total, check_id, created_at)
+            for position, position_total in zip(check_request.positions, position_totals)
+        ],
+        (check_request.payment.type, check_request.payment.amount, check_id, created_at),
+    )
+
+async def iter_ndjson_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[tuple[int, bytes]]:
+    # Splits a streamed body into (line number, line) pairs without buffering more than one line
+    line_number = 0
+    # the pieces of a line spanning several chunks are joined once, when it ends, not chunk after chunk
+    pending = []
+    async for chunk in chunks:
+        *lines, rest = chunk.split(b"\n")
+        if lines:
+            lines[0] = b"".join([*pending, lines[0]])
+            pending.clear()
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                yield line_number, line
+        if rest:
+            pending.append(rest)
+    buffer = b"".join(pending)
+    if buffer.strip():
+        yield line_number + 1, buffer
+
+def encode_cursor(created_at: datetime, check_id: uuid.UUID) -> str:
+    # Opaque pagination cursor pointing right after the given check
+    raw = json.dumps([created_at.isoformat(), str(check_id)]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple[datetime, uuid.UUID]:
+    # Raises ValueError if the cursor is malformed
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, check_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), uuid.UUID(check_id)
+    except (TypeError, ValueError) as e:
+        raise ValueError("Invalid cursor") from e
+
+def ids_digest(check_ids: Iterable[uuid.UUID]) -> str:
+    # md5 of the comma separated ids, what crud._page_version computes in Postgres
+    return hashlib.md5(",".join(str(check_id) for check_id in check_ids).encode()).hexdigest()
+
+def make_page_etag(digest: str, newest: datetime) -> str:
+    # weak, the same checks make the same page whichever serializer and encoding produced the body
+    return f'W/"{newest:%Y%m%d%H%M%S%f}-{digest}"'
+
+def make_check_etag(check_id: uuid.UUID) -> str:
+    # checks never change, the id is enough
+    return f'W/"{check_id.hex}"'
+
+def make_receipt_etag(check_id: uuid.UUID, user_updated_at: datetime) -> str:
+    # the check never changes, the user's name printed on it may
+    return f'W/"{check_id.hex}-{user_updated_at:%Y%m%d%H%M%S%f}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    # If-None-Match uses the weak comparison, so W/ prefixes are ignored on both sides
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    etag = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+def _trigrams(word: str) -> set[str]:
+    # padded like pg_trgm does it
+    word = f"  {word.lower()} "
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+def get_highlights(name: str, query: str, mode: SearchMode) -> list[tuple[int, int]]:
+    # [start, end) spans of the position name that match the search query
+    if mode == SearchMode.FUZZY:
+        # Postgres doesn't tell which part matched, mark the words similar enough to a query word
+        query_trigrams = [_trigrams(word) for word in query.split()]
+        return [
+            match.span() for match in re.finditer(r"\w+", name)
+            if any(len(q & _trigrams(match.group())) / len(q | _trigrams(match.group())) >= 0.3 for q in query_trigrams)
+        ]
+    pattern = re.escape(query)
+    if mode == SearchMode.PREFIX:
+        pattern = f"(?:^|(?<= )){pattern}"
+    return [match.span() for match in re.finditer(pattern, name, re.IGNORECASE)]
 
 def get_receipt_text(check: Check):
     width = 40 # total width of the receipt
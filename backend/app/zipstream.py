@@ -0,0 +1,73 @@
+from datetime import datetime
+from typing import Iterator
+import struct
+import tempfile
+import zlib
+
+# Minimal ZIP writer for streaming responses: the archive is produced front to back, without seeking.
+# Members are added whole (receipts are small), so sizes and CRC go straight into the local headers.
+# The central directory, the only part of a ZIP that grows with the member count, is spooled to a temporary file.
+# Zip64 end records are written when the archive outgrows the classic limits (65535 members, 4 GiB).
+
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP64_COUNT_LIMIT = 0xFFFF
+UTF8_NAMES = 0x800
+DEFLATED = 8
+
+
+def _dos_datetime(moment: datetime) -> tuple[int, int]:
+    time = moment.hour << 11 | moment.minute << 5 | moment.second // 2
+    date = (max(moment.year, 1980) - 1980) << 9 | moment.month << 5 | moment.day
+    return time, date
+
+
+class ZipStream:
+    def __init__(self, compresslevel: int = 6):
+        self.compresslevel = compresslevel
+        self._offset = 0
+        self._count = 0
+        self._central_directory = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+
+    def add(self, name: str, data: bytes, modified: datetime) -> bytes:
+        # Returns the bytes of the member, to be sent in order
+        compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS)
+        compressed = compressor.compress(data) + compressor.flush()
+        crc = zlib.crc32(data)
+        name_bytes = name.encode()
+        time, date = _dos_datetime(modified)
+
+        local_header = struct.pack(
+            "<4s5H3L2H", b"PK\x03\x04", 20, UTF8_NAMES, DEFLATED, time, date,
+            crc, len(compressed), len(data), len(name_bytes), 0,
+        )
+        offset, extra, version = self._offset, b"", 20
+        if offset >= ZIP64_LIMIT:
+            offset, extra, version = ZIP64_LIMIT, struct.pack("<2HQ", 1, 8, self._offset), 45
+        self._central_directory.write(struct.pack(
+            "<4s6H3L5H2L", b"PK\x01\x02", 3 << 8 | version, version, UTF8_NAMES, DEFLATED, time, date,
+            crc, len(compressed), len(data), len(name_bytes), len(extra), 0, 0, 0, 0o100644 << 16, offset,
+        ) + name_bytes + extra)
+
+        self._count += 1
+        member = local_header + name_bytes + compressed
+        self._offset += len(member)
+        return member
+
+    def close(self) -> Iterator[bytes]:
+        # Yields the central directory and the end records
+        start = self._offset
+        size = 0
+        self._central_directory.seek(0)
+        while block := self._central_directory.read(64 * 1024):
+            size += len(block)
+            yield block
+        self._central_directory.close()
+
+        count = self._count
+        if count >= ZIP64_COUNT_LIMIT or start >= ZIP64_LIMIT or size >= ZIP64_LIMIT:
+            yield struct.pack("<4sQ2H2L4Q", b"PK\x06\x06", 44, 3 << 8 | 45, 45, 0, 0, count, count, size, start)
+            yield struct.pack("<4sLQL", b"PK\x06\x07", 0, start + size, 1)
+        yield struct.pack(
+            "<4s4H2LH", b"PK\x05\x06", 0, 0, min(count, ZIP64_COUNT_LIMIT), min(count, ZIP64_COUNT_LIMIT),
+            min(size, ZIP64_LIMIT), min(start, ZIP64_LIMIT), 0,
+        )
@@ -0,0 +1,39 @@
+import argparse
+import json
+import sys
+
+# Compares two reports of benchmarks.run and exits with 1 if any route regressed beyond the threshold.
+
+HIGHER_IS_WORSE = ["p50_ms", "p95_ms", "p99_ms", "queries_per_request"]
+LOWER_IS_WORSE = ["throughput_rps"]
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> bool:
+    regressed = False
+    for name, result in current["results"].items():
+        before = baseline["results"].get(name)
+        if before is None:
+            print(f"{name}: not in the baseline")
+            continue
+        print(name)
+        for metric in HIGHER_IS_WORSE + LOWER_IS_WORSE:
+            old, new = before.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = change > threshold if metric in HIGHER_IS_WORSE else change < -threshold
+            regressed |= worse
+            print(f"  {metric:<20} {old:>10} -> {new:>10} ({change:+.1%}){'  REGRESSION' if worse else ''}")
+    return regressed
+
+
+parser = argparse.ArgumentParser(prog="python -m benchmarks.compare", description="Compare two benchmark reports")
+parser.add_argument("baseline")
+parser.add_argument("current")
+parser.add_argument("--threshold", type=float, default=0.1, help="relative change counted as a regression")
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    with open(args.baseline) as baseline, open(args.current) as current:
+        sys.exit(1 if compare(json.load(baseline), json.load(current), args.threshold) else 0)
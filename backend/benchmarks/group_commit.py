@@ -0,0 +1,75 @@
+import argparse
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+
+import httpx
+
+from app.core.config import settings
+from app.core.db import engine
+from app.core.group_commit import check_committer
+from app.core.security import create_access_token
+from app.main import app
+from benchmarks.run import QueryCounter, create_request, git_commit, pick_user, run_scenario
+
+# Burst of /check/create requests written one transaction per request, then again in group commit mode.
+# Reports both runs and the throughput gain, against a seeded database like benchmarks.run.
+
+
+async def main(args: argparse.Namespace):
+    settings.RATE_LIMIT_PER_SECOND = 0
+    user_id, check_ids = await pick_user()
+    token = create_access_token(user_id, timedelta(hours=1))
+    transport = httpx.ASGITransport(app=app)
+    counter = QueryCounter()
+    check_committer.max_batch = args.max_batch
+    check_committer.max_linger = args.max_linger_ms / 1000
+
+    results = {}
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://benchmark", headers={"Authorization": f"Bearer {token}"}, timeout=60
+    ) as client:
+        for mode, enabled in [("per-request", False), ("group-commit", True)]:
+            settings.GROUP_COMMIT_ENABLED = enabled
+            await run_scenario(client, create_request, check_ids, args.concurrency, args.concurrency, args.seed, None)
+            results[mode] = await run_scenario(
+                client, create_request, check_ids, args.requests, args.concurrency, args.seed, counter
+            )
+            print(mode, json.dumps(results[mode]))
+    await check_committer.stop()
+
+    gain = results["group-commit"]["throughput_rps"] / results["per-request"]["throughput_rps"]
+    print(f"throughput gain: x{gain:.2f}")
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "mode": "in-process",
+        "config": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "seed": args.seed,
+            "max_batch": args.max_batch,
+            "max_linger_ms": args.max_linger_ms,
+        },
+        "results": results,
+        "throughput_gain": round(gain, 2),
+    }
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+    await engine.dispose()
+
+
+parser = argparse.ArgumentParser(
+    prog="python -m benchmarks.group_commit", description="Compare per-request and group commit check creation"
+)
+parser.add_argument("--requests", type=int, default=2000, help="measured requests per mode")
+parser.add_argument("--concurrency", type=int, default=64)
+parser.add_argument("--seed", type=int, default=0)
+parser.add_argument("--max-batch", type=int, default=settings.GROUP_COMMIT_MAX_BATCH)
+parser.add_argument("--max-linger-ms", type=float, default=settings.GROUP_COMMIT_MAX_LINGER_MS)
+parser.add_argument("--output", help="write the JSON report to this file")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parser.parse_args()))
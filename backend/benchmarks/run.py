@@ -0,0 +1,198 @@
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import subprocess
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional
+
+import httpx
+from sqlalchemy import event, func, select
+
+from app import models
+from app.core.config import settings
+from app.core.db import engine, get_session
+from app.core.security import create_access_token
+from app.main import app
+from app.seed import CATALOG, PRODUCTS
+
+# Runs the API against a seeded database (python -m app.commands seed) and reports latency percentiles,
+# throughput and DB queries per request for each route. Results are JSON, compare runs with benchmarks.compare.
+# In-process by default through httpx.ASGITransport; --base-url targets a running server instead,
+# queries per request are only counted in process.
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        event.listen(engine.sync_engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+async def pick_user() -> tuple[int, list[str]]:
+    # the heaviest user, whose pages and receipts are the expensive ones
+    async with get_session() as session:
+        checks_count = func.sum(models.CheckDailyRollup.checks_count)
+        result = await session.execute(
+            select(models.CheckDailyRollup.user_id)
+            .group_by(models.CheckDailyRollup.user_id)
+            .order_by(checks_count.desc())
+            .limit(1)
+        )
+        user_id = result.scalar_one_or_none()
+        if user_id is None:
+            raise SystemExit("The database has no checks, run `python -m app.commands seed` first")
+        result = await session.execute(
+            select(models.Check.id)
+            .where(models.Check.user_id == user_id)
+            .order_by(models.Check.created_at.desc())
+            .limit(1000)
+        )
+        return user_id, [str(check_id) for check_id in result.scalars()]
+
+
+def create_request(rng: random.Random, check_ids: list[str]) -> tuple[str, str, dict]:
+    positions = [
+        {"name": rng.choice(CATALOG), "price": round(rng.uniform(1, 200), 2), "quantity": rng.randint(1, 3)}
+        for _ in range(rng.randint(1, 8))
+    ]
+    total = sum(position["price"] * position["quantity"] for position in positions)
+    return "POST", "/api/check/create", {
+        "json": {"positions": positions, "payment": {"type": "cashless", "amount": round(total + 1, 2)}}
+    }
+
+
+def get_all_request(rng: random.Random, check_ids: list[str]) -> tuple[str, str, dict]:
+    date_preset = rng.choice([preset.value for preset in models.DatePreset])
+    return "GET", "/api/check/get-all", {"params": {"date_preset": date_preset, "limit": 100}}
+
+
+def get_text_request(rng: random.Random, check_ids: list[str]) -> tuple[str, str, dict]:
+    return "GET", "/api/check/get-text", {"params": {"check_id": rng.choice(check_ids)}}
+
+
+def search_request(rng: random.Random, check_ids: list[str]) -> tuple[str, str, dict]:
+    mode = rng.choice([mode.value for mode in models.SearchMode])
+    return "GET", "/api/check/search", {"params": {"q": rng.choice(PRODUCTS), "mode": mode, "limit": 20}}
+
+
+def top_products_request(rng: random.Random, check_ids: list[str]) -> tuple[str, str, dict]:
+    date_preset = rng.choice([preset.value for preset in models.DatePreset])
+    order_by = rng.choice([order.value for order in models.ProductOrder])
+    return "GET", "/api/analytics/products", {"params": {"date_preset": date_preset, "order_by": order_by}}
+
+
+SCENARIOS: dict[str, Callable] = {
+    "create": create_request,
+    "get-all": get_all_request,
+    "get-text": get_text_request,
+    "search": search_request,
+    "top-products": top_products_request,
+}
+
+
+def percentile(latencies: list[float], q: float) -> float:
+    return round(statistics.quantiles(latencies, n=100, method="inclusive")[q - 1] * 1000, 3)
+
+
+async def run_scenario(
+        client: httpx.AsyncClient,
+        make_request: Callable,
+        check_ids: list[str],
+        requests: int,
+        concurrency: int,
+        seed: int,
+        counter: Optional[QueryCounter],
+    ) -> dict:
+    rng = random.Random(seed)
+    planned = [make_request(rng, check_ids) for _ in range(requests)]
+    latencies = []
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        while planned:
+            method, url, kwargs = planned.pop()
+            start = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            latencies.append(time.perf_counter() - start)
+            # 404 is a legitimate answer for an empty get-all page
+            if response.status_code >= 400 and response.status_code != 404:
+                errors += 1
+
+    queries_before = counter.count if counter else 0
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "requests": requests,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(requests / elapsed, 1),
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "queries_per_request": round((counter.count - queries_before) / requests, 2) if counter else None,
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main(args: argparse.Namespace):
+    # one user drives all the load, in process it isn't rate limited (a running server has to be configured so)
+    settings.RATE_LIMIT_PER_SECOND = 0
+    user_id, check_ids = await pick_user()
+    token = create_access_token(user_id, timedelta(hours=1))
+    headers = {"Authorization": f"Bearer {token}"}
+
+    if args.base_url:
+        transport, base_url, counter = None, args.base_url, None
+    else:
+        transport, base_url, counter = httpx.ASGITransport(app=app), "http://benchmark", QueryCounter()
+
+    results = {}
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, headers=headers, timeout=60) as client:
+        for name in args.scenarios:
+            # warm up caches and pools so the first measured requests aren't paying for connection setup
+            await run_scenario(client, SCENARIOS[name], check_ids, args.concurrency, args.concurrency, args.seed, None)
+            results[name] = await run_scenario(
+                client, SCENARIOS[name], check_ids, args.requests, args.concurrency, args.seed, counter
+            )
+            print(name, json.dumps(results[name]))
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "mode": "http" if args.base_url else "in-process",
+        "config": {"requests": args.requests, "concurrency": args.concurrency, "seed": args.seed},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+    await engine.dispose()
+
+
+parser = argparse.ArgumentParser(prog="python -m benchmarks.run", description="Benchmark the check API")
+parser.add_argument("--requests", type=int, default=1000, help="measured requests per scenario")
+parser.add_argument("--concurrency", type=int, default=16)
+parser.add_argument("--seed", type=int, default=0)
+parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+parser.add_argument("--base-url", help="benchmark a running server instead of the app in process")
+parser.add_argument("--output", help="write the JSON report to this file")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parser.parse_args()))
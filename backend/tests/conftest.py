@@ -0,0 +1,34 @@
+import os
+
+# settings are read on import, tests that don't touch the database only need them to be present
+for name, value in {
+    "SECRET_KEY": "test",
+    "POSTGRES_USER": "postgres",
+    "POSTGRES_PASSWORD": "postgres",
+    "POSTGRES_DB": "checkbox",
+    "POSTGRES_PORT": "5432",
+}.items():
+    os.environ.setdefault(name, value)
+
+
+import pytest  # noqa: E402
+
+from app.core import admission, cache  # noqa: E402
+
+
+class Clock:
+    # Stands in for a module's time, tests move now forward
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    # cache expiry and token buckets, the event loop keeps the real time
+    clock = Clock()
+    monkeypatch.setattr(cache, "time", clock)
+    monkeypatch.setattr(admission, "time", clock)
+    return clock
@@ -0,0 +1,80 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import Depends, FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+
+from app.api.deps import admit
+from app.core.admission import (
+    AdmissionController, AdmissionMiddleware, ConcurrencyLimit, MemoryRateLimitBackend, admission,
+)
+
+
+async def test_bucket_allows_burst_then_refills(clock):
+    backend = MemoryRateLimitBackend()
+    assert [await backend.take("user:1", rate=2, burst=3) for _ in range(3)] == [0, 0, 0]
+    assert await backend.take("user:1", rate=2, burst=3) == pytest.approx(0.5)
+    # other keys have their own bucket
+    assert await backend.take("user:2", rate=2, burst=3) == 0
+    clock.now += 0.5
+    assert await backend.take("user:1", rate=2, burst=3) == 0
+    assert await backend.take("user:1", rate=2, burst=3) == pytest.approx(0.5)
+
+
+async def test_bucket_refills_up_to_burst(clock):
+    backend = MemoryRateLimitBackend()
+    await backend.take("user:1", rate=1, burst=2)
+    clock.now += 3600
+    assert [await backend.take("user:1", rate=1, burst=2) for _ in range(3)] == [0, 0, pytest.approx(1)]
+
+
+async def test_rate_limit_answers_429_with_retry_after(clock):
+    controller = AdmissionController(MemoryRateLimitBackend())
+    async with controller.admit("write", "user:1", rate=0.5, burst=1):
+        pass
+    with pytest.raises(HTTPException) as raised:
+        async with controller.admit("write", "user:1", rate=0.5, burst=1):
+            pass
+    assert raised.value.status_code == 429
+    assert raised.value.headers["Retry-After"] == "2"
+
+
+async def test_concurrency_limit_sheds_past_the_queue():
+    limit = ConcurrencyLimit("test", limit=1, max_queue=1, queue_timeout=0.05)
+    async with limit.slot():
+        waiting = asyncio.create_task(limit.slot().__aenter__())
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as raised:
+            async with limit.slot():
+                pass
+        assert raised.value.status_code == 503
+        with pytest.raises(HTTPException):
+            await waiting
+    assert limit.waiting == 0
+    async with limit.slot():
+        pass
+
+
+async def test_streamed_response_holds_its_slot_until_sent():
+    limit = admission.limits["read"]
+    free = limit._semaphore._value
+    during = []
+
+    async def body():
+        for chunk in (b"a", b"b"):
+            during.append(limit._semaphore._value)
+            yield chunk
+
+    app = FastAPI()
+    app.add_middleware(AdmissionMiddleware)
+
+    @app.get("/stream", dependencies=[Depends(admit)])
+    async def stream():
+        return StreamingResponse(body())
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        assert (await client.get("/stream")).content == b"ab"
+    assert during == [free - 1, free - 1]
+    assert limit._semaphore._value == free
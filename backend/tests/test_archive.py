@@ -0,0 +1,72 @@
+import json
+import os
+import time
+from datetime import date, datetime
+from pathlib import Path
+
+import pytest
+
+from app import archive
+from app.core.config import settings
+from app.utils import uuid7
+
+
+@pytest.fixture
+def archive_dir(tmp_path, monkeypatch) -> Path:
+    monkeypatch.setattr(settings, "ARCHIVE_DIR", str(tmp_path))
+    monkeypatch.setattr(archive, "BLOCK_SIZE", 3)
+    archive._load_index.cache_clear()
+    return tmp_path
+
+
+async def write(month: date, ids: list) -> None:
+    async def batches():
+        yield [json.dumps({"id": str(check_id), "total": 1.0}) for check_id in sorted(ids)]
+
+    await archive.write_month(month, batches())
+
+
+def age(directory: Path):
+    # as if the archives were written a while ago, a fresh mtime is never trusted
+    past = time.time() - 60
+    os.utime(directory, (past, past))
+
+
+async def test_find_check_in_archive(archive_dir):
+    ids = [uuid7(datetime(2025, 1, day, 12)) for day in range(1, 11)]
+    await write(date(2025, 1, 1), ids)
+    assert archive.archived_months() == [date(2025, 1, 1)]
+    for check_id in ids:
+        assert archive.find_check(check_id)["id"] == str(check_id)
+    assert archive.find_check(uuid7(datetime(2025, 1, 5, 13))) is None
+    assert archive.find_check(uuid7(datetime(2025, 2, 5))) is None
+
+
+async def test_misses_dont_list_the_directory(archive_dir, monkeypatch):
+    await write(date(2025, 1, 1), [uuid7(datetime(2025, 1, 2))])
+    age(archive_dir)
+    archive.archived_months()
+    listings = []
+    glob = Path.glob
+    monkeypatch.setattr(Path, "glob", lambda self, pattern: listings.append(pattern) or glob(self, pattern))
+    for _ in range(3):
+        assert archive.find_check(uuid7(datetime(2025, 3, 1))) is None
+    assert listings == []
+
+    # archiving forgets the listing
+    february = uuid7(datetime(2025, 2, 3))
+    await write(date(2025, 2, 1), [february])
+    assert archive.find_check(february) is not None
+    assert len(listings) == 1
+
+
+async def test_archives_from_other_processes_are_seen(archive_dir):
+    await write(date(2025, 1, 1), [uuid7(datetime(2025, 1, 2))])
+    age(archive_dir)
+    assert archive.archived_months() == [date(2025, 1, 1)]
+    # another container writes to the shared directory, this process's listing isn't reset
+    listing = archive._listing
+    march = uuid7(datetime(2025, 3, 3))
+    await write(date(2025, 3, 1), [march])
+    archive._listing = listing
+    assert archive.find_check(march) is not None
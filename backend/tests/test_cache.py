@@ -0,0 +1,59 @@
+from app.core.cache import ByteLRUCache, TTLCache
+
+
+def test_ttl_cache_expires_entries(clock):
+    entries = TTLCache("test_expiry", maxsize=10, ttl=5)
+    entries.set("a", 1)
+    clock.now += 4.9
+    assert entries.get("a") == 1
+    clock.now += 0.1
+    assert entries.get("a") is None
+
+
+def test_ttl_cache_caps_ttl(clock):
+    entries = TTLCache("test_cap", maxsize=10, ttl=5)
+    entries.set("short", 1, ttl=1)
+    entries.set("long", 2, ttl=60)
+    entries.set("expired", 3, ttl=0)
+    clock.now += 2
+    assert entries.get("short") is None
+    assert entries.get("long") == 2
+    clock.now += 3
+    assert entries.get("long") is None
+    assert entries.get("expired") is None
+
+
+def test_ttl_cache_evicts_least_recently_used(clock):
+    entries = TTLCache("test_lru", maxsize=2, ttl=60)
+    entries.set("a", 1)
+    entries.set("b", 2)
+    assert entries.get("a") == 1
+    entries.set("c", 3)
+    assert entries.get("b") is None
+    assert entries.get("a") == 1
+    assert entries.get("c") == 3
+    entries.invalidate("a")
+    assert entries.get("a") is None
+
+
+def test_byte_cache_bounded_by_size():
+    entries = ByteLRUCache("test_bytes", maxbytes=10)
+    entries.set("a", "aaaa", 4)
+    entries.set("b", "bbbb", 4)
+    entries.get("a")
+    entries.set("c", "cccc", 4)
+    assert entries.get("b") is None
+    assert entries.get("a") == "aaaa"
+    assert entries.size == 8
+
+
+def test_byte_cache_replaces_and_skips_oversized():
+    entries = ByteLRUCache("test_replace", maxbytes=10)
+    entries.set("a", "aaaa", 4)
+    entries.set("a", "aa", 2)
+    assert entries.size == 2
+    entries.set("big", "x" * 11, 11)
+    assert entries.get("big") is None
+    assert entries.get("a") == "aa"
+    entries.clear()
+    assert entries.size == 0
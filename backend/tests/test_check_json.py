@@ -0,0 +1,47 @@
+import asyncio
+import json
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+
+from app import crud, models
+from app.core import db
+from app.core.migrations import migrate
+from app.core.partitions import ensure_partitions
+from app.utils import uuid7
+
+
+@pytest.fixture
+async def database():
+    try:
+        async with db.engine.connect():
+            pass
+    except (OSError, db.DBAPIError, asyncio.TimeoutError) as e:
+        await db.engine.dispose()
+        pytest.skip(f"PostgreSQL unavailable: {e}")
+    await migrate()
+    yield
+    await db.engine.dispose()
+
+
+async def test_check_json_matches_the_pydantic_serialization(database):
+    # a fraction with trailing zeros and integral amounts, the values Postgres writes differently
+    created_at = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=120000)
+    await ensure_partitions(created_at.date(), created_at.date())
+    [user_id] = await crud.create_users(["Check json"], [f"check-json-{uuid.uuid4().hex}"], "password")
+    check_id = uuid7(created_at)
+    check = models.Check(id=check_id, total=7.0, rest=3.0, created_at=created_at, user_id=user_id)
+    check.positions = [
+        models.Position(
+            name=name, price=price, quantity=2, total=price * 2, check_id=check_id, check_created_at=created_at
+        )
+        for name, price in [("Milk", 2.0), ("Bread", 1.5)]
+    ]
+    check.payment = models.Payment(type="cash", amount=10.0, check_id=check_id, check_created_at=created_at)
+    await crud.create_check(check)
+
+    check_json = await crud.get_check_json_by_id(check_id)
+    expected = models.CheckResponse.model_validate(check)
+    assert list(json.loads(check_json)) == list(json.loads(expected.model_dump_json()))
+    assert models.CheckResponse.model_validate_json(check_json) == expected
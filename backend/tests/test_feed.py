@@ -0,0 +1,49 @@
+from datetime import datetime
+import json
+
+from fastapi import Request
+
+from app.api.routes import feed
+from app.core.cache import USERS_CHANNEL, receipt_cache, user_cache
+from app.core.config import settings
+from app.core.feed import check_feed
+from app.models import UserPublic
+
+
+async def test_stream_subscribes_only_while_its_body_runs(monkeypatch):
+    async def get_user_by_token(token):
+        now = datetime.now()
+        return UserPublic(id=1, name="Test", login="test", is_active=True, created_at=now, updated_at=now)
+
+    monkeypatch.setattr(feed, "get_user_by_token", get_user_by_token)
+    monkeypatch.setattr(settings, "FEED_HEARTBEAT_SECONDS", 0.01)
+    request = Request({"type": "http", "method": "GET", "path": "/api/check/stream", "headers": []})
+    subscribers = check_feed.subscribers
+
+    # the client went away before the body started, nothing to release
+    response = await feed.stream_checks(request, cursor=None, token="token", last_event_id=None)
+    assert check_feed.subscribers == subscribers
+    await response.body_iterator.aclose()
+    assert check_feed.subscribers == subscribers
+
+    response = await feed.stream_checks(request, cursor=None, token="token", last_event_id=None)
+    assert await anext(response.body_iterator) == ": heartbeat\n\n"
+    assert check_feed.subscribers == subscribers + 1
+    await response.body_iterator.aclose()
+    assert check_feed.subscribers == subscribers
+
+
+def test_user_changes_reach_every_worker_cache():
+    user_cache.set(1, "user 1")
+    user_cache.set(2, "user 2")
+    receipt_cache.set("receipt", ("text", "etag"), size=4)
+
+    check_feed._on_user_changed(None, 0, USERS_CHANNEL, json.dumps([1, False]))
+    assert user_cache.get(1) is None
+    assert user_cache.get(2) == "user 2"
+    assert receipt_cache.get("receipt") is not None
+
+    # a rename changes every receipt of the user
+    check_feed._on_user_changed(None, 0, USERS_CHANNEL, json.dumps([2, True]))
+    assert user_cache.get(2) is None
+    assert receipt_cache.get("receipt") is None
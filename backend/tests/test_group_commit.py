@@ -0,0 +1,42 @@
+import asyncio
+
+from app.core.group_commit import GroupCommitter
+
+
+async def test_stop_finishes_the_batch_being_written():
+    batches, started = [], asyncio.Event()
+
+    async def flush(items):
+        started.set()
+        await asyncio.sleep(0.05)
+        batches.append(items)
+        return [item * 2 for item in items]
+
+    committer = GroupCommitter(flush, max_batch=2, max_linger=0.01)
+    submitted = [asyncio.create_task(committer.submit(item)) for item in range(5)]
+    await started.wait()
+    await committer.stop()
+    assert all(task.done() for task in submitted)
+    assert [task.result() for task in submitted] == [0, 2, 4, 6, 8]
+    assert sorted(item for batch in batches for item in batch) == list(range(5))
+
+
+async def test_stop_while_lingering_writes_the_batch():
+    committer = GroupCommitter(lambda items: asyncio.sleep(0, items), max_batch=10, max_linger=60)
+    submitted = asyncio.create_task(committer.submit("check"))
+    await asyncio.sleep(0.01)
+    await asyncio.wait_for(committer.stop(), 1)
+    assert submitted.result() == "check"
+
+
+async def test_one_bad_item_fails_alone():
+    async def flush(items):
+        if "bad" in items:
+            raise ValueError("bad item")
+        return items
+
+    committer = GroupCommitter(flush, max_batch=3, max_linger=0.01)
+    results = await asyncio.gather(*(committer.submit(item) for item in ["a", "bad", "b"]), return_exceptions=True)
+    await committer.stop()
+    assert results[0] == "a" and results[2] == "b"
+    assert isinstance(results[1], ValueError)
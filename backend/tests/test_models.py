@@ -0,0 +1,22 @@
+import pytest
+from pydantic import ValidationError
+
+from app.models import POSITION_NAME_MAX_LENGTH, CheckRequest, PositionResponse
+
+
+def check_request(name: str) -> dict:
+    return {
+        "positions": [{"name": name, "price": 1.5, "quantity": 2}],
+        "payment": {"type": "cash", "amount": 3},
+    }
+
+
+def test_position_name_is_bounded():
+    CheckRequest.model_validate(check_request("ж" * POSITION_NAME_MAX_LENGTH))
+    with pytest.raises(ValidationError):
+        CheckRequest.model_validate(check_request("ж" * (POSITION_NAME_MAX_LENGTH + 1)))
+
+
+def test_longer_stored_names_are_still_returned():
+    name = "ж" * (POSITION_NAME_MAX_LENGTH + 1)
+    assert PositionResponse(name=name, price=1.5, quantity=2, total=3).name == name
@@ -0,0 +1,41 @@
+import asyncio
+
+import pytest
+
+from app import crud
+from app.core import db
+from app.core.migrations import migrate
+
+# index each query has to use, partition indexes by their partitioned table's index
+EXPECTED_INDEXES = {
+    "get_all_users_checks": {"ix_checks_user_id_created_at_id"},
+    "get_all_users_checks_json": {"ix_checks_user_id_created_at_id"},
+    "search_users_positions": {"ix_positions_check_id_id"},
+    "get_check_by_id": {"checks_pkey"},
+    "positions_by_check_id": {"ix_positions_check_id_id"},
+    "get_check_positions": {"ix_positions_check_id_id"},
+    "payment_by_check_id": {"ix_payments_check_id"},
+    "get_user_by_login": {"ux_users_login"},
+    "get_users_top_products": {"product_daily_rollups_pkey", "product_monthly_rollups_pkey"},
+}
+
+
+@pytest.fixture
+async def database():
+    # the database the app is configured with, migrated like on startup
+    try:
+        async with db.engine.connect():
+            pass
+    except (OSError, db.DBAPIError, asyncio.TimeoutError) as e:
+        await db.engine.dispose()
+        pytest.skip(f"PostgreSQL unavailable: {e}")
+    await migrate()
+    yield
+    await db.engine.dispose()
+
+
+async def test_main_queries_use_their_indexes(database):
+    plans = await crud.explain_main_queries()
+    assert {name: plan["seq_scans"] for name, plan in plans.items() if plan["seq_scans"]} == {}
+    for name, indexes in EXPECTED_INDEXES.items():
+        assert indexes <= set(plans[name]["indexes"]), name
@@ -0,0 +1,78 @@
+from datetime import datetime
+
+import httpx
+import pytest
+
+from app import crud, models
+from app.core.cache import receipt_cache
+from app.main import app
+from app.utils import uuid7
+
+CREATED_AT = datetime(2025, 5, 17, 12, 30)
+CHECK_ID = uuid7(CREATED_AT)
+
+
+@pytest.fixture
+def user():
+    return models.User(
+        id=1, name="Олена", login="olena", password="-", is_active=True, created_at=CREATED_AT, updated_at=CREATED_AT
+    )
+
+
+@pytest.fixture
+def loads(monkeypatch, user) -> list[str]:
+    # what the route asked the database for
+    loads = []
+
+    async def get_check_by_id(check_id, user_id=None):
+        loads.append("check")
+        check = models.Check(id=check_id, total=10, rest=0, created_at=CREATED_AT, user_id=user.id)
+        check.user = user
+        check.positions = [models.Position(name="Хліб", price=10, quantity=1, total=10)]
+        check.payment = models.Payment(type="cash", amount=10)
+        return check
+
+    async def get_receipt_version(check_id):
+        loads.append("version")
+        return user.updated_at
+
+    monkeypatch.setattr(crud, "get_check_by_id", get_check_by_id)
+    monkeypatch.setattr(crud, "get_receipt_version", get_receipt_version)
+    receipt_cache.clear()
+    yield loads
+    receipt_cache.clear()
+
+
+async def get_text(etag=None) -> httpx.Response:
+    headers = {"If-None-Match": etag} if etag else {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        return await client.get("/api/check/get-text", params={"check_id": str(CHECK_ID)}, headers=headers)
+
+
+async def test_receipt_revalidation(loads, user):
+    response = await get_text()
+    assert response.status_code == 200
+    assert "Олена" in response.text
+    assert response.headers["Cache-Control"] == "private, no-cache"
+    etag = response.headers["ETag"]
+    assert etag.startswith("W/")
+    assert loads == ["check"]
+
+    # cached: no database at all
+    assert (await get_text(etag)).status_code == 304
+    assert loads == ["check"]
+
+    # another worker: the user's updated_at only
+    receipt_cache.clear()
+    assert (await get_text(etag)).status_code == 304
+    assert loads == ["check", "version"]
+
+    # renamed: the receipt is rendered again under a new ETag
+    receipt_cache.clear()
+    user.name, user.updated_at = "Олена Коваль", datetime(2025, 6, 1)
+    response = await get_text(etag)
+    assert response.status_code == 200
+    assert "Олена Коваль" in response.text
+    assert response.headers["ETag"] != etag
+    assert loads == ["check", "version", "version", "check"]
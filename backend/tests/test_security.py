@@ -0,0 +1,25 @@
+import pytest
+
+from app.core import security
+from app.core.security import PasswordHasher
+
+
+@pytest.fixture
+async def hasher(monkeypatch):
+    hasher = PasswordHasher(pool_size=2, queue_limit=4)
+    await hasher.start()
+    monkeypatch.setattr(security, "password_hasher", hasher)
+    yield hasher
+    hasher.shutdown()
+
+
+async def test_hashes_in_a_forkserver_pool(hasher):
+    assert hasher._pool._mp_context.get_start_method() in ("forkserver", "spawn")
+    hashed = await security.get_password_hash("secret")
+    assert (await security.verify_password("secret", hashed))[0]
+    assert not (await security.verify_password("wrong", hashed))[0]
+
+
+async def test_not_started():
+    with pytest.raises(RuntimeError):
+        await PasswordHasher(pool_size=1, queue_limit=1).run(security._ready)
@@ -0,0 +1,43 @@
+import uuid
+from datetime import datetime
+
+import pytest
+
+from app.core.compression import accepted_encodings
+from app.utils import decode_cursor, encode_cursor, parse_timestamp
+
+
+def test_cursor_round_trip():
+    created_at, check_id = datetime(2025, 5, 17, 12, 30, 1, 250), uuid.uuid4()
+    cursor = encode_cursor(created_at, check_id)
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == (created_at, check_id)
+
+
+@pytest.mark.parametrize("cursor", ["", "not a cursor", encode_cursor(datetime.now(), uuid.uuid4())[:-3], "WzFd"])
+def test_malformed_cursor(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("", set()),
+    ("gzip", {"gzip"}),
+    ("gzip, deflate, br", {"gzip", "deflate", "br"}),
+    ("BR;q=1.0, gzip;q=0.5", {"br", "gzip"}),
+    ("br;q=0, gzip", {"gzip"}),
+    ("gzip;q=0.000", set()),
+    ("br;q=oops", {"br"}),
+])
+def test_accepted_encodings(header, expected):
+    assert accepted_encodings(header) - {""} == expected
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("2025-05-17T12:34:56.123456", datetime(2025, 5, 17, 12, 34, 56, 123456)),
+    ("2025-05-17T12:34:56.12345", datetime(2025, 5, 17, 12, 34, 56, 123450)),
+    ("2025-05-17T12:34:56.1", datetime(2025, 5, 17, 12, 34, 56, 100000)),
+    ("2025-05-17T12:34:56", datetime(2025, 5, 17, 12, 34, 56)),
+])
+def test_parse_timestamp_with_trimmed_fraction(value, expected):
+    assert parse_timestamp(value) == expected
@@ -0,0 +1,35 @@
+import io
+import zipfile
+from datetime import datetime
+
+from app import zipstream
+from app.zipstream import ZipStream
+
+
+def build(members: dict[str, bytes], modified: datetime) -> bytes:
+    archive = ZipStream()
+    chunks = [archive.add(name, data, modified) for name, data in members.items()]
+    return b"".join(chunks) + b"".join(archive.close())
+
+
+def test_archive_reads_back():
+    members = {"receipt.txt": b"total 10.00\n" * 100, "чек.txt": "Дякуємо".encode(), "empty.txt": b""}
+    modified = datetime(2025, 5, 17, 12, 30, 15)
+    with zipfile.ZipFile(io.BytesIO(build(members, modified))) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == list(members)
+        for name, data in members.items():
+            assert archive.read(name) == data
+        assert archive.getinfo("receipt.txt").date_time == (2025, 5, 17, 12, 30, 14)
+        assert archive.getinfo("receipt.txt").compress_type == zipfile.ZIP_DEFLATED
+
+
+def test_zip64_end_records(monkeypatch):
+    # past the classic member count the zip64 end records carry it
+    monkeypatch.setattr(zipstream, "ZIP64_COUNT_LIMIT", 3)
+    members = {f"{number}.txt": str(number).encode() for number in range(5)}
+    data = build(members, datetime(2025, 1, 1))
+    assert b"PK\x06\x06" in data
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.namelist() == list(members)
+        assert archive.read("4.txt") == b"4"